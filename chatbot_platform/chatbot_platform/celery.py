@@ -0,0 +1,15 @@
+# chatbot_platform/celery.py
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatbot_platform.settings.dev')  # or 'prod'
+
+app = Celery('chatbot_platform')
+
+# All celery settings live in Django settings with a CELERY_ prefix
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Picks up tasks.py from every installed app (core/tasks.py)
+app.autodiscover_tasks()
@@ -1,5 +1,6 @@
 #settings/base.py
 import os
+import tempfile
 from pathlib import Path
 from decouple import config
 import logging
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
     'core',
     'webapp',
     'storages',
+    'django_celery_results',
 ]
 
 MIDDLEWARE = [
@@ -85,6 +87,13 @@ USE_GCS = False
 # GS_BUCKET_NAME = config("GS_BUCKET_NAME", default="chatbot-api-platform")
 
 GS_PROJECT_ID = config("GS_PROJECT_ID", default="None")
+# Vector store transfers (core/utils/vector/blob_storage.py). Point STORAGE_EMULATOR_HOST at a fake GCS
+# server, or set GCS_LOCAL_ROOT to a directory to stand in for the bucket, to exercise the GCS paths locally.
+GCS_LOCAL_ROOT = config("GCS_LOCAL_ROOT", default="")
+GCS_TRANSFER_WORKERS = config("GCS_TRANSFER_WORKERS", default=4, cast=int)
+GCS_RESUMABLE_THRESHOLD_MB = config("GCS_RESUMABLE_THRESHOLD_MB", default=8, cast=int)
+GCS_UPLOAD_CHUNK_SIZE_MB = config("GCS_UPLOAD_CHUNK_SIZE_MB", default=8, cast=int)
+GCS_SLICED_DOWNLOAD_THRESHOLD_MB = config("GCS_SLICED_DOWNLOAD_THRESHOLD_MB", default=64, cast=int)
 if USE_GCS:
     DEFAULT_FILE_STORAGE = 'storages.backends.gcloud.GoogleCloudStorage'
     GS_DEFAULT_ACL = 'publicRead'
@@ -140,8 +149,124 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 #===
 
 
+# --- Embedding model settings ---
+# The model is loaded once per worker process (see core/utils/embeddings/embedding_service.py).
+EMBEDDING_MODEL_NAME = config("EMBEDDING_MODEL_NAME", default="all-MiniLM-L6-v2")
+EMBEDDING_PRELOAD_MODELS = [EMBEDDING_MODEL_NAME]
+EMBEDDING_BATCH_SIZE = config("EMBEDDING_BATCH_SIZE", default=64, cast=int)
+# "torch" (sentence-transformers), or "onnx" / "onnx_int8" to run the model with ONNX Runtime (fp32 / int8-quantized weights;
+# core/utils/embeddings/onnx_encoder.py). Export it first with: python manage.py export_onnx_model
+# Falls back to "torch" if the export is missing. EMBEDDING_ONNX_THREADS = 0 lets ONNX Runtime pick.
+EMBEDDING_BACKEND = config("EMBEDDING_BACKEND", default="torch")
+EMBEDDING_ONNX_DIR = config("EMBEDDING_ONNX_DIR", default="")
+EMBEDDING_ONNX_THREADS = config("EMBEDDING_ONNX_THREADS", default=0, cast=int)
+# Optional embedding server (core/utils/embeddings/embedding_server.py, run with: python manage.py embedding_server, or
+# EMBEDDING_SERVER_AUTOSTART=true in gunicorn's environment): one process on the machine loads the model and every worker
+# sends its encode calls over this Unix socket. Empty = each process loads its own model. Workers encode in-process while
+# the server is unreachable and try it again after EMBEDDING_SERVER_RETRY_SECONDS.
+EMBEDDING_SERVER_SOCKET = config("EMBEDDING_SERVER_SOCKET", default="")
+EMBEDDING_SERVER_TIMEOUT_SECONDS = config("EMBEDDING_SERVER_TIMEOUT_SECONDS", default=60, cast=float)
+EMBEDDING_SERVER_RETRY_SECONDS = config("EMBEDDING_SERVER_RETRY_SECONDS", default=30, cast=float)
+# Chat queries from all workers queued on the server are encoded together, up to this many / after this wait
+EMBEDDING_SERVER_MAX_BATCH_SIZE = config("EMBEDDING_SERVER_MAX_BATCH_SIZE", default=64, cast=int)
+EMBEDDING_SERVER_MAX_WAIT_MS = config("EMBEDDING_SERVER_MAX_WAIT_MS", default=5, cast=int)
+# Chat queries are micro-batched across concurrent requests (core/utils/embeddings/query_encoder.py):
+# a batch is encoded once it has QUERY_ENCODER_MAX_BATCH_SIZE queries or its first query waited QUERY_ENCODER_MAX_WAIT_MS
+QUERY_ENCODER_MAX_BATCH_SIZE = config("QUERY_ENCODER_MAX_BATCH_SIZE", default=32, cast=int)
+QUERY_ENCODER_MAX_WAIT_MS = config("QUERY_ENCODER_MAX_WAIT_MS", default=5, cast=int)
+# Recent query vectors kept per model (normalized query text -> vector)
+QUERY_ENCODER_CACHE_SIZE = config("QUERY_ENCODER_CACHE_SIZE", default=2048, cast=int)
+
+# --- Celery (background embedding jobs, see core/tasks.py) ---
+# e.g. redis://<host>:6379/0. Queued jobs only run if a worker (celery -A chatbot_platform worker) consumes this broker.
+CELERY_BROKER_URL = config("CELERY_BROKER_URL", default="")
+CELERY_RESULT_BACKEND = "django-db"
+CELERY_TASK_TRACK_STARTED = True
+# Run tasks inline in the web process (no broker/worker needed). The default until a broker is configured, so a
+# deployment without one keeps embedding in the request instead of queueing jobs nothing will run.
+CELERY_TASK_ALWAYS_EAGER = config("CELERY_TASK_ALWAYS_EAGER", default=not CELERY_BROKER_URL, cast=bool)
+# One long embedding job at a time per worker process; don't prefetch others behind it
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# --- Text extraction (core/utils/file_reader.py) ---
+# PDFs with at least this many pages are extracted by a process pool; smaller ones stay serial
+PDF_PARALLEL_PAGE_THRESHOLD = config("PDF_PARALLEL_PAGE_THRESHOLD", default=50, cast=int)
+# 0 = min(4, CPU count)
+PDF_EXTRACTION_WORKERS = config("PDF_EXTRACTION_WORKERS", default=0, cast=int)
+
+# --- Chunking settings (core/utils/chunking/text_chunker.py) ---
+# Sizes are in whitespace-separated words; keep CHUNK_SIZE_TOKENS under the model's input limit
+CHUNK_SIZE_TOKENS = config("CHUNK_SIZE_TOKENS", default=180, cast=int)
+CHUNK_OVERLAP_TOKENS = config("CHUNK_OVERLAP_TOKENS", default=30, cast=int)
+
+# --- Vector store settings ---
+# Where chunks and vectors are stored (core/utils/vector/vector_store.py): "faiss" (index files per KB on local disk or GCS),
+# "faiss_sharded" (KBs packed into VECTOR_SHARD_COUNT shared FAISS indexes; move existing KBs with manage.py compact_vector_shards)
+# or "pgvector" (rows in PostgreSQL with the pgvector extension; needs USE_CLOUD_DB / a Postgres PGVECTOR_DB_ALIAS)
+VECTOR_STORE_BACKEND = config("VECTOR_STORE_BACKEND", default="faiss")
+VECTOR_SHARD_COUNT = config("VECTOR_SHARD_COUNT", default=16, cast=int)
+PGVECTOR_DB_ALIAS = config("PGVECTOR_DB_ALIAS", default="default")
+PGVECTOR_EF_SEARCH = config("PGVECTOR_EF_SEARCH", default=64, cast=int)
+# "relaxed_order" keeps filtered HNSW scans going until top_k rows of the KB are found (used with pgvector >= 0.8;
+# older versions, or "off", fall back to an exact scan of the KB whenever the HNSW scan comes back short)
+PGVECTOR_ITERATIVE_SCAN = config("PGVECTOR_ITERATIVE_SCAN", default="relaxed_order")
+# Loaded FAISS indexes + chunk lists are kept in a per-process LRU cache (core/utils/vector/index_cache.py).
+VECTOR_INDEX_CACHE_MAX_BYTES = config("VECTOR_INDEX_CACHE_MAX_BYTES", default=512 * 1024 * 1024, cast=int)
+# How often a cached index is checked against storage (file mtime / GCS generation) for changes made by other workers
+VECTOR_INDEX_CACHE_REVALIDATE_SECONDS = config("VECTOR_INDEX_CACHE_REVALIDATE_SECONDS", default=10, cast=int)
+# With USE_GCS, downloaded index/chunk files are kept on local disk (core/utils/vector/disk_cache.py), keyed by blob
+# generation, so new processes and evicted indexes don't go back to the bucket. Empty dir disables it.
+VECTOR_DISK_CACHE_DIR = config("VECTOR_DISK_CACHE_DIR", default=os.path.join(tempfile.gettempdir(), "vector_store_cache"))
+VECTOR_DISK_CACHE_MAX_BYTES = config("VECTOR_DISK_CACHE_MAX_BYTES", default=2 * 1024 * 1024 * 1024, cast=int)
+# Index type per KB: "auto" picks flat / hnsw / ivfpq by vector count (core/utils/vector/index_factory.py)
+VECTOR_INDEX_TYPE = config("VECTOR_INDEX_TYPE", default="auto")
+VECTOR_INDEX_HNSW_THRESHOLD = config("VECTOR_INDEX_HNSW_THRESHOLD", default=20000, cast=int)
+VECTOR_INDEX_IVFPQ_THRESHOLD = config("VECTOR_INDEX_IVFPQ_THRESHOLD", default=500000, cast=int)
+# Recall vs. latency at query time: IVF lists probed / HNSW candidate list size
+VECTOR_SEARCH_NPROBE = config("VECTOR_SEARCH_NPROBE", default=16, cast=int)
+VECTOR_SEARCH_EF_SEARCH = config("VECTOR_SEARCH_EF_SEARCH", default=64, cast=int)
+# How vectors are stored in new indexes unless the KB picks its own: "none" (float32), "fp16", "sq8" or "pq".
+# Check what it costs in recall with: python manage.py check_vector_recall --kb <id>
+VECTOR_QUANTIZATION = config("VECTOR_QUANTIZATION", default="none")
+# How new indexes compare vectors: "cosine" (normalized vectors, inner-product search) or "l2". Existing indexes keep theirs.
+VECTOR_METRIC = config("VECTOR_METRIC", default="cosine")
+# Chunks less similar than this (cosine, 0..1) to the question are not sent to the LLM; 0 disables the cutoff.
+# 0.2 suits all-MiniLM-L6-v2, where unrelated text scores around 0-0.15.
+RETRIEVAL_MIN_SIMILARITY = config("RETRIEVAL_MIN_SIMILARITY", default=0.2, cast=float)
+# Keyword/hybrid search (per KB, KnowledgeBase.retrieval_mode): hybrid merges the top HYBRID_CANDIDATES
+# dense and BM25 hits with reciprocal-rank fusion, score = sum of 1 / (HYBRID_RRF_K + rank)
+HYBRID_CANDIDATES = config("HYBRID_CANDIDATES", default=20, cast=int)
+HYBRID_RRF_K = config("HYBRID_RRF_K", default=60, cast=int)
+
+
 LOGIN_URL = '/login/'
 X_FRAME_OPTIONS = 'ALLOWALL'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GOOGLE_GENAI_API_KEY = config("GOOGLE_GENAI_API_KEY")
+GENAI_MODEL_NAME = config("GENAI_MODEL_NAME", default="gemini-2.0-flash-001")
+# Retrieved chunks passed to the LLM as context for each chat message
+CHAT_CONTEXT_CHUNKS = config("CHAT_CONTEXT_CHUNKS", default=3, cast=int)
+# Optional rerank stage (core/utils/embeddings/reranker.py): retrieve RERANK_CANDIDATES chunks, score them with this
+# cross-encoder (e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2") and keep the best CHAT_CONTEXT_CHUNKS. Empty = off.
+# If scoring wouldn't finish within RERANK_BUDGET_MS, the retrieval order is kept instead.
+RERANK_MODEL_NAME = config("RERANK_MODEL_NAME", default="")
+RERANK_CANDIDATES = config("RERANK_CANDIDATES", default=20, cast=int)
+RERANK_BATCH_SIZE = config("RERANK_BATCH_SIZE", default=16, cast=int)
+RERANK_BUDGET_MS = config("RERANK_BUDGET_MS", default=150, cast=int)
+
+# --- Chat answer cache (core/utils/cache/response_cache.py) ---
+# "local" (per process), "django" (the CACHES alias below, shared by all workers), a dotted path to a backend class, or "" to disable
+RESPONSE_CACHE_BACKEND = config("RESPONSE_CACHE_BACKEND", default="local")
+RESPONSE_CACHE_ALIAS = config("RESPONSE_CACHE_ALIAS", default="default")
+RESPONSE_CACHE_TTL_SECONDS = config("RESPONSE_CACHE_TTL_SECONDS", default=3600, cast=int)
+# Cosine similarity between question embeddings needed to reuse an answer (same retrieved chunks required too)
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = config("RESPONSE_CACHE_SIMILARITY_THRESHOLD", default=0.95, cast=float)
+RESPONSE_CACHE_MAX_ENTRIES = config("RESPONSE_CACHE_MAX_ENTRIES", default=4096, cast=int)
+
+# --- Metrics (core/utils/metrics.py) ---
+# Per-stage chat/ingestion histograms on /metrics (Prometheus text format), for staff or "Authorization: Bearer <METRICS_TOKEN>".
+# With several gunicorn workers, set the PROMETHEUS_MULTIPROC_DIR environment variable to an empty, writable directory
+# (the same one for Celery workers on the host) so every process's samples are merged into one scrape.
+METRICS_ENABLED = config("METRICS_ENABLED", default=True, cast=bool)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
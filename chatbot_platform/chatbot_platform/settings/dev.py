@@ -10,6 +10,10 @@ ALLOWED_HOSTS = [
 
 USE_GCS = False 
 
+# Without a broker running locally, embed in the request like before. Set to False and start
+# `celery -A chatbot_platform worker` to exercise the real queue.
+CELERY_TASK_ALWAYS_EAGER = config("CELERY_TASK_ALWAYS_EAGER", default=True, cast=bool)
+
 CSRF_TRUSTED_ORIGINS = [
     'https://chatbot-api-platform-29773676777.us-central1.run.app',
 ]
@@ -1,16 +1,24 @@
 from django.contrib import admin
-from .models import  KnowledgeBase, ChatbotWidget
+from .models import  KnowledgeBase, KnowledgeBaseDocument, ChatbotWidget
 
 
 
 @admin.register(KnowledgeBase)
 class KnowledgeBaseAdmin(admin.ModelAdmin):
-    list_display = ('title', 'user', 'created_at', 'is_embedded', 'embedded', 'widget_slug')
+    list_display = ('title', 'user', 'created_at', 'is_embedded', 'embedded', 'embedding_status', 'embedding_progress', 'index_type', 'vector_quantization', 'retrieval_mode', 'widget_slug')
     search_fields = ('title', 'user__username', 'widget_slug')
-    list_filter = ('is_embedded', 'embedded', 'created_at')
+    list_filter = ('is_embedded', 'embedded', 'embedding_status', 'retrieval_mode', 'created_at')
     ordering = ('-created_at',)
 
 
+@admin.register(KnowledgeBaseDocument)
+class KnowledgeBaseDocumentAdmin(admin.ModelAdmin):
+    list_display = ('name', 'knowledge_base', 'is_embedded', 'updated_at')
+    search_fields = ('name', 'knowledge_base__title')
+    list_filter = ('is_embedded',)
+    ordering = ('-updated_at',)
+
+
 @admin.register(ChatbotWidget)
 class ChatbotWidgetAdmin(admin.ModelAdmin):
     list_display = ('name', 'user', 'created_at')
@@ -0,0 +1,175 @@
+# core/management/commands/benchmark.py
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.utils import benchmarking
+from core.utils.embeddings.embedding_service import get_embedding_model
+from core.utils.vector import vector_logic
+from core.utils.vector.index_cache import get_index_cache
+from core.utils.vector.index_factory import INDEX_TYPES, QUANTIZATIONS
+from core.utils.vector.keyword_index import RETRIEVAL_MODES
+
+STAGES = ("extract", "chunk", "embed", "search", "chat")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the ingestion and retrieval hot paths on synthetic knowledge bases: text extraction, "
+        "chunking, embed_and_store, search_similar_chunks and a full chat turn with a stubbed LLM. "
+        "Reports throughput, p50/p95/p99 latency and peak RSS per stage, and can write the results as JSON "
+        "and compare them with an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size", type=int, action="append", dest="sizes",
+            help="Chunks in a synthetic KB (repeatable, default: 1000 and 10000).",
+        )
+        parser.add_argument("--stage", action="append", choices=STAGES, dest="stages", help="Stage to run (repeatable, default: all).")
+        parser.add_argument("--queries", type=int, default=200, help="Queries per search/chat run (default 200).")
+        parser.add_argument("--top-k", type=int, default=3)
+        parser.add_argument("--mode", action="append", choices=RETRIEVAL_MODES, dest="modes", help="Retrieval mode (repeatable, default: dense).")
+        parser.add_argument("--index-type", choices=INDEX_TYPES, help="Force an index type (default: chosen by size).")
+        parser.add_argument("--quantization", choices=QUANTIZATIONS, help="Vector storage (default: VECTOR_QUANTIZATION).")
+        parser.add_argument("--documents", type=int, default=12, help="Files generated for the extract/chunk stages (default 12).")
+        parser.add_argument("--document-words", type=int, default=5000, help="Words per generated file (default 5000).")
+        parser.add_argument(
+            "--model", choices=("real", "hashing"), default="real",
+            help="'real' uses the configured embedding model; 'hashing' a deterministic word-hashing encoder, "
+                 "to time everything except the model.",
+        )
+        parser.add_argument("--llm-latency-ms", type=float, default=0, help="Simulated LLM latency in the chat stage (default 0).")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--compare", help="Earlier --output file to compare with.")
+        parser.add_argument(
+            "--max-regression", type=float, default=10.0,
+            help="With --compare, fail if a throughput, latency or memory metric got worse by more than this percent (default 10).",
+        )
+
+    def handle(self, *args, **options):
+        stages = options["stages"] or list(STAGES)
+        sizes = options["sizes"] or [1000, 10000]
+        modes = options["modes"] or [vector_logic.MODE_DENSE]
+        if options["compare"] and not os.path.exists(options["compare"]):
+            raise CommandError(f"{options['compare']} does not exist.")
+
+        if options["model"] == "hashing":
+            model = benchmarking.HashingEncoder()
+        else:
+            started = time.perf_counter()
+            model = get_embedding_model()
+            self.stdout.write(f"Loaded embedding model in {time.perf_counter() - started:.2f}s")
+
+        corpus = benchmarking.SyntheticCorpus(seed=options["seed"])
+        results = {
+            "environment": benchmarking.environment_info(),
+            "parameters": {
+                key: options[key] for key in (
+                    "queries", "top_k", "index_type", "quantization", "documents", "document_words", "model",
+                    "llm_latency_ms", "seed",
+                )
+            },
+            "settings": {
+                "EMBEDDING_MODEL_NAME": getattr(settings, "EMBEDDING_MODEL_NAME", None),
+                "EMBEDDING_BACKEND": getattr(settings, "EMBEDDING_BACKEND", None),
+                "EMBEDDING_BATCH_SIZE": getattr(settings, "EMBEDDING_BATCH_SIZE", None),
+                "VECTOR_METRIC": getattr(settings, "VECTOR_METRIC", None),
+                "VECTOR_QUANTIZATION": getattr(settings, "VECTOR_QUANTIZATION", None),
+                "RETRIEVAL_MIN_SIMILARITY": getattr(settings, "RETRIEVAL_MIN_SIMILARITY", None),
+            },
+            "stages": {},
+        }
+        results["parameters"].update({"sizes": sizes, "modes": modes})
+
+        # Everything is written under a scratch BASE_DIR on local disk, never to the real stores
+        workdir = Path(tempfile.mkdtemp(prefix="kb_benchmark_"))
+        original_base_dir, original_use_gcs = settings.BASE_DIR, getattr(settings, "USE_GCS", False)
+        settings.BASE_DIR, settings.USE_GCS = workdir, False
+        try:
+            self._run(stages, sizes, modes, model, corpus, workdir, options, results["stages"])
+        finally:
+            settings.BASE_DIR, settings.USE_GCS = original_base_dir, original_use_gcs
+            get_index_cache().clear()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["compare"]:
+            self._compare(results, options["compare"], options["max_regression"])
+
+    def _run(self, stages, sizes, modes, model, corpus, workdir, options, out):
+        if "extract" in stages or "chunk" in stages:
+            documents_dir = workdir / "documents"
+            documents_dir.mkdir()
+            paths = benchmarking.write_synthetic_documents(
+                str(documents_dir), corpus, options["documents"], options["document_words"],
+            )
+            texts, out["extract"] = benchmarking.bench_extraction(paths)
+            self._report("extract", out["extract"])
+            if "chunk" in stages:
+                _, out["chunk"] = benchmarking.bench_chunking(texts, paths)
+                self._report("chunk", out["chunk"])
+
+        if not {"embed", "search", "chat"} & set(stages):
+            return
+        for size in sizes:
+            index_name = f"benchmark_{size}"
+            chunks = corpus.chunks(size, words_per_chunk=getattr(settings, "CHUNK_SIZE_TOKENS", 150))
+            queries = corpus.queries(chunks, max(options["queries"], 2))
+            # Search and chat need an index even when only they are being timed
+            embed = benchmarking.bench_embed_and_store(
+                chunks, index_name, model, index_type=options["index_type"], quantization=options["quantization"],
+            )
+            if "embed" in stages:
+                out[f"embed.{size}"] = embed
+                self._report(f"embed {size}", embed)
+            for mode in modes:
+                if "search" in stages:
+                    get_index_cache().clear() # So cold_ms includes loading the index
+                    key = f"search.{size}.{mode}"
+                    out[key] = benchmarking.bench_search(queries, index_name, model, top_k=options["top_k"], mode=mode)
+                    self._report(key, out[key])
+                if "chat" in stages:
+                    key = f"chat.{size}.{mode}"
+                    out[key] = benchmarking.bench_chat(
+                        queries, index_name, model, top_k=options["top_k"], mode=mode,
+                        llm=benchmarking.stub_llm(options["llm_latency_ms"]),
+                    )
+                    self._report(key, out[key])
+            vector_logic.delete_vector_store(index_name)
+
+    def _report(self, name, metrics):
+        parts = []
+        for key, value in metrics.items():
+            if isinstance(value, dict):
+                if value.get("count"):
+                    parts.append(f"p50 {value['p50_ms']} ms, p95 {value['p95_ms']} ms, p99 {value['p99_ms']} ms")
+            elif key.endswith("_per_second") or key in ("cold_ms", "seconds", "peak_rss_mb", "index_type"):
+                parts.append(f"{key} {value}")
+        self.stdout.write(f"{name:24} " + ", ".join(parts))
+
+    def _compare(self, results, baseline_path, max_regression):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = benchmarking.compare_results(results, baseline, max_regression)
+        self.stdout.write(
+            f"Compared with {baseline_path} (commit {baseline.get('environment', {}).get('commit')}):"
+        )
+        for metric, before, after, change, regressed in rows:
+            line = f"  {metric:48} {before:>12} -> {after:<12} {change:+.1f}%"
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+        regressions = [row[0] for row in rows if row[4]]
+        if regressions:
+            raise CommandError(f"{len(regressions)} metric(s) regressed by more than {max_regression}%: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS(f"No metric regressed by more than {max_regression}%."))
@@ -0,0 +1,118 @@
+# core/management/commands/check_vector_recall.py
+
+import time
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import KnowledgeBase
+from core.utils.embeddings.embedding_service import get_embedding_model
+from core.utils.ingestion.kb_ingestion import get_index_name
+from core.utils.vector import vector_logic
+from core.utils.vector.index_factory import (
+    INDEX_FLAT, QUANT_NONE, QUANTIZATIONS, build_index, get_index_type, get_metric, get_quantization, get_search_params,
+    prepare_query, reconstruct_all,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares search results of quantized copies of a KB's FAISS index (fp16, sq8, pq) with exact search "
+        "on a sample of queries, and reports recall@k, index size and query latency. "
+        "With --apply, rebuilds the KB's index with the chosen vector storage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kb", type=int, action="append", dest="kb_ids", required=True, help="KB id (repeatable).")
+        parser.add_argument(
+            "--quantization", action="append", choices=QUANTIZATIONS, dest="quantizations",
+            help="Vector storage to test (repeatable, default: all).",
+        )
+        parser.add_argument("--top-k", type=int, default=10, help="Results compared per query (default 10).")
+        parser.add_argument("--queries", type=int, default=200, help="Chunks sampled as queries (default 200).")
+        parser.add_argument("--query-file", help="Text file with one question per line, used instead of sampled chunks.")
+        parser.add_argument(
+            "--reencode", action="store_true",
+            help="Re-encode the chunk texts for exact vectors (needed when the stored index is already quantized).",
+        )
+        parser.add_argument("--apply", choices=QUANTIZATIONS, help="Rebuild the KB's index with this vector storage (one --kb only).")
+
+    def handle(self, *args, **options):
+        if options["apply"] and len(options["kb_ids"]) != 1:
+            raise CommandError("--apply works on one --kb at a time.")
+        quantizations = options["quantizations"] or list(QUANTIZATIONS)
+        model = None
+        if options["reencode"] or options["query_file"]:
+            model = get_embedding_model()
+
+        for kb in KnowledgeBase.objects.filter(id__in=options["kb_ids"]).order_by("id"):
+            index_name = get_index_name(kb)
+            # A private in-memory copy: reconstructing vectors doesn't work on the mmapped, cached one
+            index, store, error_message = vector_logic._load_vector_store(index_name, for_update=True)
+            if error_message:
+                self.stderr.write(f"{index_name}: {error_message} (only per-KB FAISS stores can be checked)")
+                continue
+
+            ids, vectors = self._exact_vectors(index, store, model, options["reencode"])
+            current_quantization = get_quantization(index)
+            if current_quantization != QUANT_NONE and not options["reencode"]:
+                self.stderr.write(
+                    f"{index_name} is stored as {current_quantization}; the baseline is its reconstructed vectors. "
+                    "Use --reencode for an exact baseline."
+                )
+            index_type, metric = get_index_type(index), get_metric(index)
+            self.stdout.write(f"{index_name}: {len(ids)} vectors, {index_type} {metric} index stored as {current_quantization}")
+
+            queries, exclude = self._queries(ids, vectors, model, options)
+            top_k = min(options["top_k"], len(ids) - (1 if exclude is not None else 0))
+            if top_k < 1 or not len(queries):
+                self.stderr.write(f"{index_name}: not enough vectors to compare")
+                continue
+            # build_index normalizes cosine vectors in place, so each index gets its own copy
+            exact, _ = build_index(vectors.copy(), INDEX_FLAT, ids=ids, quantization=QUANT_NONE, metric=metric)
+            expected = self._search(exact, queries, top_k, exclude)[0]
+
+            for quantization in quantizations:
+                candidate, _ = build_index(vectors.copy(), index_type, ids=ids, quantization=quantization, metric=metric)
+                found, ms_per_query = self._search(candidate, queries, top_k, exclude)
+                recall = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(found, expected)])
+                size = len(faiss.serialize_index(candidate))
+                self.stdout.write(
+                    f"  {get_quantization(candidate):5} recall@{top_k} {recall:.3f}  "
+                    f"{size / 1024 / 1024:8.2f} MB ({size / len(ids):7.1f} B/vector)  {ms_per_query:.3f} ms/query"
+                )
+
+            if options["apply"]:
+                rebuilt, rebuilt_type = build_index(vectors, index_type, ids=ids, quantization=options["apply"], metric=metric)
+                vector_logic._save_vector_store(index_name, rebuilt, store, expected_version=store.version)
+                KnowledgeBase.objects.filter(pk=kb.pk).update(vector_quantization=options["apply"], index_type=rebuilt_type)
+                self.stdout.write(self.style.SUCCESS(f"{index_name}: rebuilt as {rebuilt_type}/{get_quantization(rebuilt)}"))
+
+    def _exact_vectors(self, index, store, model, reencode):
+        if not reencode:
+            return reconstruct_all(index)
+        ids = np.asarray(store.ids, dtype="int64")
+        vectors = np.asarray(model.encode(list(store.texts), batch_size=64, show_progress_bar=False), dtype="float32")
+        return ids, vectors
+
+    def _queries(self, ids, vectors, model, options):
+        """Returns (query vectors, ids to drop from each query's results or None)."""
+        if options["query_file"]:
+            with open(options["query_file"], encoding="utf-8") as f:
+                questions = [line.strip() for line in f if line.strip()]
+            return np.asarray(model.encode(questions, show_progress_bar=False), dtype="float32"), None
+        # Stored chunks as queries; each one's own vector is dropped from its results so it can't inflate recall
+        sample = np.random.default_rng(0).choice(len(ids), min(options["queries"], len(ids)), replace=False)
+        return vectors[sample], ids[sample]
+
+    def _search(self, index, queries, top_k, exclude):
+        queries = prepare_query(index, queries)
+        started = time.perf_counter()
+        _, found = index.search(queries, top_k + (1 if exclude is not None else 0), params=get_search_params(index))
+        ms_per_query = 1000 * (time.perf_counter() - started) / len(queries)
+        results = []
+        for row, row_ids in enumerate(found):
+            row_ids = [int(i) for i in row_ids if i >= 0 and (exclude is None or i != exclude[row])]
+            results.append(row_ids[:top_k])
+        return results, ms_per_query
@@ -0,0 +1,103 @@
+# core/management/commands/compact_vector_shards.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import KnowledgeBase
+from core.utils.ingestion.kb_ingestion import get_index_name
+from core.utils.vector import vector_logic
+from core.utils.vector.index_factory import (
+    build_index, choose_index_type, choose_metric, choose_quantization, get_index_type, get_metric, get_quantization,
+    reconstruct_all,
+)
+from core.utils.vector.sharded_store import ShardedFaissVectorStore
+from core.utils.vector.vector_store import get_vector_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves per-KB FAISS stores into the shared shards used by VECTOR_STORE_BACKEND='faiss_sharded' "
+        "(vectors are copied, nothing is re-encoded), then deletes the per-KB files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kb", type=int, action="append", dest="kb_ids", help="Only this KB id (repeatable).")
+        parser.add_argument("--max-vectors", type=int, default=None, help="Only move KBs with at most this many vectors.")
+        parser.add_argument(
+            "--rebuild", action="store_true",
+            help=(
+                "Also rebuild shards whose index type no longer fits their size (e.g. a flat shard that outgrew "
+                "VECTOR_INDEX_HNSW_THRESHOLD) or whose vector storage or metric differs from VECTOR_QUANTIZATION / VECTOR_METRIC."
+            ),
+        )
+        parser.add_argument("--keep-source", action="store_true", help="Don't delete the per-KB files after moving them.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be moved.")
+
+    def handle(self, *args, **options):
+        vector_store = get_vector_store()
+        if not isinstance(vector_store, ShardedFaissVectorStore):
+            raise CommandError("Set VECTOR_STORE_BACKEND='faiss_sharded' first; other backends don't use shards.")
+
+        kbs = KnowledgeBase.objects.filter(is_embedded=True).order_by("id")
+        if options["kb_ids"]:
+            kbs = kbs.filter(id__in=options["kb_ids"])
+
+        by_shard = {}
+        for kb in kbs:
+            index_name = get_index_name(kb)
+            if vector_logic._find_store_files(index_name) is None:
+                continue # Already in its shard
+            index, _, error_message = vector_logic._load_vector_store(index_name)
+            if error_message:
+                self.stderr.write(f"{index_name}: {error_message}")
+                continue
+            if options["max_vectors"] is not None and index.ntotal > options["max_vectors"]:
+                continue
+            by_shard.setdefault(vector_store.shard_for(index_name), []).append((kb, index_name, int(index.ntotal)))
+
+        moved_total = 0
+        for shard, items in sorted(by_shard.items()):
+            names = ", ".join(f"{index_name} ({n_vectors})" for _, index_name, n_vectors in items)
+            if options["dry_run"]:
+                self.stdout.write(f"{shard}: would move {names}")
+                continue
+
+            # One load/save of the shard for all of its KBs
+            with vector_store.shard_write_lock(shard):
+                index, store = vector_store.load_shard_for_update(shard)
+                moved = []
+                for kb, index_name, _ in items:
+                    index, store, n_moved = vector_store.migrate_index(index, store, index_name)
+                    if n_moved:
+                        moved.append((kb, index_name))
+                        moved_total += n_moved
+                if moved:
+                    vector_store.save_shard(shard, index, store, [index_name for _, index_name in moved])
+
+            index_type = get_index_type(index) if index is not None else ""
+            for kb, index_name in moved:
+                KnowledgeBase.objects.filter(pk=kb.pk).update(index_type=index_type)
+                if not options["keep_source"]:
+                    vector_store.per_index.delete(index_name)
+            self.stdout.write(self.style.SUCCESS(f"{shard}: moved {names} ({index.ntotal if index is not None else 0} vectors in the shard)"))
+
+        if options["rebuild"] and not options["dry_run"]:
+            for shard_number in range(vector_store.shard_count):
+                self._rebuild_shard(vector_store, f"shard_{shard_number}")
+
+        self.stdout.write(f"Done: {moved_total} vectors moved into shards.")
+
+    def _rebuild_shard(self, vector_store, shard):
+        with vector_store.shard_write_lock(shard):
+            index, store = vector_store.load_shard_for_update(shard)
+            if index is None or index.ntotal == 0:
+                return
+            current = (get_index_type(index), get_quantization(index), get_metric(index))
+            wanted = (choose_index_type(index.ntotal), choose_quantization(), choose_metric())
+            if wanted == current:
+                return
+            ids, vectors = reconstruct_all(index)
+            rebuilt, index_type = build_index(vectors, wanted[0], ids=ids, quantization=wanted[1], metric=wanted[2])
+            vector_store.save_shard(shard, rebuilt, store)
+        self.stdout.write(self.style.SUCCESS(
+            f"{shard}: rebuilt {'/'.join(current)} -> {index_type}/{get_quantization(rebuilt)}/{get_metric(rebuilt)} ({rebuilt.ntotal} vectors)"
+        ))
@@ -0,0 +1,50 @@
+# core/management/commands/embedding_server.py
+
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.utils.embeddings.embedding_server import (
+    DEFAULT_INTERACTIVE_MAX_TEXTS, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS, EmbeddingServer,
+)
+from core.utils.embeddings.embedding_service import get_default_model_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the local embedding server: loads the embedding model once and serves batched encode requests "
+        "from every web and Celery worker on this machine over a Unix socket (EMBEDDING_SERVER_SOCKET)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", help="Unix socket path (default: EMBEDDING_SERVER_SOCKET).")
+        parser.add_argument("--model", action="append", dest="models", help="Model to load up front (repeatable, default: EMBEDDING_PRELOAD_MODELS).")
+        parser.add_argument(
+            "--max-batch-size", type=int,
+            default=getattr(settings, "EMBEDDING_SERVER_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE),
+            help="Most queued chat queries encoded together.",
+        )
+        parser.add_argument(
+            "--max-wait-ms", type=int, default=getattr(settings, "EMBEDDING_SERVER_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS),
+            help="How long a query waits for others to batch with.",
+        )
+
+    def handle(self, *args, **options):
+        socket_path = options["socket"] or getattr(settings, "EMBEDDING_SERVER_SOCKET", "")
+        if not socket_path:
+            raise CommandError("Set EMBEDDING_SERVER_SOCKET or pass --socket.")
+        model_names = options["models"] or getattr(settings, "EMBEDDING_PRELOAD_MODELS", None) or [get_default_model_name()]
+
+        server = EmbeddingServer(
+            socket_path, model_names, max_batch_size=options["max_batch_size"], max_wait_ms=options["max_wait_ms"],
+            interactive_max_texts=getattr(settings, "QUERY_ENCODER_MAX_BATCH_SIZE", DEFAULT_INTERACTIVE_MAX_TEXTS),
+        )
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: server.shutdown())
+        self.stdout.write(f"Embedding server for {', '.join(model_names)} listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        self.stdout.write("Embedding server stopped")
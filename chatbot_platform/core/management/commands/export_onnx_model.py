@@ -0,0 +1,153 @@
+# core/management/commands/export_onnx_model.py
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import KnowledgeBase
+from core.utils.embeddings.onnx_encoder import (
+    BACKEND_ONNX, BACKEND_ONNX_INT8, CONFIG_FILE, DEFAULT_MIN_COSINE, MODEL_FILES, OnnxSentenceEncoder, compare_encoders,
+    export_onnx_model, get_export_dir, publish_export,
+)
+from core.utils.ingestion.kb_ingestion import get_index_name
+from core.utils.vector import vector_logic
+
+# Used when no --kb / --text-file is given: short questions, sentences and (joined below) chunk-length text
+SAMPLE_TEXTS = [
+    "What are your opening hours?",
+    "How do I reset my password?",
+    "Can I get a refund after 30 days?",
+    "Where is the nearest office?",
+    "Does the premium plan include phone support?",
+    "Invoice INV-2024-0042 was paid twice.",
+    "The warranty covers manufacturing defects for two years from the date of purchase.",
+    "Orders placed before 2 pm on a working day are shipped the same day.",
+    "To cancel a subscription, open Account settings, choose Billing and click Cancel plan.",
+    "Employees accrue 1.5 days of paid leave per month, up to a maximum of 30 days.",
+    "The API rate limit is 100 requests per minute per key; exceeding it returns HTTP 429.",
+    "Passwords must be at least 12 characters long and may not reuse any of the last five.",
+    "Bananas are yellow when ripe and contain a lot of potassium.",
+    "The quarterly report shows revenue growth of 12% compared with the previous year.",
+    "Le service client est disponible du lundi au vendredi.",
+    "Die Lieferung erfolgt innerhalb von drei Werktagen.",
+    "Please attach a copy of the receipt when returning an item.",
+    "Server maintenance is scheduled for Sunday between 01:00 and 03:00 UTC.",
+]
+
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the embedding model to ONNX (fp32 and int8-quantized) for EMBEDDING_BACKEND=onnx / onnx_int8, "
+        "and checks that its vectors match the PyTorch model's on sample texts before replacing an earlier export."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", help="Model to export (default: EMBEDDING_MODEL_NAME).")
+        parser.add_argument("--output", help="Export directory (default: EMBEDDING_ONNX_DIR/<model>).")
+        parser.add_argument("--no-int8", action="store_true", help="Skip the int8-quantized model.")
+        parser.add_argument("--kb", type=int, action="append", dest="kb_ids", help="Check on chunks of this KB (repeatable, FAISS stores).")
+        parser.add_argument("--text-file", help="Check on the texts in this file, one per line.")
+        parser.add_argument("--samples", type=_positive_int, default=500, help="Most texts to check on (default 500).")
+        parser.add_argument("--top-k", type=_positive_int, default=10, help="Neighbours compared for recall (default 10).")
+        parser.add_argument(
+            "--min-cosine", type=float, default=DEFAULT_MIN_COSINE[BACKEND_ONNX],
+            help=f"Lowest cosine to the PyTorch vectors allowed for the fp32 model (default {DEFAULT_MIN_COSINE[BACKEND_ONNX]}).",
+        )
+        parser.add_argument(
+            "--min-cosine-int8", type=float, default=DEFAULT_MIN_COSINE[BACKEND_ONNX_INT8],
+            help=f"Same for the int8 model (default {DEFAULT_MIN_COSINE[BACKEND_ONNX_INT8]}).",
+        )
+
+    def handle(self, *args, **options):
+        from sentence_transformers import SentenceTransformer
+
+        model_name = options["model"] or getattr(settings, "EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+        export_dir = get_export_dir(model_name) if not options["output"] else os.path.abspath(options["output"])
+        texts = self._sample_texts(options)
+        if len(texts) < 2:
+            raise CommandError("Need at least two sample texts to compare.")
+
+        reference = SentenceTransformer(model_name, device="cpu")
+        batch_size = getattr(settings, "EMBEDDING_BATCH_SIZE", 64)
+        started = time.perf_counter()
+        reference_vectors = np.asarray(reference.encode(texts, batch_size=batch_size, show_progress_bar=False), dtype="float32")
+        torch_ms = 1000 * (time.perf_counter() - started) / len(texts)
+        self.stdout.write(f"{model_name}: {len(texts)} sample texts, torch {torch_ms:.2f} ms/text")
+
+        # Staged next to the target so publishing is a rename
+        parent = os.path.dirname(os.path.abspath(export_dir))
+        os.makedirs(parent, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=".onnx_export.", dir=parent)
+        try:
+            config = export_onnx_model(reference, staging_dir, quantize=not options["no_int8"])
+            backends = [BACKEND_ONNX] + ([] if options["no_int8"] else [BACKEND_ONNX_INT8])
+            thresholds = {BACKEND_ONNX: options["min_cosine"], BACKEND_ONNX_INT8: options["min_cosine_int8"]}
+            validation, failed = {}, []
+            for backend in backends:
+                encoder = OnnxSentenceEncoder(staging_dir, backend)
+                started = time.perf_counter()
+                vectors = encoder.encode(texts, batch_size=batch_size)
+                report = compare_encoders(reference_vectors, vectors, options["top_k"])
+                report["ms_per_text"] = round(1000 * (time.perf_counter() - started) / len(texts), 3)
+                report["size_bytes"] = os.path.getsize(os.path.join(staging_dir, MODEL_FILES[backend]))
+                report["min_cosine_required"] = thresholds[backend]
+                validation[backend] = report
+                recall_key = next(key for key in report if key.startswith("recall@"))
+                line = (
+                    f"  {backend:10} cosine min {report['min_cosine']:.5f} / mean {report['mean_cosine']:.5f}, "
+                    f"{recall_key} {report[recall_key]:.3f}, {report['ms_per_text']:.2f} ms/text, "
+                    f"{report['size_bytes'] / 1024 / 1024:.1f} MB"
+                )
+                if report["min_cosine"] < thresholds[backend]:
+                    failed.append(backend)
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+            if failed:
+                raise CommandError(
+                    f"{', '.join(failed)} vectors differ too much from the PyTorch model's; the export was not saved."
+                )
+
+            config.update({"model_name": model_name, "validation": validation})
+            with open(os.path.join(staging_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+                json.dump(config, f, indent=2)
+            publish_export(staging_dir, export_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported to {export_dir}; set EMBEDDING_BACKEND={' or '.join(backends)} to use it."
+        ))
+
+    def _sample_texts(self, options):
+        texts = []
+        if options["text_file"]:
+            with open(options["text_file"], encoding="utf-8") as f:
+                texts.extend(line.strip() for line in f if line.strip())
+        for kb in KnowledgeBase.objects.filter(id__in=options["kb_ids"] or []).order_by("id"):
+            # for_update: a writable ChunkStore with .texts, not the read-only mapped chunk file
+            _, store, error_message = vector_logic._load_vector_store(get_index_name(kb), for_update=True)
+            if error_message:
+                self.stderr.write(f"KB {kb.id}: {error_message} (only per-KB FAISS stores can be sampled)")
+                continue
+            texts.extend(store.texts)
+        if not texts:
+            # Chunk-length texts too, so truncation at max_seq_length is covered
+            texts = SAMPLE_TEXTS + [" ".join(SAMPLE_TEXTS[i:] + SAMPLE_TEXTS[:i]) for i in range(0, len(SAMPLE_TEXTS), 3)]
+        if len(texts) > options["samples"]:
+            sample = np.random.default_rng(0).choice(len(texts), options["samples"], replace=False)
+            texts = [texts[i] for i in sorted(sample)]
+        return texts
@@ -0,0 +1,104 @@
+# core/management/commands/ingest.py
+
+import json
+import os
+import signal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import KnowledgeBase
+from core.utils.ingestion.bulk_ingestion import find_files, run_bulk_ingestion
+from core.utils.ingestion.kb_ingestion import IngestionError
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-ingests files for a user: one knowledge base per file, or documents added to --kb. Extraction "
+        "(process pool), encoding (batched) and index writing run as overlapping stages; re-running the same "
+        "command resumes an interrupted run. Prints a throughput report at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", help="Files or directories (searched recursively for .txt/.pdf/.docx).")
+        parser.add_argument("--manifest", help="File listing one path per line, optionally followed by a tab and a KB title.")
+        parser.add_argument("--user", required=True, help="Username that will own the knowledge bases.")
+        parser.add_argument("--kb", type=int, help="Add the files as documents of this (embedded) KB instead.")
+        parser.add_argument("--workers", type=int, help="Extraction processes (default: up to 4).")
+        parser.add_argument("--queue-size", type=int, default=8, help="Files buffered between stages (default 8).")
+        parser.add_argument("--batch-size", type=int, help="Chunks per encode batch (default: EMBEDDING_BATCH_SIZE).")
+        parser.add_argument(
+            "--quantization", choices=[value for value, _ in KnowledgeBase.QUANTIZATION_CHOICES if value],
+            help="Vector quantization of the new KBs (default: VECTOR_QUANTIZATION).",
+        )
+        parser.add_argument("--state", help="Resume state file (default: ingest_state/<hash of user and files>.json).")
+        parser.add_argument("--report", help="Also write the throughput report to this JSON file.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['user']}")
+        kb = None
+        if options["kb"] is not None:
+            kb = KnowledgeBase.objects.filter(pk=options["kb"], user=user).first()
+            if kb is None:
+                raise CommandError(f"{user.username} has no KB {options['kb']}")
+            # A running embedding job is refused by run_bulk_ingestion, which also lets a re-run take over its own claim
+            if not kb.is_embedded:
+                raise CommandError(f"KB {kb.id} must finish embedding before documents can be added to it")
+
+        if not options["paths"] and not options["manifest"]:
+            raise CommandError("Give files or directories to ingest, or --manifest.")
+        files = find_files(options["paths"], options["manifest"])
+        missing = [path for path, _ in files if not os.path.isfile(path)]
+        if missing:
+            raise CommandError(f"Not found: {', '.join(missing[:5])}" + (" ..." if len(missing) > 5 else ""))
+        if not files:
+            raise CommandError("No .txt, .pdf or .docx files found.")
+
+        self.stdout.write(f"Ingesting {len(files)} files for {user.username}" + (f" into KB {kb.id}" if kb else ""))
+        # A container stop (SIGTERM) takes the same path as Ctrl-C: the KB's claim is released and the run can be resumed
+        previous_handler = signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+        try:
+            stats, state_path = run_bulk_ingestion(
+                files, user, kb=kb, state_path=options["state"], workers=options["workers"],
+                queue_size=options["queue_size"], batch_size=options["batch_size"],
+                quantization=options["quantization"], log=self.stdout.write,
+            )
+        except KeyboardInterrupt:
+            self.stderr.write("Interrupted; run the same command again to resume.")
+            raise SystemExit(1)
+        except IngestionError as e:
+            raise CommandError(str(e))
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+
+        report = stats.report()
+        self.stdout.write(
+            f"{report['files']} files ingested, {report['skipped']} already done, {report['failed']} failed "
+            f"in {report['wall_seconds']}s"
+        )
+        self.stdout.write(
+            f"  {report['files_per_second']} files/s, {report['chunks_per_second']} chunks/s, "
+            f"{report['megabytes_per_second']} MB/s ({report['chunks']} chunks, {report['pages']} pages, {report['megabytes']} MB)"
+        )
+        self.stdout.write(
+            f"  stage busy seconds: extract {report['extract_seconds']}, chunk {report['chunk_seconds']} "
+            f"(summed over workers), encode {report['encode_seconds']} in {report['encode_batches']} batches, "
+            f"write {report['write_seconds']}"
+        )
+        self.stdout.write(
+            f"  waiting for input: encode {report['encode_wait_seconds']}s, write {report['write_wait_seconds']}s"
+        )
+        if options["report"]:
+            with open(options["report"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        if report["failed"]:
+            self.stdout.write(self.style.WARNING(f"Failed files are listed in {state_path}; fix them and re-run to retry."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Done (state: {state_path})"))
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.1 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_knowledgebase_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding_status',
+            field=models.CharField(choices=[('not_started', 'Not started'), ('queued', 'Queued'), ('running', 'Running'), ('failed', 'Failed'), ('done', 'Done')], default='not_started', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding_progress',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding_task_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='embedding_finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_knowledgebase_embedding_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='index_type',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_knowledgebasedocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='retrieval_mode',
+            field=models.CharField(choices=[('dense', 'Semantic (embeddings)'), ('keyword', 'Keyword (BM25)'), ('hybrid', 'Hybrid (semantic + keyword)')], default='dense', max_length=10),
+        ),
+    ]
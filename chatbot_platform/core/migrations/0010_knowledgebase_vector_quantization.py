@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_knowledgebase_retrieval_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebase',
+            name='vector_quantization',
+            field=models.CharField(blank=True, choices=[('', 'Default'), ('none', 'Full precision (float32)'), ('fp16', 'Half precision (fp16, 2x smaller)'), ('sq8', '8-bit scalar quantization (4x smaller)'), ('pq', 'Product quantization (smallest, lower recall)')], default='', max_length=10),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 
 class UserProfile(models.Model):
@@ -11,6 +12,39 @@ class UserProfile(models.Model):
 
 
 class KnowledgeBase(models.Model):
+    # Background embedding job states (see core/tasks.py)
+    EMBEDDING_NOT_STARTED = "not_started"
+    EMBEDDING_QUEUED = "queued"
+    EMBEDDING_RUNNING = "running"
+    EMBEDDING_FAILED = "failed"
+    EMBEDDING_DONE = "done"
+    EMBEDDING_STATUS_CHOICES = [
+        (EMBEDDING_NOT_STARTED, "Not started"),
+        (EMBEDDING_QUEUED, "Queued"),
+        (EMBEDDING_RUNNING, "Running"),
+        (EMBEDDING_FAILED, "Failed"),
+        (EMBEDDING_DONE, "Done"),
+    ]
+
+    # How the widget finds context for a question (see core/utils/vector/keyword_index.py)
+    RETRIEVAL_DENSE = "dense"
+    RETRIEVAL_KEYWORD = "keyword"
+    RETRIEVAL_HYBRID = "hybrid"
+    RETRIEVAL_MODE_CHOICES = [
+        (RETRIEVAL_DENSE, "Semantic (embeddings)"),
+        (RETRIEVAL_KEYWORD, "Keyword (BM25)"),
+        (RETRIEVAL_HYBRID, "Hybrid (semantic + keyword)"),
+    ]
+
+    # How the FAISS index stores vectors (see core/utils/vector/index_factory.py); blank = settings.VECTOR_QUANTIZATION
+    QUANTIZATION_CHOICES = [
+        ("", "Default"),
+        ("none", "Full precision (float32)"),
+        ("fp16", "Half precision (fp16, 2x smaller)"),
+        ("sq8", "8-bit scalar quantization (4x smaller)"),
+        ("pq", "Product quantization (smallest, lower recall)"),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     file = models.FileField(upload_to="knowledge_bases/")  # Use default storage
@@ -21,9 +55,52 @@ class KnowledgeBase(models.Model):
     widget_slug = models.SlugField(unique=True, blank=True, null=True)
     embedded = models.BooleanField(default=False) 
 
+    # Embedding job tracking
+    embedding_status = models.CharField(max_length=20, choices=EMBEDDING_STATUS_CHOICES, default=EMBEDDING_NOT_STARTED)
+    embedding_progress = models.PositiveSmallIntegerField(default=0)  # 0-100
+    embedding_error = models.TextField(blank=True, default="")
+    embedding_task_id = models.CharField(max_length=255, blank=True, default="")
+    embedding_started_at = models.DateTimeField(blank=True, null=True)
+    embedding_finished_at = models.DateTimeField(blank=True, null=True)
+    # FAISS index type chosen at build time ("flat", "hnsw" or "ivfpq", see core/utils/vector/index_factory.py)
+    index_type = models.CharField(max_length=20, blank=True, default="")
+    retrieval_mode = models.CharField(max_length=10, choices=RETRIEVAL_MODE_CHOICES, default=RETRIEVAL_DENSE)
+    vector_quantization = models.CharField(max_length=10, choices=QUANTIZATION_CHOICES, blank=True, default="")
+
     def __str__(self):
         return f"{self.title} ({self.user.username})"
 
+    @property
+    def embedding_in_progress(self):
+        return self.embedding_status in (self.EMBEDDING_QUEUED, self.EMBEDDING_RUNNING)
+
+    @property
+    def embedding_duration_seconds(self):
+        if not self.embedding_started_at:
+            return None
+        end = self.embedding_finished_at or timezone.now()
+        return round((end - self.embedding_started_at).total_seconds(), 1)
+
+
+class KnowledgeBaseDocument(models.Model):
+    """
+    An extra file added to an already embedded KnowledgeBase. Its chunks live in the KB's
+    vector store under document_key, so it can be added, replaced or removed on its own.
+    """
+    knowledge_base = models.ForeignKey(KnowledgeBase, on_delete=models.CASCADE, related_name="documents")
+    name = models.CharField(max_length=255)  # Original upload name; re-uploading the same name replaces the file
+    file = models.FileField(upload_to="knowledge_bases/documents/")
+    is_embedded = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.knowledge_base.title})"
+
+    @property
+    def document_key(self):
+        return f"doc_{self.id}"
+
 
 class ChatbotWidget(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
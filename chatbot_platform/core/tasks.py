@@ -0,0 +1,110 @@
+# core/tasks.py
+
+import logging
+import time
+
+from celery import shared_task
+from django.utils import timezone
+
+from core.models import KnowledgeBase
+from core.utils.metrics import INGESTION_JOBS
+from core.utils.cache.response_cache import invalidate_kb_responses
+from core.utils.ingestion.kb_ingestion import IngestionError, ingest_knowledge_base
+from core.utils.vector.blob_storage import BlobPreconditionFailed
+from core.utils.vector.vector_logic import VectorStoreUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Failures worth retrying: network hiccups, GCS 429/5xx, losing a write race to another job
+# (the retry re-reads the store) and an existing store that failed to load. Anything else is treated as permanent.
+TRANSIENT_EXCEPTIONS = (ConnectionError, TimeoutError, BlobPreconditionFailed, VectorStoreUnavailable)
+try:
+    from google.api_core import exceptions as gcp_exceptions
+    TRANSIENT_EXCEPTIONS += (gcp_exceptions.ServerError, gcp_exceptions.TooManyRequests)
+except ImportError:
+    pass
+
+# Don't hammer the DB with a write for every encoded batch
+PROGRESS_UPDATE_INTERVAL_SECONDS = 1.0
+
+
+def _update_kb(kb_id, **fields):
+    # .update() avoids overwriting fields the web process may have changed meanwhile
+    KnowledgeBase.objects.filter(pk=kb_id).update(**fields)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30, acks_late=True)
+def embed_knowledge_base(self, kb_id):
+    """Background job: extract, chunk, encode and store the vector index for one KnowledgeBase."""
+    try:
+        kb = KnowledgeBase.objects.get(pk=kb_id)
+    except KnowledgeBase.DoesNotExist:
+        logger.warning(f"KB {kb_id} was deleted before its embedding job ran")
+        return
+
+    _update_kb(
+        kb_id,
+        embedding_status=KnowledgeBase.EMBEDDING_RUNNING,
+        embedding_progress=0,
+        embedding_error="",
+        embedding_started_at=timezone.now(),
+        embedding_finished_at=None,
+    )
+
+    last_update = [0.0]
+
+    def progress(percent, stage):
+        now = time.monotonic()
+        if now - last_update[0] >= PROGRESS_UPDATE_INTERVAL_SECONDS:
+            last_update[0] = now
+            _update_kb(kb_id, embedding_progress=min(percent, 99))
+            logger.info(f"KB {kb_id}: {stage} ({percent}%)")
+
+    try:
+        chunk_count = ingest_knowledge_base(kb, progress_callback=progress)
+    except IngestionError as e:
+        INGESTION_JOBS.labels("failed").inc()
+        _update_kb(
+            kb_id,
+            embedding_status=KnowledgeBase.EMBEDDING_FAILED,
+            embedding_error=str(e),
+            embedding_finished_at=timezone.now(),
+        )
+        return
+    except TRANSIENT_EXCEPTIONS as e:
+        if self.request.retries < self.max_retries:
+            logger.warning(f"KB {kb_id}: transient embedding failure, retrying: {e}")
+            INGESTION_JOBS.labels("retried").inc()
+            _update_kb(kb_id, embedding_status=KnowledgeBase.EMBEDDING_QUEUED, embedding_error=f"Retrying after error: {e}")
+            # Exponential backoff: 30s, 60s, 120s
+            raise self.retry(exc=e, countdown=self.default_retry_delay * (2 ** self.request.retries))
+        INGESTION_JOBS.labels("failed").inc()
+        _update_kb(
+            kb_id,
+            embedding_status=KnowledgeBase.EMBEDDING_FAILED,
+            embedding_error=f"Failed to embed knowledge base: {e}",
+            embedding_finished_at=timezone.now(),
+        )
+        return
+    except Exception as e:
+        logger.error(f"KB {kb_id}: embedding failed", exc_info=True)
+        INGESTION_JOBS.labels("failed").inc()
+        _update_kb(
+            kb_id,
+            embedding_status=KnowledgeBase.EMBEDDING_FAILED,
+            embedding_error=f"Failed to embed knowledge base: {e}",
+            embedding_finished_at=timezone.now(),
+        )
+        return
+
+    INGESTION_JOBS.labels("done").inc()
+    _update_kb(
+        kb_id,
+        embedding_status=KnowledgeBase.EMBEDDING_DONE,
+        embedding_progress=100,
+        embedding_finished_at=timezone.now(),
+    )
+    # Cached chat answers were generated from the old chunks
+    invalidate_kb_responses(kb_id)
+    logger.info(f"KB {kb_id}: embedded {chunk_count} chunks")
+    return chunk_count
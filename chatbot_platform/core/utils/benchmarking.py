@@ -0,0 +1,397 @@
+# core/utils/benchmarking.py
+
+import hashlib
+import os
+import platform
+import subprocess
+import threading
+import time
+
+import faiss
+import numpy as np
+from django.core.files import File
+
+from core.utils.chunking.text_chunker import chunk_text
+from core.utils.file_reader import extract_text_from_file
+from core.utils.vector import vector_logic
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    from docx import Document
+except ImportError:
+    Document = None
+
+# Throughput metrics (larger is better); latency (_ms) and memory (_mb) are better smaller
+HIGHER_IS_BETTER = ("per_second",)
+SYNTHETIC_VOCABULARY_SIZE = 20_000
+RSS_SAMPLE_INTERVAL_SECONDS = 0.005
+
+
+def current_rss_mb():
+    """Resident set size of this process right now, in MB (None where unavailable)."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StagePeakRss:
+    """
+    Peak RSS while the `with` block runs, sampled from a background thread. The process-lifetime
+    peak (ru_maxrss) can't be used per stage: after the largest stage every stage would report it.
+    `peak_mb` is None where RSS can't be read.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        if self.peak_mb is not None:
+            self._thread = threading.Thread(target=self._run, name="benchmark-rss", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+        if self.peak_mb is not None:
+            self.peak_mb = round(self.peak_mb, 1)
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean/max in milliseconds for a list of per-operation durations."""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds, dtype="float64") * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": len(ms),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def environment_info():
+    """Where the numbers came from, so results from different machines or commits aren't mixed up."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "faiss": getattr(faiss, "__version__", None),
+        "numpy": np.__version__,
+    }
+
+
+class HashingEncoder:
+    """
+    Deterministic stand-in for the embedding model: each word adds to one of `dim` buckets.
+    Lets the benchmark measure everything around the model (chunking, indexing, search)
+    without loading or timing a transformer.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        vectors = np.zeros((len(sentences), self.dim), dtype="float32")
+        for row, sentence in enumerate(sentences):
+            for word in sentence.lower().split():
+                vectors[row, int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % self.dim] += 1.0
+        return vectors
+
+
+class SyntheticCorpus:
+    """
+    Reproducible filler text with a Zipf-like word distribution (a few very common words, a long
+    tail of rare ones), so keyword and vector search see realistic term statistics.
+    """
+
+    def __init__(self, seed=0, vocabulary_size=SYNTHETIC_VOCABULARY_SIZE):
+        self.rng = np.random.default_rng(seed)
+        self.vocabulary = np.array([f"w{i}" for i in range(vocabulary_size)])
+        weights = 1.0 / np.arange(1, vocabulary_size + 1)
+        self.probabilities = weights / weights.sum()
+
+    def words(self, n):
+        return self.vocabulary[self.rng.choice(len(self.vocabulary), size=n, p=self.probabilities)]
+
+    def paragraphs(self, n_words, sentence_words=(8, 20), paragraph_sentences=(3, 8)):
+        """Text of about `n_words` words as a list of paragraphs of sentences."""
+        words = self.words(n_words)
+        paragraphs, sentences, position = [], [], 0
+        paragraph_length = self.rng.integers(*paragraph_sentences)
+        while position < len(words):
+            length = int(self.rng.integers(*sentence_words))
+            sentence = " ".join(words[position:position + length])
+            sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+            position += length
+            if len(sentences) >= paragraph_length:
+                paragraphs.append(" ".join(sentences))
+                sentences, paragraph_length = [], self.rng.integers(*paragraph_sentences)
+        if sentences:
+            paragraphs.append(" ".join(sentences))
+        return paragraphs
+
+    def chunks(self, n, words_per_chunk=150):
+        """`n` chunk texts, as the chunker would hand them to embed_and_store."""
+        words = self.words(n * words_per_chunk).reshape(n, words_per_chunk)
+        return [" ".join(row) for row in words]
+
+    def queries(self, chunks, n, query_words=(4, 10)):
+        """Questions made of a run of words from random chunks, so every query has a relevant answer."""
+        queries = []
+        for position in self.rng.integers(0, len(chunks), size=n):
+            words = chunks[position].split()
+            length = min(int(self.rng.integers(*query_words)), len(words))
+            start = int(self.rng.integers(0, max(len(words) - length, 0) + 1))
+            queries.append(" ".join(words[start:start + length]))
+        return queries
+
+
+def _write_pdf(path, pages):
+    """Minimal text PDF (one Helvetica text block per page) that pypdf can extract."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        text = " ".join(
+            f"({line.replace(chr(92), '').replace('(', '').replace(')', '')}) Tj T*" for line in lines
+        )
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text} ET".encode("latin-1", errors="ignore")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream.decode('latin-1')}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    body = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref_offset = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(body)
+
+
+def write_synthetic_documents(directory, corpus, count, words_per_document, formats=("txt", "pdf", "docx")):
+    """Writes `count` documents (cycling through `formats`) into `directory`; returns their paths."""
+    formats = [fmt for fmt in formats if fmt != "docx" or Document is not None]
+    paths = []
+    for number in range(count):
+        fmt = formats[number % len(formats)]
+        paragraphs = corpus.paragraphs(words_per_document)
+        path = os.path.join(directory, f"doc_{number}.{fmt}")
+        if fmt == "txt":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(paragraphs))
+        elif fmt == "docx":
+            document = Document()
+            for paragraph in paragraphs:
+                document.add_paragraph(paragraph)
+            document.save(path)
+        else:
+            # ~40 lines of ~12 words per page
+            words = " ".join(paragraphs).split()
+            lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+            _write_pdf(path, [lines[i:i + 40] for i in range(0, len(lines), 40)] or [[]])
+        paths.append(path)
+    return paths
+
+
+# --- Stages. Each returns a dict of metrics; throughput keys end in _per_second ---
+
+def bench_extraction(paths):
+    """extract_text_from_file on each file, as ingestion reads an uploaded KB file."""
+    durations, texts, total_bytes = [], [], 0
+    started = time.perf_counter()
+    with StagePeakRss() as rss:
+        for path in paths:
+            file_started = time.perf_counter()
+            texts.append(extract_text_from_file(File(None, name=path)))
+            durations.append(time.perf_counter() - file_started)
+            total_bytes += os.path.getsize(path)
+    elapsed = time.perf_counter() - started
+    return texts, {
+        "documents": len(paths),
+        "seconds": round(elapsed, 3),
+        "documents_per_second": round(len(paths) / elapsed, 2) if elapsed else None,
+        "mb_per_second": round(total_bytes / (1024 * 1024) / elapsed, 2) if elapsed else None,
+        "per_document": latency_summary(durations),
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+
+def bench_chunking(texts, paths):
+    started = time.perf_counter()
+    chunks = []
+    with StagePeakRss() as rss:
+        for text, path in zip(texts, paths):
+            chunks.extend(chunk_text(text, os.path.splitext(path)[1]))
+    elapsed = time.perf_counter() - started
+    return chunks, {
+        "chunks": len(chunks),
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(chunks) / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+
+def bench_embed_and_store(chunks, index_name, model, index_type=None, quantization=None):
+    started = time.perf_counter()
+    with StagePeakRss() as rss:
+        info = vector_logic.embed_and_store(chunks, index_name, model, index_type=index_type, quantization=quantization)
+    elapsed = time.perf_counter() - started
+    return {
+        "chunks": len(chunks),
+        "index_type": info["index_type"] if info else None,
+        "quantization": info["quantization"] if info else None,
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(chunks) / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+
+def bench_search(queries, index_name, model, top_k=3, mode=vector_logic.MODE_DENSE):
+    """
+    search_similar_chunks for each query. The first query also loads the index from storage and is
+    reported separately as cold_ms; the rest hit the in-process index cache.
+    """
+    with StagePeakRss() as rss:
+        cold_started = time.perf_counter()
+        vector_logic.search_similar_chunks(queries[0], index_name, model, top_k=top_k, mode=mode)
+        cold_seconds = time.perf_counter() - cold_started
+
+        durations = []
+        started = time.perf_counter()
+        for query in queries[1:]:
+            query_started = time.perf_counter()
+            vector_logic.search_similar_chunks(query, index_name, model, top_k=top_k, mode=mode)
+            durations.append(time.perf_counter() - query_started)
+        elapsed = time.perf_counter() - started
+    return {
+        "mode": mode,
+        "top_k": top_k,
+        "cold_ms": round(1000 * cold_seconds, 3),
+        "queries_per_second": round(len(durations) / elapsed, 1) if elapsed else None,
+        "latency": latency_summary(durations),
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+
+def stub_llm(latency_ms=0):
+    """A generate_genai_response stand-in that waits `latency_ms` and answers with the prompt size."""
+    from webapp.utils.genai_llm import build_prompt # Imported here so the other stages don't load the Gemini SDK
+
+    def generate(context, question):
+        prompt = build_prompt(context, question)
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        return f"stub answer ({len(prompt)} prompt characters)"
+    return generate
+
+
+def bench_chat(queries, index_name, model, top_k=3, mode=vector_logic.MODE_DENSE, llm=None):
+    """
+    A chat turn end to end: retrieve context, build the prompt and call the (stubbed) LLM.
+    Also reports how much context reaches the prompt, which the similarity cutoff reduces.
+    """
+    llm = llm or stub_llm()
+    durations, context_chars = [], []
+    started = time.perf_counter()
+    with StagePeakRss() as rss:
+        for query in queries:
+            query_started = time.perf_counter()
+            results, message = vector_logic.search_scored_chunks(query, index_name, model, top_k=top_k, mode=mode)
+            context = "\n".join(result.text for result in results) if results else (message or "No relevant information found.")
+            llm(context, query)
+            durations.append(time.perf_counter() - query_started)
+            context_chars.append(len(context))
+    elapsed = time.perf_counter() - started
+    return {
+        "mode": mode,
+        "top_k": top_k,
+        "requests_per_second": round(len(queries) / elapsed, 1) if elapsed else None,
+        "latency": latency_summary(durations),
+        "mean_context_chars": round(float(np.mean(context_chars)), 1) if context_chars else 0,
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+
+# --- Comparing runs ---
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def _is_tracked(metric):
+    # max_ms is a single sample and too noisy to gate on
+    leaf = metric.rsplit(".", 1)[-1]
+    return leaf.endswith("_per_second") or (leaf.endswith("_ms") and leaf != "max_ms") or leaf == "peak_rss_mb"
+
+
+def compare_results(current, baseline, max_regression_percent=10.0):
+    """
+    Compares the "stages" of two benchmark result documents metric by metric.
+    Returns [(metric, baseline value, current value, change %, regressed)] for throughput,
+    latency and memory metrics present in both; `regressed` is True when the metric got worse
+    by more than `max_regression_percent`.
+    """
+    current_metrics = _flatten(current.get("stages", {}))
+    baseline_metrics = _flatten(baseline.get("stages", {}))
+    rows = []
+    for metric in sorted(current_metrics.keys() & baseline_metrics.keys()):
+        if not _is_tracked(metric):
+            continue
+        before, after = baseline_metrics[metric], current_metrics[metric]
+        if not before:
+            continue
+        change = 100.0 * (after - before) / before
+        worse = -change if metric.rsplit(".", 1)[-1].endswith(HIGHER_IS_BETTER) else change
+        rows.append((metric, before, after, round(change, 1), worse > max_regression_percent))
+    return rows
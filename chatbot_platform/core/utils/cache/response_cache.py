@@ -0,0 +1,207 @@
+# core/utils/cache/response_cache.py
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+DEFAULT_MAX_ENTRIES = 4096 # In-process backend only
+MAX_ANSWERS_PER_KEY = 8
+
+
+def context_fingerprint(context):
+    """Identifies the retrieved chunks an answer was generated from."""
+    return hashlib.sha1(context.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def _kb_version(kb):
+    # Changes whenever an embedding job finishes, which every process sees through the DB row;
+    # the backend version (bumped by invalidate()) additionally covers shared backends right away
+    finished_at = kb.embedding_finished_at
+    return int(finished_at.timestamp() * 1_000_000) if finished_at else 0
+
+
+# --- Backends ---
+# A backend stores lists of answer entries under string keys with a TTL, plus a per-KB version
+# number that is bumped to invalidate everything cached for that KB.
+
+class LocalResponseCacheBackend:
+    """Per-process LRU dict. Fast, but each worker warms its own copy."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_version(self, kb_id):
+        return self._versions.get(kb_id, 0)
+
+    def bump_version(self, kb_id):
+        with self._lock:
+            self._versions[kb_id] = self._versions.get(kb_id, 0) + 1
+            # Old-version keys can never be read again; drop them now rather than waiting for the LRU
+            prefix = f"{kb_id}:"
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+
+class DjangoResponseCacheBackend:
+    """Django cache framework (e.g. Redis/Memcached), shared by every worker and instance."""
+
+    def __init__(self, alias="default"):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(f"response_cache:{key}")
+
+    def set(self, key, value, ttl):
+        self.cache.set(f"response_cache:{key}", value, ttl)
+
+    def get_version(self, kb_id):
+        return self.cache.get(f"response_cache_version:{kb_id}", 0)
+
+    def bump_version(self, kb_id):
+        version_key = f"response_cache_version:{kb_id}"
+        # add() is a no-op if the key exists; incr() is atomic on Redis/Memcached
+        self.cache.add(version_key, 0, None)
+        try:
+            self.cache.incr(version_key)
+        except ValueError:
+            self.cache.set(version_key, 1, None)
+
+
+BACKENDS = {
+    "local": lambda: LocalResponseCacheBackend(getattr(settings, "RESPONSE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+    "django": lambda: DjangoResponseCacheBackend(getattr(settings, "RESPONSE_CACHE_ALIAS", "default")),
+}
+
+
+class ResponseCache:
+    """
+    Caches LLM answers per KB so repeated widget questions skip the LLM call.
+
+    An answer is reused when it was generated from exactly the same retrieved chunks (context
+    fingerprint) and its question embedding has cosine similarity >= `threshold` with the new
+    one, so rephrasings of the same question hit but questions that merely share context don't.
+    Keys include when the KB was last embedded, so answers from before a re-embed are never
+    served; invalidate(kb_id) also drops them from the backend when a KB is re-embedded or deleted.
+    """
+
+    def __init__(self, backend, ttl=DEFAULT_TTL_SECONDS, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+        self.backend = backend
+        self.ttl = ttl
+        self.threshold = threshold
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def _key(self, kb, context):
+        return f"{kb.id}:{self.backend.get_version(kb.id)}:{_kb_version(kb)}:{context_fingerprint(context)}"
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype="float32").reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, kb, query_vector, context):
+        """Returns a cached answer for this question and context, or None."""
+        entries = self.backend.get(self._key(kb, context)) or []
+        query_vector = self._normalize(query_vector)
+        best_answer, best_score = None, self.threshold
+        for vector, answer in entries:
+            score = float(np.dot(query_vector, np.asarray(vector, dtype="float32")))
+            if score >= best_score:
+                best_answer, best_score = answer, score
+        with self._stats_lock:
+            if best_answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best_answer
+
+    def put(self, kb, query_vector, context, answer):
+        key = self._key(kb, context)
+        entries = self.backend.get(key) or []
+        # Plain lists so the entry pickles for any Django cache backend
+        entries.append((self._normalize(query_vector).tolist(), answer))
+        self.backend.set(key, entries[-MAX_ANSWERS_PER_KEY:], self.ttl)
+        with self._stats_lock:
+            self.stores += 1
+
+    def invalidate(self, kb_id):
+        self.backend.bump_version(kb_id)
+        with self._stats_lock:
+            self.invalidations += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "ttl_seconds": self.ttl,
+                "similarity_threshold": self.threshold,
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Returns the process-wide ResponseCache, or None if settings.RESPONSE_CACHE_BACKEND is empty.
+    The backend is "local", "django", or a dotted path to a backend class.
+    """
+    global _response_cache
+    backend_name = getattr(settings, "RESPONSE_CACHE_BACKEND", "local")
+    if not backend_name:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                backend_factory = BACKENDS.get(backend_name) or import_string(backend_name)
+                _response_cache = ResponseCache(
+                    backend_factory(),
+                    ttl=getattr(settings, "RESPONSE_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS),
+                    threshold=getattr(settings, "RESPONSE_CACHE_SIMILARITY_THRESHOLD", DEFAULT_SIMILARITY_THRESHOLD),
+                )
+    return _response_cache
+
+
+def invalidate_kb_responses(kb_id):
+    """Drops every cached answer for a KB (call after it is re-embedded or deleted)."""
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        response_cache.invalidate(kb_id)
@@ -0,0 +1,161 @@
+# core/utils/chunking/text_chunker.py
+
+import os
+import re
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+
+# Defaults are sized for all-MiniLM-L6-v2, which truncates input at 256 word pieces.
+# A "token" here is a whitespace-separated word; word pieces run ~1.3x that, so 180 words stays under the limit.
+DEFAULT_CHUNK_SIZE = 180
+DEFAULT_CHUNK_OVERLAP = 30
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+(?=["\'(\[]?[A-Z0-9])')
+_PARAGRAPH_BOUNDARY = re.compile(r'\n\s*\n')
+_WORD = re.compile(r'\S+')
+
+
+def count_tokens(text):
+    return len(_WORD.findall(text))
+
+
+# --- Per-file-type preprocessing ---
+# Each strategy turns the raw output of extract_text_from_file into a list of paragraphs.
+
+def _paragraphs_from_txt(text):
+    # Plain text: blank lines separate paragraphs, single newlines are kept as soft wraps
+    return [re.sub(r'\s*\n\s*', ' ', p).strip() for p in _PARAGRAPH_BOUNDARY.split(text)]
+
+def _paragraphs_from_pdf(text):
+    # pypdf breaks lines at the page layout, not at sentence ends: re-join hyphenated words
+    # and hard-wrapped lines, keeping blank lines as paragraph breaks.
+    text = re.sub(r'(\w)-\n(\w)', r'\1\2', text)
+    return _paragraphs_from_txt(text)
+
+def _paragraphs_from_docx(text):
+    # python-docx output is one paragraph per line
+    return [line.strip() for line in text.split('\n')]
+
+CHUNKING_STRATEGIES = {
+    '.txt': _paragraphs_from_txt,
+    '.pdf': _paragraphs_from_pdf,
+    '.docx': _paragraphs_from_docx,
+    '.doc': _paragraphs_from_docx,
+}
+
+
+def _split_sentences(paragraph):
+    return [s.strip() for s in _SENTENCE_BOUNDARY.split(paragraph) if s.strip()]
+
+def _split_long_unit(unit, chunk_size, chunk_overlap):
+    """Word windows for a single sentence that is longer than the chunk size on its own."""
+    words = unit.split()
+    step = max(chunk_size - chunk_overlap, 1)
+    return [" ".join(words[i:i + chunk_size]) for i in range(0, len(words), step) if words[i:i + chunk_size]]
+
+
+class Chunk(NamedTuple):
+    text: str
+    page_number: Optional[int] = None     # Page the chunk starts on (PDFs)
+    paragraph_index: Optional[int] = None # Paragraph the chunk starts in (DOCX/TXT)
+
+
+def _resolve_sizes(chunk_size, chunk_overlap):
+    chunk_size = chunk_size or getattr(settings, "CHUNK_SIZE_TOKENS", DEFAULT_CHUNK_SIZE)
+    if chunk_overlap is None:
+        chunk_overlap = getattr(settings, "CHUNK_OVERLAP_TOKENS", DEFAULT_CHUNK_OVERLAP)
+    return chunk_size, min(chunk_overlap, chunk_size // 2)
+
+
+def iter_chunks(sections, file_extension=None, chunk_size=None, chunk_overlap=None):
+    """
+    Streams overlapping, sentence-aligned chunks out of an iterable of text sections.
+
+    Sentences are packed into windows of at most `chunk_size` tokens; consecutive windows share
+    roughly `chunk_overlap` tokens of trailing sentences so answers spanning a boundary are still
+    retrievable. Sentences are only split when a single one is longer than `chunk_size`.
+    Windows run across section boundaries, and only the current window is held in memory.
+
+    Args:
+        sections: Iterable of TextSection (from core.utils.file_reader.iter_text_sections) or plain strings.
+        file_extension (str): e.g. ".pdf"; selects the preprocessing strategy (defaults to plain text).
+        chunk_size (int): Max tokens per chunk (defaults to settings.CHUNK_SIZE_TOKENS).
+        chunk_overlap (int): Tokens shared between consecutive chunks (defaults to settings.CHUNK_OVERLAP_TOKENS).
+
+    Yields:
+        Chunk: In document order, tagged with the page/paragraph they start in.
+    """
+    chunk_size, chunk_overlap = _resolve_sizes(chunk_size, chunk_overlap)
+    strategy = CHUNKING_STRATEGIES.get((file_extension or '').lower(), _paragraphs_from_txt)
+
+    def iter_units():
+        # Flatten the document into sentence units, splitting any unit that can't fit in one chunk
+        for section in sections:
+            if isinstance(section, str):
+                section_text, page_number, paragraph_index = section, None, None
+            else:
+                section_text, page_number, paragraph_index = section.text, section.page_number, section.paragraph_index
+            for paragraph in strategy(section_text):
+                if not paragraph:
+                    continue
+                for sentence in _split_sentences(paragraph):
+                    if count_tokens(sentence) > chunk_size:
+                        for piece in _split_long_unit(sentence, chunk_size, chunk_overlap):
+                            yield piece, page_number, paragraph_index
+                    else:
+                        yield sentence, page_number, paragraph_index
+
+    def make_chunk(window):
+        _, _, page_number, paragraph_index = window[0]
+        return Chunk(" ".join(unit[0] for unit in window), page_number, paragraph_index)
+
+    window = [] # list of (sentence, token_count, page_number, paragraph_index)
+    window_tokens = 0
+
+    for unit, page_number, paragraph_index in iter_units():
+        unit_tokens = count_tokens(unit)
+        if window and window_tokens + unit_tokens > chunk_size:
+            yield make_chunk(window)
+            # Carry trailing sentences forward as overlap
+            carried = []
+            carried_tokens = 0
+            for item in reversed(window):
+                if carried_tokens + item[1] > chunk_overlap:
+                    break
+                carried.insert(0, item)
+                carried_tokens += item[1]
+            window = carried
+            window_tokens = carried_tokens
+            # The overlap must still leave room for the new unit
+            while window and window_tokens + unit_tokens > chunk_size:
+                window_tokens -= window.pop(0)[1]
+        window.append((unit, unit_tokens, page_number, paragraph_index))
+        window_tokens += unit_tokens
+
+    if window:
+        yield make_chunk(window)
+
+
+def chunk_text(text, file_extension=None, chunk_size=None, chunk_overlap=None):
+    """
+    Splits extracted document text into overlapping, sentence-aligned chunks for embedding.
+    See iter_chunks for how windows are built.
+
+    Args:
+        text (str): Text returned by extract_text_from_file.
+        file_extension (str): e.g. ".pdf"; selects the preprocessing strategy (defaults to plain text).
+        chunk_size (int): Max tokens per chunk (defaults to settings.CHUNK_SIZE_TOKENS).
+        chunk_overlap (int): Tokens shared between consecutive chunks (defaults to settings.CHUNK_OVERLAP_TOKENS).
+
+    Returns:
+        list[str]: The chunks, in document order.
+    """
+    if not text or not text.strip():
+        return []
+    return [chunk.text for chunk in iter_chunks([text], file_extension, chunk_size, chunk_overlap)]
+
+
+def chunk_file_text(text, file_name):
+    """Convenience wrapper that picks the strategy from a file name (e.g. kb.file.name)."""
+    return chunk_text(text, file_extension=os.path.splitext(file_name or '')[1])
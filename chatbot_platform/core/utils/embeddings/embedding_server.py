@@ -0,0 +1,476 @@
+# embeddings/embedding_server.py
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 5
+DEFAULT_INTERACTIVE_MAX_TEXTS = 32
+DEFAULT_TIMEOUT_SECONDS = 60
+DEFAULT_RETRY_SECONDS = 30
+# How long a client keeps retrying a connect refused because the server's accept backlog is full
+CONNECT_BACKLOG_RETRY_SECONDS = 2.0
+
+# Every message is: header length, body length (big-endian uint32), JSON header, raw body.
+# Requests carry everything in the header; encode responses put the float32 vectors in the body.
+_LENGTHS = struct.Struct(">II")
+
+
+class EmbeddingServerUnavailable(Exception):
+    """The embedding server can't be reached (not running, socket gone, timed out)."""
+
+
+class EmbeddingServerError(RuntimeError):
+    """The embedding server was reached but couldn't encode the texts."""
+
+
+def _send_message(sock, header, body=b""):
+    header_bytes = json.dumps(header).encode("utf-8")
+    sock.sendall(_LENGTHS.pack(len(header_bytes), len(body)) + header_bytes + body)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if not count:
+            raise EOFError("Connection closed")
+        received += count
+    return bytes(buffer)
+
+
+def _recv_message(sock):
+    header_length, body_length = _LENGTHS.unpack(_recv_exact(sock, _LENGTHS.size))
+    header = json.loads(_recv_exact(sock, header_length))
+    return header, _recv_exact(sock, body_length) if body_length else b""
+
+
+# --- Server (manage.py embedding_server) ---
+
+class _Job:
+    __slots__ = ("texts", "batch_size", "future", "queued_at")
+
+    def __init__(self, texts, batch_size):
+        self.texts = texts
+        self.batch_size = batch_size
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+
+class ModelWorker:
+    """
+    Owns one loaded model and encodes the jobs of every connection on a single thread.
+
+    Small jobs (chat queries, at most `interactive_max_texts` texts) go before bulk ones
+    (ingestion batches) and are merged: the thread waits up to `max_wait_ms` for more of them,
+    up to `max_batch_size` texts, and encodes them in one call. Bulk jobs are encoded one at a
+    time, so a chat query waits for at most one ingestion batch.
+    """
+
+    def __init__(self, model, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 interactive_max_texts=DEFAULT_INTERACTIVE_MAX_TEXTS):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max(0, max_wait_ms) / 1000
+        self.interactive_max_texts = interactive_max_texts
+        self._interactive = deque()
+        self._bulk = deque()
+        self._condition = threading.Condition()
+
+        self.jobs = 0
+        self.batches = 0
+        self.encoded = 0
+        self.encode_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="embedding-server-model", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts, batch_size):
+        job = _Job(texts, batch_size)
+        with self._condition:
+            (self._interactive if len(texts) <= self.interactive_max_texts else self._bulk).append(job)
+            self._condition.notify()
+        return job.future
+
+    def stats(self):
+        with self._condition:
+            return {
+                "jobs": self.jobs,
+                "batches": self.batches,
+                "encoded": self.encoded,
+                "avg_batch_size": round(self.encoded / self.batches, 2) if self.batches else 0,
+                "avg_encode_ms": round(1000 * self.encode_seconds / self.batches, 2) if self.batches else 0,
+                "avg_wait_ms": round(1000 * self.wait_seconds / self.jobs, 2) if self.jobs else 0,
+                "queued_interactive": len(self._interactive),
+                "queued_bulk": len(self._bulk),
+            }
+
+    def _take_jobs(self):
+        with self._condition:
+            while not self._interactive and not self._bulk:
+                self._condition.wait()
+            if not self._interactive:
+                return [self._bulk.popleft()]
+            deadline = time.monotonic() + self.max_wait_seconds
+            while sum(len(job.texts) for job in self._interactive) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            jobs, total = [], 0
+            while self._interactive and (not jobs or total + len(self._interactive[0].texts) <= self.max_batch_size):
+                job = self._interactive.popleft()
+                jobs.append(job)
+                total += len(job.texts)
+            return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._take_jobs()
+            texts = [text for job in jobs for text in job.texts]
+            batch_size = jobs[0].batch_size if len(jobs) == 1 else len(texts)
+            started = time.monotonic()
+            try:
+                vectors = np.asarray(self.model.encode(texts, batch_size=batch_size, show_progress_bar=False), dtype="float32")
+            except Exception as e:
+                logger.error(f"Embedding server failed to encode {len(texts)} texts", exc_info=True)
+                for job in jobs:
+                    job.future.set_exception(e)
+                continue
+            finished = time.monotonic()
+
+            offset = 0
+            for job in jobs:
+                job.future.set_result(vectors[offset:offset + len(job.texts)])
+                offset += len(job.texts)
+            with self._condition:
+                self.jobs += len(jobs)
+                self.batches += 1
+                self.encoded += len(texts)
+                self.encode_seconds += finished - started
+                self.wait_seconds += sum(started - job.queued_at for job in jobs)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # One connection per client thread, kept open for many requests
+        while True:
+            try:
+                header, _ = _recv_message(self.request)
+            except (EOFError, ConnectionError):
+                return
+            try:
+                self._respond(header)
+            except (BrokenPipeError, ConnectionError):
+                return
+
+    def _respond(self, header):
+        server = self.server.embedding_server
+        op = header.get("op")
+        if op == "ping":
+            _send_message(self.request, {"ok": True, "pid": os.getpid(), "models": server.stats()})
+            return
+        if op == "dimension":
+            try:
+                dimension = server.get_worker(header["model"]).model.get_sentence_embedding_dimension()
+            except Exception as e:
+                _send_message(self.request, {"ok": False, "error": f"{type(e).__name__}: {e}"})
+                return
+            _send_message(self.request, {"ok": True, "dimension": int(dimension)})
+            return
+        if op != "encode":
+            _send_message(self.request, {"ok": False, "error": f"Unknown op: {op}"})
+            return
+        try:
+            worker = server.get_worker(header["model"])
+            vectors = worker.submit(list(header["texts"]), int(header.get("batch_size") or 32)).result()
+        except Exception as e:
+            _send_message(self.request, {"ok": False, "error": f"{type(e).__name__}: {e}"})
+            return
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        _send_message(self.request, {"ok": True, "shape": list(vectors.shape)}, vectors.tobytes())
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Every worker process connects at once after a deploy; socketserver's default backlog of 5 would turn
+    # the rest away (Unix sockets fail with EAGAIN instead of waiting) and send them to in-process models
+    request_queue_size = socket.SOMAXCONN
+
+
+class EmbeddingServer:
+    """
+    Serves encode requests from every worker process on this machine over a Unix socket, so the
+    model is loaded once instead of once per worker. Models are loaded with the configured
+    EMBEDDING_BACKEND (PyTorch or ONNX); one asked for that isn't loaded yet is loaded on first use.
+    """
+
+    def __init__(self, socket_path, model_names=(), max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 interactive_max_texts=DEFAULT_INTERACTIVE_MAX_TEXTS):
+        self.socket_path = socket_path
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.interactive_max_texts = interactive_max_texts
+        self._workers = {}
+        self._workers_lock = threading.Lock()
+        for model_name in model_names:
+            self.get_worker(model_name)
+        self._server = None
+
+    def get_worker(self, model_name):
+        from core.utils.embeddings.embedding_service import get_embedding_model
+
+        worker = self._workers.get(model_name)
+        if worker is None:
+            with self._workers_lock:
+                worker = self._workers.get(model_name)
+                if worker is None:
+                    worker = ModelWorker(
+                        get_embedding_model(model_name, in_process=True), self.max_batch_size, self.max_wait_ms,
+                        self.interactive_max_texts,
+                    )
+                    self._workers[model_name] = worker
+        return worker
+
+    def stats(self):
+        return {model_name: worker.stats() for model_name, worker in list(self._workers.items())}
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            if ping(self.socket_path, timeout=1) is not None:
+                raise RuntimeError(f"An embedding server is already listening on {self.socket_path}")
+            os.unlink(self.socket_path) # Left behind by a server that didn't shut down cleanly
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        self._server = _UnixServer(self.socket_path, _RequestHandler)
+        self._server.embedding_server = self
+        os.chmod(self.socket_path, 0o660)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def shutdown(self):
+        if self._server is not None:
+            # serve_forever() has to return on another thread than the one calling shutdown()
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+
+def ping(socket_path, timeout=1.0):
+    """Returns the server's status, or None if nothing answers on `socket_path`."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            _send_message(sock, {"op": "ping"})
+            header, _ = _recv_message(sock)
+            return header
+    except (OSError, EOFError, ValueError):
+        return None
+
+
+def wait_for_server(socket_path, timeout):
+    """Polls until a server answers on `socket_path`; returns whether one did within `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if ping(socket_path) is not None:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+# --- Client (used by get_embedding_model when EMBEDDING_SERVER_SOCKET is set) ---
+
+class EmbeddingClient:
+    """
+    Stand-in for a local model that sends encode() calls to the embedding server. Each thread
+    keeps its own connection. Calls larger than `batch_size` are sent as several requests, so the
+    server can fit chat queries in between a long ingestion run's batches.
+
+    If the server can't be reached, the texts are encoded with an in-process model instead
+    (loaded on first need), and the server is tried again after `retry_seconds`. Both paths take
+    the same encode() arguments: normalize_embeddings is applied here to the server's vectors,
+    and anything else the server couldn't honor is rejected rather than dropped.
+    """
+
+    def __init__(self, socket_path, model_name, timeout=DEFAULT_TIMEOUT_SECONDS, retry_seconds=DEFAULT_RETRY_SECONDS):
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.timeout = timeout
+        self.retry_seconds = retry_seconds
+        self._local = threading.local()
+        self._down_until = 0.0
+        self._dimension = None
+
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.remote_texts = 0
+        self.local_texts = 0
+        self.failures = 0
+        self.last_error = ""
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, normalize_embeddings=False, **kwargs):
+        if kwargs:
+            raise TypeError(f"EmbeddingClient.encode() doesn't support {', '.join(sorted(kwargs))}")
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype="float32")
+
+        if self._server_up():
+            try:
+                step = max(1, batch_size)
+                vectors = np.vstack([self._request(texts[start:start + step], step) for start in range(0, len(texts), step)])
+                if normalize_embeddings:
+                    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                return vectors[0] if single else vectors
+            except EmbeddingServerUnavailable as e:
+                self._mark_down(e)
+
+        with self._stats_lock:
+            self.local_texts += len(texts)
+        return self._local_model().encode(
+            sentences, batch_size=batch_size, show_progress_bar=show_progress_bar, normalize_embeddings=normalize_embeddings,
+        )
+
+    def get_sentence_embedding_dimension(self):
+        if self._dimension is None and self._server_up():
+            try:
+                self._dimension = int(self._call({"op": "dimension", "model": self.model_name})[0]["dimension"])
+            except EmbeddingServerUnavailable as e:
+                self._mark_down(e)
+        if self._dimension is None:
+            return self._local_model().get_sentence_embedding_dimension()
+        return self._dimension
+
+    def _server_up(self):
+        return time.monotonic() >= self._down_until
+
+    def _mark_down(self, error):
+        self._down_until = time.monotonic() + self.retry_seconds
+        with self._stats_lock:
+            self.failures += 1
+            self.last_error = str(error)
+        logger.warning(f"Embedding server unavailable ({error}); encoding in-process for {self.retry_seconds}s")
+
+    def _local_model(self):
+        from core.utils.embeddings.embedding_service import get_embedding_model
+
+        return get_embedding_model(self.model_name, in_process=True)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "socket": self.socket_path,
+                "requests": self.requests,
+                "remote_texts": self.remote_texts,
+                "local_texts": self.local_texts,
+                "failures": self.failures,
+                "last_error": self.last_error,
+                "using_server": self._server_up(),
+            }
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            deadline = time.monotonic() + CONNECT_BACKLOG_RETRY_SECONDS
+            while sock is None:
+                attempt = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                attempt.settimeout(self.timeout)
+                try:
+                    attempt.connect(self.socket_path)
+                    sock = attempt
+                except BlockingIOError:
+                    # Backlog full: the server is busy accepting, not gone
+                    attempt.close()
+                    if time.monotonic() >= deadline:
+                        raise
+                    time.sleep(0.01)
+                except OSError:
+                    attempt.close()
+                    raise
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _call(self, request):
+        """Sends one request on this thread's connection; returns the (header, body) of an ok response."""
+        try:
+            sock = self._connection()
+            _send_message(sock, request)
+            header, body = _recv_message(sock)
+        except (OSError, EOFError, ValueError) as e:
+            # Timed out or cut off mid-message: the connection can't be reused
+            self._close()
+            raise EmbeddingServerUnavailable(str(e) or type(e).__name__) from e
+        if not header.get("ok"):
+            raise EmbeddingServerError(header.get("error", "unknown error"))
+        return header, body
+
+    def _request(self, texts, batch_size):
+        header, body = self._call({"op": "encode", "model": self.model_name, "texts": texts, "batch_size": batch_size})
+        with self._stats_lock:
+            self.requests += 1
+            self.remote_texts += len(texts)
+        vectors = np.frombuffer(body, dtype="<f4").reshape(header["shape"]).astype("float32")
+        self._dimension = vectors.shape[1]
+        return vectors
+
+    def _reset_after_fork(self):
+        # The parent's connections must not be shared with the child
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+
+# --- Process-wide clients (one per model) ---
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_embedding_client(model_name, socket_path):
+    client = _clients.get(model_name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(model_name)
+            if client is None:
+                client = EmbeddingClient(
+                    socket_path, model_name,
+                    timeout=getattr(settings, "EMBEDDING_SERVER_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS),
+                    retry_seconds=getattr(settings, "EMBEDDING_SERVER_RETRY_SECONDS", DEFAULT_RETRY_SECONDS),
+                )
+                _clients[model_name] = client
+    return client
+
+
+def get_embedding_client_stats():
+    return {model_name: client.stats() for model_name, client in _clients.items()}
+
+
+def _reset_clients_after_fork():
+    for client in _clients.values():
+        client._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
@@ -1,7 +1,132 @@
 # embeddings/embedding_service.py
 
-from sentence_transformers import SentenceTransformer
+import logging
+import threading
+import time
 
-def get_embedding_model():
-    # You can change the model name based on your needs
-    return SentenceTransformer('all-MiniLM-L6-v2')
+from django.conf import settings
+
+from core.utils.embeddings.onnx_encoder import BACKEND_TORCH, OnnxModelUnavailable, get_embedding_backend, load_onnx_encoder
+
+try:
+    import psutil # Optional: used only to report memory usage of loaded models
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
+# --- Process-wide model registry ---
+# Each model is loaded once per worker process and shared by every request/thread.
+_models = {}
+_model_stats = {}
+_registry_lock = threading.Lock()
+
+
+def _get_rss_bytes():
+    if psutil is None:
+        return None
+    try:
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+def get_default_model_name():
+    # You can change the model name based on your needs via settings.EMBEDDING_MODEL_NAME
+    return getattr(settings, "EMBEDDING_MODEL_NAME", DEFAULT_EMBEDDING_MODEL)
+
+
+def _load_model(model_name):
+    """
+    Returns (model, backend) for settings.EMBEDDING_BACKEND. The ONNX backends need the model
+    exported first (manage.py export_onnx_model); without it the PyTorch model is used instead.
+    """
+    backend = get_embedding_backend()
+    if backend != BACKEND_TORCH:
+        try:
+            return load_onnx_encoder(model_name, backend), backend
+        except OnnxModelUnavailable as e:
+            logger.warning(f"Embedding backend '{backend}' unavailable for '{model_name}' ({e}); using PyTorch")
+    # Imported here so ONNX-only workers never import torch
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name), BACKEND_TORCH
+
+
+def get_embedding_model(model_name=None, in_process=False):
+    """
+    Returns the shared embedding model for `model_name`, loading it on first use: a
+    SentenceTransformer, or an OnnxSentenceEncoder with EMBEDDING_BACKEND="onnx" / "onnx_int8"
+    (same encode() interface and compatible vectors, see onnx_encoder.py).
+
+    With settings.EMBEDDING_SERVER_SOCKET set, returns an EmbeddingClient for the embedding server
+    on that socket instead (see embedding_server.py), unless `in_process` is true.
+
+    The model is loaded at most once per process, even if several threads ask for it at the
+    same time. Subsequent calls are a dictionary lookup.
+    """
+    model_name = model_name or get_default_model_name()
+    socket_path = getattr(settings, "EMBEDDING_SERVER_SOCKET", "")
+    if socket_path and not in_process:
+        from core.utils.embeddings.embedding_server import get_embedding_client
+        return get_embedding_client(model_name, socket_path)
+
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        # Another thread may have finished loading while we were waiting for the lock
+        model = _models.get(model_name)
+        if model is not None:
+            return model
+
+        rss_before = _get_rss_bytes()
+        started = time.perf_counter()
+        model, backend = _load_model(model_name)
+        load_seconds = time.perf_counter() - started
+        rss_after = _get_rss_bytes()
+
+        _models[model_name] = model
+        _model_stats[model_name] = {
+            "model_name": model_name,
+            "backend": backend,
+            "load_seconds": round(load_seconds, 3),
+            "loaded_at": time.time(),
+            "rss_delta_bytes": (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+            "rss_after_bytes": rss_after,
+        }
+        logger.info(f"Loaded embedding model '{model_name}' ({backend}) in {load_seconds:.2f}s")
+        return model
+
+
+def preload_embedding_models():
+    """
+    Loads every model listed in settings.EMBEDDING_PRELOAD_MODELS (defaults to the default model).
+    Called from the post_worker_init hook in gunicorn.conf.py (when EMBEDDING_PRELOAD is set) so
+    the first chat request on a worker doesn't pay the model load. With an embedding server, only
+    the client is set up.
+    """
+    model_names = getattr(settings, "EMBEDDING_PRELOAD_MODELS", None) or [get_default_model_name()]
+    for model_name in model_names:
+        try:
+            get_embedding_model(model_name)
+        except Exception as e:
+            logger.error(f"Failed to preload embedding model '{model_name}': {e}", exc_info=True)
+
+
+def get_model_stats():
+    """Returns load time and memory stats for every model loaded in this process."""
+    return {
+        "loaded_models": list(_models.keys()),
+        "models": {name: dict(stats) for name, stats in _model_stats.items()},
+        "process_rss_bytes": _get_rss_bytes(),
+    }
+
+
+def clear_embedding_models():
+    """Drops all loaded models (mainly useful in tests or after a fork that should not share them)."""
+    with _registry_lock:
+        _models.clear()
+        _model_stats.clear()
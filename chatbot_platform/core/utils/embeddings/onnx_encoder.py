@@ -0,0 +1,251 @@
+# embeddings/onnx_encoder.py
+
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import onnxruntime # Optional: only needed with EMBEDDING_BACKEND="onnx" / "onnx_int8"
+except ImportError:
+    onnxruntime = None
+
+logger = logging.getLogger(__name__)
+
+BACKEND_TORCH = "torch"
+BACKEND_ONNX = "onnx"
+BACKEND_ONNX_INT8 = "onnx_int8"
+BACKENDS = (BACKEND_TORCH, BACKEND_ONNX, BACKEND_ONNX_INT8)
+
+MODEL_FILES = {BACKEND_ONNX: "model.onnx", BACKEND_ONNX_INT8: "model_int8.onnx"}
+TOKENIZER_FILE = "tokenizer.json"
+CONFIG_FILE = "encoder_config.json"
+ONNX_OPSET = 14
+
+# Lowest cosine similarity to the PyTorch model's vectors an export may have on the sample texts.
+# Below this, its vectors would rank an existing index's chunks differently from the ones they were stored with.
+DEFAULT_MIN_COSINE = {BACKEND_ONNX: 0.999, BACKEND_ONNX_INT8: 0.98}
+
+
+class OnnxModelUnavailable(Exception):
+    """The ONNX backend can't be used: onnxruntime is missing or the model wasn't exported."""
+
+
+def get_embedding_backend():
+    backend = getattr(settings, "EMBEDDING_BACKEND", BACKEND_TORCH)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+    return backend
+
+
+def get_export_dir(model_name):
+    """Where export_onnx_model writes `model_name` (settings.EMBEDDING_ONNX_DIR, one folder per model)."""
+    root = getattr(settings, "EMBEDDING_ONNX_DIR", "") or os.path.join(settings.BASE_DIR, "onnx_models")
+    return Path(root) / re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name)
+
+
+class OnnxSentenceEncoder:
+    """
+    Runs an exported sentence-transformers model with ONNX Runtime: tokenizer.json through the
+    `tokenizers` library, the transformer in an InferenceSession, then the same pooling and
+    normalization as the original model. encode() takes the arguments the rest of the code passes
+    to SentenceTransformer.encode, so either can be handed to vector_logic or the query encoder.
+
+    Sequences are sorted by length before batching (as SentenceTransformer does) to keep padding low.
+    """
+
+    def __init__(self, export_dir, backend=BACKEND_ONNX, threads=0):
+        if onnxruntime is None:
+            raise OnnxModelUnavailable("onnxruntime is not installed")
+        export_dir = Path(export_dir)
+        model_path = export_dir / MODEL_FILES[backend]
+        if not model_path.exists() or not (export_dir / CONFIG_FILE).exists():
+            raise OnnxModelUnavailable(f"{model_path} not found; run manage.py export_onnx_model")
+        from tokenizers import Tokenizer
+
+        with open(export_dir / CONFIG_FILE, encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.backend = backend
+        self.max_seq_length = self.config["max_seq_length"]
+
+        self.tokenizer = Tokenizer.from_file(str(export_dir / TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self._input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        sentences = list(sentences)
+        dimension = self.get_sentence_embedding_dimension()
+        if not sentences:
+            return np.zeros((0, dimension), dtype="float32")
+
+        order = np.argsort([-len(sentence) for sentence in sentences], kind="stable")
+        embeddings = np.empty((len(sentences), dimension), dtype="float32")
+        batch_size = max(1, batch_size)
+        for start in range(0, len(sentences), batch_size):
+            positions = order[start:start + batch_size]
+            embeddings[positions] = self._encode_batch([sentences[pos] for pos in positions])
+
+        if self.config["normalize"] or normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype="int64")
+        feeds = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype="int64"),
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype="int64"),
+        }
+        token_embeddings = self.session.run(None, {name: feeds[name] for name in self._input_names})[0]
+
+        if self.config["pooling"] == "cls":
+            return token_embeddings[:, 0]
+        mask = attention_mask[:, :, None].astype("float32")
+        return (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+
+def load_onnx_encoder(model_name, backend):
+    return OnnxSentenceEncoder(
+        get_export_dir(model_name), backend, threads=getattr(settings, "EMBEDDING_ONNX_THREADS", 0),
+    )
+
+
+# --- Export (needs torch + sentence-transformers, and the onnx package for int8; run at build time) ---
+
+def _pooling_mode(model):
+    from sentence_transformers import models
+
+    modules = list(model)
+    if not isinstance(modules[0], models.Transformer) or len(modules) < 2 or not isinstance(modules[1], models.Pooling):
+        raise ValueError("Only Transformer -> Pooling [-> Normalize] models can be exported")
+    if any(not isinstance(module, models.Normalize) for module in modules[2:]):
+        raise ValueError("Models with layers after pooling (e.g. Dense) can't be exported")
+    pooling = modules[1].get_config_dict()
+    # "pooling_mode" in newer sentence-transformers, one flag per mode before
+    mode = pooling.get("pooling_mode")
+    if mode is None:
+        mode = "mean" if pooling.get("pooling_mode_mean_tokens") else "cls" if pooling.get("pooling_mode_cls_token") else None
+    if mode not in ("mean", "cls"):
+        raise ValueError("Only mean or CLS pooling can be exported")
+    return mode, any(isinstance(module, models.Normalize) for module in modules[2:])
+
+
+def export_onnx_model(reference_model, export_dir, quantize=True):
+    """
+    Exports a loaded SentenceTransformer to `export_dir`: model.onnx (fp32), model_int8.onnx
+    (dynamically quantized weights, if `quantize`), tokenizer.json and encoder_config.json.
+    """
+    import torch
+
+    pooling, normalize = _pooling_mode(reference_model)
+    transformer = reference_model[0]
+    tokenizer = transformer.tokenizer
+    if not getattr(tokenizer, "is_fast", False):
+        raise ValueError("The model needs a fast (tokenizers) tokenizer to run without transformers")
+    export_dir = Path(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+
+    sample = tokenizer(["export sample", "a longer export sample sentence"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    auto_model = transformer.auto_model.to("cpu").eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(auto_model),
+            tuple(sample[name] for name in input_names),
+            str(export_dir / MODEL_FILES[BACKEND_ONNX]),
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["token_embeddings"]},
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(
+            str(export_dir / MODEL_FILES[BACKEND_ONNX]), str(export_dir / MODEL_FILES[BACKEND_ONNX_INT8]),
+            weight_type=QuantType.QInt8,
+        )
+
+    tokenizer.backend_tokenizer.save(str(export_dir / TOKENIZER_FILE))
+    config = {
+        "pooling": pooling,
+        "normalize": normalize,
+        "max_seq_length": transformer.max_seq_length,
+        "dimension": reference_model.get_sentence_embedding_dimension(),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+    }
+    with open(export_dir / CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def compare_encoders(reference_vectors, vectors, top_k=10):
+    """
+    How closely `vectors` (ONNX) match `reference_vectors` (PyTorch) for the same texts: per-text
+    cosine similarity, and recall@top_k of each text's nearest neighbours among the others
+    (what an existing index would return for it as a query).
+    """
+    a = reference_vectors / np.maximum(np.linalg.norm(reference_vectors, axis=1, keepdims=True), 1e-12)
+    b = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    cosine = (a * b).sum(axis=1)
+    top_k = min(top_k, len(a) - 1)
+    recall = None
+    if top_k > 0:
+        expected = a @ a.T
+        found = b @ a.T # New query vectors against the stored (reference) vectors
+        np.fill_diagonal(expected, -np.inf)
+        np.fill_diagonal(found, -np.inf)
+        expected_ids = np.argsort(-expected, axis=1)[:, :top_k]
+        found_ids = np.argsort(-found, axis=1)[:, :top_k]
+        recall = float(np.mean([len(set(e) & set(f)) / top_k for e, f in zip(expected_ids, found_ids)]))
+    return {
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "max_abs_diff": float(np.abs(a - b).max()),
+        f"recall@{top_k}": recall,
+    }
+
+
+def publish_export(staging_dir, export_dir):
+    """Swaps a verified export into place, so a failed export never replaces a working one."""
+    export_dir = Path(export_dir)
+    export_dir.parent.mkdir(parents=True, exist_ok=True)
+    previous = None
+    if export_dir.exists():
+        previous = Path(tempfile.mkdtemp(prefix=export_dir.name + ".old.", dir=export_dir.parent))
+        os.replace(export_dir, previous / "export")
+    os.chmod(staging_dir, 0o755) # mkdtemp creates it private to this user
+    os.replace(staging_dir, export_dir)
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
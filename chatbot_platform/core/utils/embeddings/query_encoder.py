@@ -0,0 +1,237 @@
+# embeddings/query_encoder.py
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import numpy as np
+from django.conf import settings
+
+from core.utils.embeddings.embedding_service import get_default_model_name, get_embedding_model
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5
+DEFAULT_CACHE_SIZE = 2048
+RECENT_BATCHES_KEPT = 20
+
+
+class QueryEncoder:
+    """
+    Encodes chat queries for one model, batching concurrent requests.
+
+    Request threads hand their query to a background thread, which waits up to `max_wait_ms`
+    for other queries to arrive (or until `max_batch_size` are queued) and encodes them in a
+    single model.encode() call. A query that is already queued or being encoded just waits
+    for that result instead of being encoded again, and recent query vectors are kept in an LRU keyed by normalized text, so repeated questions skip the
+    model entirely.
+
+    encode() takes the same arguments as SentenceTransformer.encode for a list of sentences,
+    so an encoder can be passed anywhere a model is expected for query-time encoding
+    (e.g. search_similar_chunks).
+    """
+
+    def __init__(self, model, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS, cache_size=DEFAULT_CACHE_SIZE):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max(0, max_wait_ms) / 1000
+        self.cache_size = cache_size
+        # Casing only matters if the tokenizer keeps it (all-MiniLM-L6-v2 lowercases anyway)
+        self._fold_case = bool(getattr(getattr(model, "tokenizer", None), "do_lower_case", False))
+
+        self._cache = OrderedDict()
+        self._pending = {} # normalized text -> futures waiting for it; guarded by _cache_lock
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.queries = 0
+        self.cache_hits = 0
+        self.deduplicated = 0
+        self.batches = 0
+        self.encoded = 0
+        self.encode_seconds = 0.0
+        self.largest_batch = 0
+        self._recent_batches = deque(maxlen=RECENT_BATCHES_KEPT)
+
+    def normalize(self, text):
+        text = " ".join(text.split())
+        return text.lower() if self._fold_case else text
+
+    # --- public API ---
+
+    def encode(self, sentences, **kwargs):
+        """Returns float32 vectors for `sentences` (a string or list of strings), shape like model.encode."""
+        if isinstance(sentences, str):
+            return self.encode_query(sentences)
+        # Submit everything before waiting so the sentences can share a batch
+        futures = [self._submit(sentence) for sentence in sentences]
+        vectors = [future.result() for future in futures]
+        return np.vstack(vectors) if vectors else np.zeros((0, 0), dtype="float32")
+
+    def encode_query(self, text):
+        return self._submit(text).result()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queries": self.queries,
+                "cache_hits": self.cache_hits,
+                "deduplicated": self.deduplicated,
+                "batches": self.batches,
+                "encoded": self.encoded,
+                "avg_batch_size": round(self.encoded / self.batches, 2) if self.batches else 0,
+                "largest_batch": self.largest_batch,
+                "avg_encode_ms": round(1000 * self.encode_seconds / self.batches, 2) if self.batches else 0,
+                "cache_entries": len(self._cache),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_seconds * 1000,
+                "recent_batches": list(self._recent_batches),
+            }
+
+    # --- internals ---
+
+    def _submit(self, text):
+        key = self.normalize(text)
+        future = Future()
+        in_flight = False
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+            elif key in self._pending:
+                self._pending[key].append(future)
+                in_flight = True
+            else:
+                self._pending[key] = [future]
+        with self._stats_lock:
+            self.queries += 1
+            if vector is not None:
+                self.cache_hits += 1
+            elif in_flight:
+                self.deduplicated += 1
+        if vector is not None:
+            future.set_result(vector)
+        elif not in_flight:
+            self._ensure_thread()
+            self._queue.put((key, time.monotonic()))
+        return future
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="query-encoder", daemon=True)
+                self._thread.start()
+
+    def _reset_after_fork(self):
+        # The batching thread doesn't survive a fork, and anything it had queued belongs to the parent
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            keys = [key for key, _ in batch] # Unique: repeats wait in _pending instead of being queued
+
+            started = time.monotonic()
+            try:
+                vectors = np.asarray(self.model.encode(keys, batch_size=len(keys), show_progress_bar=False), dtype="float32")
+            except Exception as e:
+                logger.error(f"Query encoding failed for a batch of {len(keys)}", exc_info=True)
+                with self._cache_lock:
+                    waiting = [self._pending.pop(key, []) for key in keys]
+                for futures in waiting:
+                    for future in futures:
+                        future.set_exception(e)
+                continue
+            encode_seconds = time.monotonic() - started
+
+            with self._cache_lock:
+                waiting = []
+                for key, vector in zip(keys, vectors):
+                    vector.setflags(write=False) # Shared between callers and the cache
+                    self._cache[key] = vector
+                    self._cache.move_to_end(key)
+                    waiting.append(self._pending.pop(key, []))
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+            requests = 0
+            for vector, futures in zip(vectors, waiting):
+                requests += len(futures)
+                for future in futures:
+                    future.set_result(vector)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.encoded += len(keys)
+                self.encode_seconds += encode_seconds
+                self.largest_batch = max(self.largest_batch, len(keys))
+                self._recent_batches.append({
+                    "size": len(keys),
+                    "requests": requests,
+                    "wait_ms": round(1000 * (started - batch[0][1]), 2),
+                    "encode_ms": round(1000 * encode_seconds, 2),
+                })
+
+
+# --- Process-wide encoder registry (one per embedding model) ---
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_query_encoder(model_name=None):
+    """Returns the shared QueryEncoder for `model_name`, configured from settings.QUERY_ENCODER_*."""
+    model_name = model_name or get_default_model_name()
+    encoder = _encoders.get(model_name)
+    if encoder is not None:
+        return encoder
+
+    with _encoders_lock:
+        encoder = _encoders.get(model_name)
+        if encoder is None:
+            encoder = QueryEncoder(
+                get_embedding_model(model_name),
+                max_batch_size=getattr(settings, "QUERY_ENCODER_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE),
+                max_wait_ms=getattr(settings, "QUERY_ENCODER_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS),
+                cache_size=getattr(settings, "QUERY_ENCODER_CACHE_SIZE", DEFAULT_CACHE_SIZE),
+            )
+            _encoders[model_name] = encoder
+        return encoder
+
+
+def _reset_encoders_after_fork():
+    for encoder in _encoders.values():
+        encoder._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_encoders_after_fork)
+
+
+def get_query_encoder_stats():
+    return {model_name: encoder.stats() for model_name, encoder in _encoders.items()}
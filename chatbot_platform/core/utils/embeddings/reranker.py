@@ -0,0 +1,180 @@
+# embeddings/reranker.py
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CANDIDATES = 20
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_BUDGET_MS = 150
+RECENT_CALLS_KEPT = 20
+
+
+class Reranker:
+    """
+    Reorders retrieved chunks by a cross-encoder's relevance score for each (query, chunk) pair.
+
+    Retrieval hands over more candidates than the chat needs; the cross-encoder reads query and
+    chunk together, which ranks far better than comparing two independent embeddings, and
+    only the best `top_k` are kept for the prompt.
+
+    Pairs are scored in batches of `batch_size` against a per-request time budget. Before each
+    batch, the time it will take is estimated from the recent cost per pair; if it would not
+    finish within the budget, scoring stops and the candidates are returned in retrieval order,
+    so a slow instance or unusually long chunks don't hold a chat request much past the budget.
+    The estimate is seeded by warm_up() when the model loads; without it the first request's
+    first batch runs unchecked. A batch that has started is never interrupted, so one batch
+    running slower than estimated can still overrun.
+    """
+
+    def __init__(self, model, batch_size=DEFAULT_BATCH_SIZE, budget_ms=DEFAULT_BUDGET_MS):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.budget_seconds = max(0, budget_ms) / 1000
+        self._seconds_per_pair = None # Moving average over recent batches; None until warm_up or the first one
+
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.reranked = 0
+        self.fallbacks = 0
+        self.pairs_scored = 0
+        self.rerank_seconds = 0.0
+        self._recent_calls = deque(maxlen=RECENT_CALLS_KEPT)
+
+    def warm_up(self):
+        """
+        Runs the model once to finish its lazy initialization (untimed), then scores one full
+        batch of dummy pairs to seed the cost-per-pair estimate before any request relies on it.
+        """
+        self.model.predict([("warm up", "warm up")], show_progress_bar=False)
+        pairs = [("warm up query", "warm up passage " * 32)] * self.batch_size
+        started = time.perf_counter()
+        self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        self._observe(len(pairs), time.perf_counter() - started)
+
+    def rerank(self, query, candidates, top_k, budget_ms=None):
+        """
+        Returns (best `top_k` candidates, info). info has "reranked" (False when the budget ran
+        out and the retrieval order was kept), "candidates", "scored" and "rerank_ms".
+        """
+        budget_seconds = self.budget_seconds if budget_ms is None else max(0, budget_ms) / 1000
+        started = time.perf_counter()
+        deadline = started + budget_seconds
+
+        scores = []
+        seconds_per_pair = self._seconds_per_pair # This request's own batches count as soon as we have one
+        for start in range(0, len(candidates), self.batch_size):
+            batch = candidates[start:start + self.batch_size]
+            if seconds_per_pair is not None and time.perf_counter() + seconds_per_pair * len(batch) > deadline:
+                break
+            batch_started = time.perf_counter()
+            scores.extend(float(score) for score in self.model.predict(
+                [(query, text) for text in batch], batch_size=len(batch), show_progress_bar=False,
+            ))
+            batch_seconds = time.perf_counter() - batch_started
+            self._observe(len(batch), batch_seconds)
+            seconds_per_pair = max(seconds_per_pair or 0.0, batch_seconds / len(batch))
+
+        reranked = len(scores) == len(candidates)
+        if reranked:
+            order = sorted(range(len(candidates)), key=lambda i: -scores[i])
+            results = [candidates[i] for i in order[:top_k]]
+        else:
+            results = list(candidates[:top_k])
+        elapsed = time.perf_counter() - started
+
+        info = {
+            "reranked": reranked,
+            "candidates": len(candidates),
+            "scored": len(scores),
+            "rerank_ms": round(1000 * elapsed, 2),
+        }
+        with self._stats_lock:
+            self.calls += 1
+            self.pairs_scored += len(scores)
+            self.rerank_seconds += elapsed
+            if reranked:
+                self.reranked += 1
+            else:
+                self.fallbacks += 1
+            self._recent_calls.append(info)
+        if not reranked:
+            logger.warning(f"Rerank budget of {1000 * budget_seconds:.0f} ms ran out after {len(scores)}/{len(candidates)} pairs; kept retrieval order")
+        return results, info
+
+    def _observe(self, pairs, seconds):
+        per_pair = seconds / max(pairs, 1)
+        if self._seconds_per_pair is None:
+            self._seconds_per_pair = per_pair
+        else:
+            self._seconds_per_pair = 0.8 * self._seconds_per_pair + 0.2 * per_pair
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "calls": self.calls,
+                "reranked": self.reranked,
+                "fallbacks": self.fallbacks,
+                "pairs_scored": self.pairs_scored,
+                "avg_rerank_ms": round(1000 * self.rerank_seconds / self.calls, 2) if self.calls else 0,
+                "ms_per_pair": round(1000 * self._seconds_per_pair, 3) if self._seconds_per_pair is not None else None,
+                "batch_size": self.batch_size,
+                "budget_ms": self.budget_seconds * 1000,
+                "recent_calls": list(self._recent_calls),
+            }
+
+    def _reset_after_fork(self):
+        self._stats_lock = threading.Lock()
+
+
+# --- Process-wide reranker (loaded once per worker, like the embedding models) ---
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """
+    Returns the shared Reranker for settings.RERANK_MODEL_NAME, loading the cross-encoder on
+    first use, or None when reranking is disabled (RERANK_MODEL_NAME empty).
+    """
+    global _reranker
+    model_name = getattr(settings, "RERANK_MODEL_NAME", "")
+    if not model_name:
+        return None
+    if _reranker is not None:
+        return _reranker
+
+    with _reranker_lock:
+        if _reranker is None:
+            from sentence_transformers import CrossEncoder # Only imported (with torch) when reranking is on
+
+            started = time.perf_counter()
+            reranker = Reranker(
+                CrossEncoder(model_name),
+                batch_size=getattr(settings, "RERANK_BATCH_SIZE", DEFAULT_BATCH_SIZE),
+                budget_ms=getattr(settings, "RERANK_BUDGET_MS", DEFAULT_BUDGET_MS),
+            )
+            reranker.warm_up() # Keep lazy initialization out of request budgets and seed the estimate
+            logger.info(f"Loaded rerank model '{model_name}' in {time.perf_counter() - started:.2f}s "
+                        f"({1000 * reranker._seconds_per_pair:.2f} ms per pair)")
+            _reranker = reranker
+        return _reranker
+
+
+def get_reranker_stats():
+    return _reranker.stats() if _reranker is not None else {"enabled": bool(getattr(settings, "RERANK_MODEL_NAME", ""))}
+
+
+def _reset_reranker_after_fork():
+    if _reranker is not None:
+        _reranker._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_reranker_after_fork)
@@ -1,7 +1,20 @@
 # core/utils/file_reader.py
 
+import io
 import os
+import math
+import time
+import shutil
+import tempfile
+import itertools
+import multiprocessing
 import logging # Import the logging module
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import NamedTuple, Optional
+
+from django.conf import settings
 
 logger = logging.getLogger(__name__) # Get a logger instance for this module
 
@@ -19,58 +32,244 @@ except ImportError:
     Document = None
     logger.warning("python-docx not installed. DOCX files will not be processed.")
 
-# Function to extract text from a Django FileField object
-def extract_text_from_file(file_field_object):
+# Text files are yielded paragraph by paragraph; a "paragraph" with no blank lines is cut at this size
+MAX_TEXT_SECTION_CHARS = 64 * 1024
+
+
+class TextExtractionError(Exception):
+    """Raised by iter_text_sections when a file can't be read; the message is user-facing."""
+
+
+class TextSection(NamedTuple):
     """
-    Extracts text content from a Django FileField object (e.g., kb.file).
-    It handles .txt, .pdf, and .docx files by opening them in binary mode from storage.
+    One piece of a document as it streams out of iter_text_sections.
+
+    page_number/page_count are set for PDFs (1-based), paragraph_index for DOCX/TXT paragraphs.
+    char_offset is the position of this section in the text extract_text_from_file would return.
+    extract_seconds is the time pypdf spent extracting the page (PDFs only).
+    """
+    text: str
+    page_number: Optional[int] = None
+    page_count: Optional[int] = None
+    paragraph_index: Optional[int] = None
+    char_offset: int = 0
+    extract_seconds: Optional[float] = None
+
+
+# Joined between sections by extract_text_from_file (and counted in char_offset)
+SECTION_SEPARATOR = "\n"
+
+
+def _iter_txt_sections(f):
+    # Decode incrementally and group lines into paragraphs at blank lines
+    stream = io.TextIOWrapper(f, encoding='utf-8', errors='ignore')
+    lines = []
+    size = 0
+    paragraph_index = 0
+    for line in stream:
+        if not line.strip():
+            if lines:
+                yield "".join(lines), paragraph_index
+                paragraph_index += 1
+                lines, size = [], 0
+            continue
+        lines.append(line)
+        size += len(line)
+        if size >= MAX_TEXT_SECTION_CHARS:
+            yield "".join(lines), paragraph_index
+            paragraph_index += 1
+            lines, size = [], 0
+    if lines:
+        yield "".join(lines), paragraph_index
+
+
+def iter_text_sections(file_field_object, parallel=None):
+    """
+    Streams the text of a Django FileField object (e.g., kb.file) one section at a time:
+    one page per PDF page, one paragraph per DOCX/TXT paragraph. Only the current section
+    is held in memory (python-docx still parses the whole DOCX up front).
+
+    Large PDFs (settings.PDF_PARALLEL_PAGE_THRESHOLD pages or more) are extracted by a process
+    pool of settings.PDF_EXTRACTION_WORKERS; pages are still yielded in order.
 
     Args:
         file_field_object: A Django FileField instance (e.g., kb.file from a model instance).
+        parallel (bool): Force (True) or disable (False) parallel PDF extraction; None picks by page count.
 
-    Returns:
-        str: The extracted text content, or an error message if unsupported/failed.
+    Yields:
+        TextSection: Non-empty sections in document order.
+
+    Raises:
+        TextExtractionError: If the file is missing, unsupported or can't be parsed.
     """
     if not file_field_object:
-        return "Error: No file object provided."
+        raise TextExtractionError("No file object provided.")
 
     file_extension = os.path.splitext(file_field_object.name)[1].lower()
-    extracted_text = ""
+    if file_extension == '.pdf' and not PdfReader:
+        raise TextExtractionError("pypdf not available. Cannot process PDF files.")
+    if file_extension == '.docx' and not Document:
+        raise TextExtractionError("python-docx not available. Cannot process DOCX files.")
+    if file_extension not in ('.txt', '.pdf', '.docx'):
+        raise TextExtractionError(f"Unsupported file type: {file_extension}")
 
     try:
         # Use .open('rb') to read from any backend that django-storages supports (GCS, local, etc.).
-        with file_field_object.open('rb') as f: # Open the file from storage in binary read mode
-            if file_extension == '.txt':
-                # For text files, read binary and decode to UTF-8
-                extracted_text = f.read().decode('utf-8', errors='ignore')
-            elif file_extension == '.pdf':
-                if PdfReader: # Check for the 'pypdf' import alias now
-                    try:
-                        # pypdf.PdfReader can directly read from a file-like object
-                        reader = PdfReader(f)
-                        for page in reader.pages:
-                            page_text = page.extract_text()
-                            if page_text:
-                                extracted_text += page_text
-                    except Exception as e:
-                        logger.error(f"Error processing PDF: {file_field_object.name} - {e}", exc_info=True)
-                        extracted_text = f"Error: Could not read PDF content. Please ensure pypdf is installed and the file is valid. ({e})"
-                else:
-                    extracted_text = "Error: pypdf not available. Cannot process PDF files."
-            elif file_extension == '.docx':
-                if Document: # Check for the 'python-docx' import alias
-                    try:
-                        document = Document(f) # python-docx Document can take a file-like object
-                        extracted_text = "\n".join([paragraph.text for paragraph in document.paragraphs])
-                    except Exception as e:
-                        logger.error(f"Error processing DOCX: {file_field_object.name} - {e}", exc_info=True)
-                        extracted_text = f"Error: Could not read DOCX content. Please ensure python-docx is installed and the file is valid. ({e})"
-                else:
-                    extracted_text = "Error: python-docx not available. Cannot process DOCX files."
-            else:
-                extracted_text = f"Error: Unsupported file type: {file_extension}"
+        f = file_field_object.open('rb') # Open the file from storage in binary read mode
     except Exception as e:
         logger.error(f"Error opening or reading file from storage: {file_field_object.name} - {e}", exc_info=True)
-        extracted_text = f"Error: Could not access file from storage: {e}"
+        raise TextExtractionError(f"Could not access file from storage: {e}")
+
+    char_offset = 0
+    with f:
+        if file_extension == '.txt':
+            for text, paragraph_index in _iter_txt_sections(f):
+                yield TextSection(text, paragraph_index=paragraph_index, char_offset=char_offset)
+                char_offset += len(text) + len(SECTION_SEPARATOR)
+        elif file_extension == '.pdf':
+            try:
+                # pypdf.PdfReader can directly read from a file-like object; pages are parsed lazily
+                reader = PdfReader(f)
+                page_count = len(reader.pages)
+            except Exception as e:
+                logger.error(f"Error processing PDF: {file_field_object.name} - {e}", exc_info=True)
+                raise TextExtractionError(f"Could not read PDF content. Please ensure pypdf is installed and the file is valid. ({e})")
+
+            workers = _get_pdf_worker_count(page_count, parallel)
+            page_timings = []
+            started = time.perf_counter()
+            with nullcontext() if workers <= 1 else _local_pdf_path(file_field_object, f) as pdf_path:
+                if workers > 1:
+                    pages = _iter_pdf_pages_parallel(pdf_path, page_count, workers)
+                else:
+                    pages = _iter_pdf_pages_serial(reader, page_count)
+                try:
+                    for page_number, page_text, seconds in pages:
+                        page_timings.append((seconds, page_number))
+                        if page_text:
+                            yield TextSection(page_text, page_number=page_number, page_count=page_count,
+                                              char_offset=char_offset, extract_seconds=seconds)
+                            char_offset += len(page_text) + len(SECTION_SEPARATOR)
+                except TextExtractionError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error processing PDF: {file_field_object.name} - {e}", exc_info=True)
+                    raise TextExtractionError(f"Could not read PDF content. Please ensure pypdf is installed and the file is valid. ({e})")
+            _log_pdf_timings(file_field_object.name, page_timings, workers, time.perf_counter() - started)
+        elif file_extension == '.docx':
+            try:
+                document = Document(f) # python-docx Document can take a file-like object
+            except Exception as e:
+                logger.error(f"Error processing DOCX: {file_field_object.name} - {e}", exc_info=True)
+                raise TextExtractionError(f"Could not read DOCX content. Please ensure python-docx is installed and the file is valid. ({e})")
+            for paragraph_index, paragraph in enumerate(document.paragraphs):
+                if paragraph.text:
+                    yield TextSection(paragraph.text, paragraph_index=paragraph_index, char_offset=char_offset)
+                    char_offset += len(paragraph.text) + len(SECTION_SEPARATOR)
+
+
+# --- PDF page extraction (serial or process pool) ---
+
+def _get_pdf_worker_count(page_count, parallel):
+    if parallel is False:
+        return 1
+    workers = getattr(settings, "PDF_EXTRACTION_WORKERS", None) or min(4, os.cpu_count() or 1)
+    threshold = getattr(settings, "PDF_PARALLEL_PAGE_THRESHOLD", 50)
+    if parallel is None and page_count < threshold:
+        return 1
+    if multiprocessing.current_process().daemon:
+        # Daemonic processes (e.g. some pool workers) can't start children of their own
+        return 1
+    return max(1, min(workers, page_count))
+
+
+def _extract_pdf_page_range(pdf_path, first_page, last_page):
+    # Runs in a worker process: returns [(page_number, text, seconds), ...] for the range
+    reader = PdfReader(pdf_path)
+    results = []
+    for page_number in range(first_page, last_page + 1):
+        started = time.perf_counter()
+        page_text = reader.pages[page_number - 1].extract_text() or ""
+        results.append((page_number, page_text, time.perf_counter() - started))
+    return results
+
+
+def _iter_pdf_pages_serial(reader, page_count):
+    for page_number in range(1, page_count + 1):
+        started = time.perf_counter()
+        page_text = reader.pages[page_number - 1].extract_text() or ""
+        yield page_number, page_text, time.perf_counter() - started
+
+
+def _iter_pdf_pages_parallel(pdf_path, page_count, workers):
+    # Several small ranges per worker keeps the pool balanced when some pages are much slower
+    range_size = max(1, math.ceil(page_count / (workers * 4)))
+    ranges = iter([(first, min(first + range_size - 1, page_count)) for first in range(1, page_count + 1, range_size)])
+
+    # spawn, not fork: the parent may be a threaded web/celery process
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        # Only keep a bounded number of ranges in flight so finished pages don't pile up in memory
+        pending = deque(pool.submit(_extract_pdf_page_range, pdf_path, first, last)
+                        for first, last in itertools.islice(ranges, workers * 2))
+        while pending:
+            results = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range:
+                pending.append(pool.submit(_extract_pdf_page_range, pdf_path, *next_range))
+            yield from results
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+@contextmanager
+def _local_pdf_path(file_field_object, f):
+    """Worker processes need a path: use the storage's local file if there is one, else a temp copy."""
+    local_path = None
+    try:
+        local_path = file_field_object.path
+    except (NotImplementedError, ValueError, AttributeError):
+        pass # Remote storage (GCS) has no local path
+
+    if local_path and os.path.exists(local_path):
+        yield local_path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        f.seek(0)
+        shutil.copyfileobj(f, tmp)
+        tmp.flush()
+        yield tmp.name
+
+
+def _log_pdf_timings(file_name, page_timings, workers, wall_seconds):
+    if not page_timings:
+        return
+    cpu_seconds = sum(seconds for seconds, _ in page_timings)
+    slowest_seconds, slowest_page = max(page_timings)
+    logger.info(
+        f"Extracted {len(page_timings)} PDF pages from {file_name} in {wall_seconds:.2f}s "
+        f"({cpu_seconds:.2f}s page time, {workers} worker(s)); slowest page {slowest_page} took {slowest_seconds:.2f}s"
+    )
+
+
+# Function to extract text from a Django FileField object
+def extract_text_from_file(file_field_object):
+    """
+    Extracts text content from a Django FileField object (e.g., kb.file).
+    It handles .txt, .pdf, and .docx files by opening them in binary mode from storage.
+    Prefer iter_text_sections for large files; this joins every section into one string.
+
+    Args:
+        file_field_object: A Django FileField instance (e.g., kb.file from a model instance).
+
+    Returns:
+        str: The extracted text content, or an error message if unsupported/failed.
+    """
+    try:
+        # Collect parts and join once instead of growing a string page by page
+        parts = [section.text for section in iter_text_sections(file_field_object)]
+    except TextExtractionError as e:
+        return f"Error: {e}"
 
-    return extracted_text.strip() # Strip leading/trailing whitespace from the final text
\ No newline at end of file
+    return SECTION_SEPARATOR.join(parts).strip() # Strip leading/trailing whitespace from the final text
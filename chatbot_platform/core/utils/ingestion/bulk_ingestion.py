@@ -0,0 +1,588 @@
+# core/utils/ingestion/bulk_ingestion.py
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.files import File
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import KnowledgeBase, KnowledgeBaseDocument
+from core.utils.cache.response_cache import invalidate_kb_responses
+from core.utils.chunking.text_chunker import Chunk, iter_chunks
+from core.utils.embeddings.embedding_service import get_embedding_model
+from core.utils.file_reader import TextExtractionError, iter_text_sections
+from core.utils.ingestion.kb_ingestion import IngestionError, get_index_name
+from core.utils.metrics import STAGE_CHUNK, STAGE_EXTRACT, StageClock
+from core.utils.vector.chunk_store import DEFAULT_DOC_KEY
+from core.utils.vector.vector_store import get_vector_store
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".docx")
+STATE_VERSION = 1
+STATUS_STARTED = "started"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+RUN_TOKEN_PREFIX = "ingest-" # Marks embedding_task_id values that are bulk ingestion claims, not Celery task ids
+
+_DONE = object()
+
+
+class ExtractedFile(NamedTuple):
+    """One file after the extract stage (runs in a pool process, so everything here is picklable)."""
+    path: str
+    chunks: List[Chunk]
+    sections: int = 0
+    pages: int = 0
+    chars: int = 0
+    extract_seconds: float = 0.0
+    chunk_seconds: float = 0.0
+    error: Optional[str] = None
+
+
+class EncodedFile(NamedTuple):
+    extracted: ExtractedFile
+    vectors: Optional[np.ndarray]
+
+
+def find_files(paths, manifest=None):
+    """
+    Returns [(absolute path, title or None)] for the files under `paths` (files or directories,
+    walked recursively, hidden entries skipped) and in `manifest` (one path per line, optionally
+    followed by a tab and a KB title; relative paths are relative to the manifest).
+    """
+    found = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                found.extend(
+                    (os.path.join(root, name), None) for name in sorted(names)
+                    if not name.startswith(".") and os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+                )
+        else:
+            found.append((path, None))
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                path, _, title = line.partition("\t")
+                found.append((os.path.join(base, path.strip()), title.strip() or None))
+    # The same file listed twice would be ingested twice
+    seen = set()
+    return [(path, title) for path, title in found if not (path in seen or seen.add(path))]
+
+
+class _LocalFile:
+    """What iter_text_sections needs from a FileField, for a file on local disk."""
+
+    def __init__(self, path):
+        self.name = path
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def __bool__(self):
+        return True
+
+    def open(self, mode="rb"):
+        return open(self.path, mode)
+
+
+def extract_file(path):
+    """Extract + chunk one file (runs in a pool process). Errors are returned, not raised."""
+    clock = StageClock() # Only used to split extract / chunk time; nothing is observed
+    sections = pages = chars = 0
+
+    def counted(source):
+        nonlocal sections, pages, chars
+        for section in source:
+            sections += 1
+            pages = max(pages, section.page_count or 0)
+            chars += len(section.text)
+            yield section
+
+    try:
+        # parallel=False: pool processes can't start pools of their own, and the files already run in parallel
+        section_iter = clock.timed_iter(counted(iter_text_sections(_LocalFile(path), parallel=False)), STAGE_EXTRACT)
+        chunks = list(clock.timed_iter(iter_chunks(section_iter, os.path.splitext(path)[1]), STAGE_CHUNK, exclude=STAGE_EXTRACT))
+        error = None
+    except (TextExtractionError, OSError) as e:
+        chunks, error = [], str(e)
+    return ExtractedFile(
+        path, chunks, sections, pages, chars,
+        clock.seconds.get(STAGE_EXTRACT, 0.0), clock.seconds.get(STAGE_CHUNK, 0.0), error,
+    )
+
+
+class PrecomputedEncoder:
+    """
+    Model stand-in handed to VectorStore.build / upsert_document: returns the vectors the encode
+    stage already computed for these texts, so the stores' own encoding step is a lookup.
+    """
+
+    def __init__(self, texts, vectors):
+        self._vectors = dict(zip(texts, vectors))
+
+    def encode(self, sentences, **kwargs):
+        return np.vstack([self._vectors[sentence] for sentence in sentences])
+
+
+class IngestionState:
+    """
+    Progress of a bulk ingestion, saved to a JSON file after every file so an interrupted run
+    can be resumed: finished files are skipped (unless changed on disk since), and a file that
+    was being written when the run stopped reuses the KB created for it. `run_token` identifies
+    the run's claim on a target KB, so a resumed run can take over the claim of one that was killed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.run_token = ""
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == STATE_VERSION:
+                self.files = data.get("files", {})
+                self.run_token = data.get("run_token", "")
+
+    @staticmethod
+    def fingerprint(path):
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def is_done(self, path):
+        entry = self.files.get(path)
+        return bool(entry) and entry.get("status") == STATUS_DONE and entry.get("fingerprint") == self.fingerprint(path)
+
+    def get(self, path):
+        return self.files.get(path, {})
+
+    def update(self, path, **fields):
+        entry = self.files.setdefault(path, {})
+        entry.update(fields)
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": STATE_VERSION, "run_token": self.run_token, "files": self.files}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+class PipelineStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.pages = 0
+        self.sections = 0
+        self.chunks = 0
+        self.extract_seconds = 0.0
+        self.chunk_seconds = 0.0
+        self.encode_seconds = 0.0
+        self.encode_batches = 0
+        self.encode_wait_seconds = 0.0 # Encode stage idle, waiting for extracted files
+        self.write_seconds = 0.0
+        self.write_wait_seconds = 0.0 # Write stage idle, waiting for vectors
+
+    def report(self):
+        wall = time.perf_counter() - self.started
+        per_second = lambda value: round(value / wall, 2) if wall else 0 # noqa: E731
+        return {
+            "wall_seconds": round(wall, 2),
+            "files": self.files,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "pages": self.pages,
+            "sections": self.sections,
+            "chunks": self.chunks,
+            "megabytes": round(self.bytes / 1024 / 1024, 2),
+            "files_per_second": per_second(self.files),
+            "chunks_per_second": per_second(self.chunks),
+            "megabytes_per_second": per_second(self.bytes / 1024 / 1024),
+            # Busy time per stage; extract/chunk are summed over the pool processes
+            "extract_seconds": round(self.extract_seconds, 2),
+            "chunk_seconds": round(self.chunk_seconds, 2),
+            "encode_seconds": round(self.encode_seconds, 2),
+            "encode_batches": self.encode_batches,
+            "encode_wait_seconds": round(self.encode_wait_seconds, 2),
+            "write_seconds": round(self.write_seconds, 2),
+            "write_wait_seconds": round(self.write_wait_seconds, 2),
+        }
+
+
+class IngestionPipeline:
+    """
+    Runs files through extract+chunk -> encode -> write as overlapping stages:
+
+    - a process pool extracts and chunks up to `workers` files at once (at most `queue_size`
+      finished files wait for the encoder, so a slow encoder throttles extraction);
+    - one thread encodes the chunks in batches of `batch_size`, filling batches across files;
+    - the calling thread writes each file's vectors with `write(encoded_file)` (DB and store access
+      stay on one thread), in the order the files finished extracting.
+
+    Memory is bounded by the queue sizes: roughly `workers + 2 * queue_size` files' chunks at a time.
+    """
+
+    def __init__(self, model, write, workers=None, queue_size=8, batch_size=None, stats=None):
+        self.model = model
+        self.write = write
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.queue_size = max(1, queue_size)
+        self.batch_size = batch_size or getattr(settings, "EMBEDDING_BATCH_SIZE", 64)
+        self.stats = stats or PipelineStats()
+        self._extracted = queue.Queue(maxsize=self.queue_size)
+        self._encoded = queue.Queue(maxsize=self.queue_size)
+        self._stop = threading.Event()
+        self._error = None
+
+    def run(self, paths):
+        # spawn, not fork: this process has threads (and maybe a loaded model). Spawned processes start
+        # without Django set up, and need it before unpickling extract_file imports this module.
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=django.setup,
+        )
+        threads = [
+            threading.Thread(target=self._guard, args=(self._feed, pool, list(paths)), name="ingest-extract", daemon=True),
+            threading.Thread(target=self._guard, args=(self._encode,), name="ingest-encode", daemon=True),
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            while True:
+                waited = time.perf_counter()
+                item = self._encoded.get()
+                self.stats.write_wait_seconds += time.perf_counter() - waited
+                if item is _DONE:
+                    break
+                started = time.perf_counter()
+                self.write(item)
+                self.stats.write_seconds += time.perf_counter() - started
+            if self._error is not None:
+                raise self._error
+        finally:
+            self._stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+        return self.stats
+
+    def _guard(self, target, *args):
+        # A failed stage ends the run; the write loop re-raises its exception
+        try:
+            target(*args)
+        except BaseException as e:
+            if self._stop.is_set():
+                return # Failing because the run is being shut down
+            logger.error(f"Bulk ingestion stage {threading.current_thread().name} failed", exc_info=True)
+            self._error = e
+            self._stop.set()
+            self._put(self._encoded, _DONE, force=True)
+
+    def _put(self, target_queue, item, force=False):
+        while force or not self._stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if force:
+                    try: # Make room: the run is over and nobody will read what was queued
+                        target_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+        return False
+
+    def _feed(self, pool, paths):
+        pending = deque()
+        paths = iter(paths)
+        for path in paths:
+            pending.append(pool.submit(extract_file, path))
+            if len(pending) >= self.workers * 2:
+                break
+        while pending:
+            result = pending.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(pool.submit(extract_file, next_path))
+            if not self._put(self._extracted, result):
+                return
+        self._put(self._extracted, _DONE)
+
+    def _encode(self):
+        files = deque() # [extracted, vector parts, chunks not yet encoded], in arrival order
+        buffer = [] # (file entry, chunk text) waiting for a full batch
+        finished = False
+        while not finished and not self._stop.is_set():
+            waited = time.perf_counter()
+            try:
+                # Don't hold a partial batch back while the extractors are busy
+                item = self._extracted.get(timeout=0.05 if buffer else 0.5)
+            except queue.Empty:
+                self.stats.encode_wait_seconds += time.perf_counter() - waited
+                if buffer:
+                    self._encode_batch(buffer)
+                    buffer = []
+                    self._emit_finished(files)
+                continue
+            self.stats.encode_wait_seconds += time.perf_counter() - waited
+            if item is _DONE:
+                finished = True
+            else:
+                entry = [item, [], len(item.chunks)]
+                files.append(entry)
+                buffer.extend((entry, chunk.text) for chunk in item.chunks)
+            while len(buffer) >= self.batch_size or (finished and buffer):
+                self._encode_batch(buffer[:self.batch_size])
+                buffer = buffer[self.batch_size:]
+            self._emit_finished(files)
+        if finished:
+            self._put(self._encoded, _DONE)
+
+    def _encode_batch(self, batch):
+        started = time.perf_counter()
+        vectors = np.asarray(
+            self.model.encode([text for _, text in batch], batch_size=len(batch), show_progress_bar=False), dtype="float32",
+        )
+        self.stats.encode_seconds += time.perf_counter() - started
+        self.stats.encode_batches += 1
+        # A batch holds consecutive chunks, so each file's part of it is one slice
+        position = 0
+        while position < len(batch):
+            entry = batch[position][0]
+            end = position
+            while end < len(batch) and batch[end][0] is entry:
+                end += 1
+            entry[1].append(vectors[position:end])
+            entry[2] -= end - position
+            position = end
+
+    def _emit_finished(self, files):
+        while files and files[0][2] == 0:
+            extracted, parts, _ = files.popleft()
+            vectors = np.vstack(parts) if parts else None
+            if not self._put(self._encoded, EncodedFile(extracted, vectors)):
+                return
+
+
+# --- Writing to knowledge bases (runs on the calling thread) ---
+
+def default_state_path(user, paths, kb=None):
+    """State file for this user + set of files (+ target KB), so re-running the same command resumes it."""
+    key = "\n".join([user.username, str(kb.id if kb else "")] + sorted(paths))
+    return os.path.join(settings.BASE_DIR, "ingest_state", hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+
+class KnowledgeBaseWriter:
+    """
+    Stores each encoded file: as a new KnowledgeBase of `user` (one per file), or, with `kb`, as a
+    document of that KB, replacing the document with the same name (like an upload on the KB page).
+    Progress goes to `state`; `log` gets one line per file. While documents are added to `kb`, it
+    is marked as being embedded (see start / finish), so no embedding job runs on it meanwhile.
+    """
+
+    def __init__(self, user, state, stats, kb=None, titles=None, quantization=None, log=None):
+        self.user = user
+        self.state = state
+        self.stats = stats
+        self.kb = kb
+        self.titles = titles or {}
+        self.quantization = quantization
+        self.log = log or logger.info
+        self.vector_store = get_vector_store()
+        self.pending = 0
+
+    def start(self, pending):
+        """
+        Claims `kb` for a run that writes `pending` files, like a queued embedding job would. The
+        claim is tagged with the state file's run token (in embedding_task_id): a run killed before
+        it could release the claim (SIGKILL, OOM) leaves the KB running, and re-running it with the
+        same state file takes the claim over instead of being refused.
+        """
+        self.pending = pending
+        if self.kb is None:
+            return
+        if not self.state.run_token:
+            # Saved before claiming, so a claim can never exist without the state file knowing it
+            self.state.run_token = f"{RUN_TOKEN_PREFIX}{uuid.uuid4().hex}"
+            self.state.save()
+        # Atomic, so an embedding job queued from the KB page meanwhile can't run at the same time
+        idle = ~Q(embedding_status__in=[KnowledgeBase.EMBEDDING_QUEUED, KnowledgeBase.EMBEDDING_RUNNING])
+        claimed = KnowledgeBase.objects.filter(idle | Q(embedding_task_id=self.state.run_token), pk=self.kb.pk).update(
+            embedding_status=KnowledgeBase.EMBEDDING_RUNNING,
+            embedding_progress=0,
+            embedding_error="",
+            embedding_task_id=self.state.run_token,
+            embedding_started_at=timezone.now(),
+            embedding_finished_at=None,
+        )
+        if not claimed:
+            raise IngestionError(f"KB {self.kb.id} is already being embedded")
+
+    def finish(self, error=""):
+        """Marks `kb` done (or failed with `error`) at the end of the run."""
+        if self.kb is None:
+            return
+        if error:
+            fields = {"embedding_status": KnowledgeBase.EMBEDDING_FAILED, "embedding_error": error}
+        else:
+            fields = {"embedding_status": KnowledgeBase.EMBEDDING_DONE, "embedding_progress": 100, "embedding_error": ""}
+        KnowledgeBase.objects.filter(pk=self.kb.pk).update(embedding_finished_at=timezone.now(), **fields)
+
+    def is_done(self, path):
+        """Finished in an earlier run, unchanged since, and its KB / document still exists."""
+        if not self.state.is_done(path):
+            return False
+        entry = self.state.get(path)
+        if self.kb is not None:
+            return self.kb.documents.filter(pk=entry.get("document_id"), is_embedded=True).exists()
+        return KnowledgeBase.objects.filter(pk=entry.get("kb_id"), user=self.user, is_embedded=True).exists()
+
+    def __call__(self, encoded):
+        extracted = encoded.extracted
+        path = extracted.path
+        self.stats.bytes += os.path.getsize(path)
+        self.stats.sections += extracted.sections
+        self.stats.pages += extracted.pages
+        self.stats.extract_seconds += extracted.extract_seconds
+        self.stats.chunk_seconds += extracted.chunk_seconds
+        fingerprint = IngestionState.fingerprint(path)
+        if extracted.error or not extracted.chunks:
+            error = extracted.error or "no readable text or is empty"
+            self.stats.failed += 1
+            self.state.update(path, status=STATUS_FAILED, error=error, fingerprint=fingerprint)
+            self.log(f"FAILED {path}: {error}")
+            return
+
+        texts = [chunk.text for chunk in extracted.chunks]
+        encoder = PrecomputedEncoder(texts, encoded.vectors)
+        if self.kb is not None:
+            target = self._write_document(path, extracted.chunks, encoder)
+        else:
+            target = self._write_knowledge_base(path, extracted.chunks, encoder)
+        self.stats.files += 1
+        self.stats.chunks += len(texts)
+        self.state.update(path, status=STATUS_DONE, error="", fingerprint=fingerprint, chunks=len(texts))
+        self.log(f"{target}: {len(texts)} chunks from {path}")
+
+    def _write_knowledge_base(self, path, chunks, encoder):
+        kb = KnowledgeBase.objects.filter(pk=self.state.get(path).get("kb_id"), user=self.user).first()
+        if kb is None:
+            kb = KnowledgeBase(
+                user=self.user,
+                title=self.titles.get(path) or os.path.splitext(os.path.basename(path))[0],
+                vector_quantization=self.quantization or "",
+                embedding_status=KnowledgeBase.EMBEDDING_RUNNING,
+                embedding_started_at=timezone.now(),
+            )
+            with open(path, "rb") as f:
+                kb.file.save(os.path.basename(path), File(f), save=True)
+        # Recorded before the index is written, so a resumed run rebuilds into this KB instead of adding another
+        self.state.update(path, status=STATUS_STARTED, kb_id=kb.id)
+
+        store_info = self.vector_store.build(
+            get_index_name(kb), chunks, encoder, doc_key=DEFAULT_DOC_KEY, quantization=kb.vector_quantization or None,
+        )
+        if not kb.widget_slug:
+            kb.widget_slug = str(uuid.uuid4())[:8]
+        kb.is_embedded = True
+        kb.index_type = store_info["index_type"]
+        kb.embedding_status = KnowledgeBase.EMBEDDING_DONE
+        kb.embedding_progress = 100
+        kb.embedding_error = ""
+        kb.embedding_finished_at = timezone.now()
+        kb.save()
+        return f"KB {kb.id}"
+
+    def _write_document(self, path, chunks, encoder):
+        name = os.path.basename(path)
+        document = self.kb.documents.filter(name=name).first()
+        with open(path, "rb") as f:
+            if document:
+                if document.file:
+                    document.file.delete(save=False)
+                document.file.save(name, File(f), save=False)
+                document.is_embedded = False
+                document.save()
+            else:
+                document = KnowledgeBaseDocument(knowledge_base=self.kb, name=name)
+                document.file.save(name, File(f), save=True)
+        self.state.update(path, status=STATUS_STARTED, kb_id=self.kb.id, document_id=document.id)
+
+        store_info = self.vector_store.upsert_document(get_index_name(self.kb), document.document_key, chunks, encoder)
+        KnowledgeBaseDocument.objects.filter(pk=document.pk).update(is_embedded=True)
+        # Upserts can change the index type as the KB grows (see ingest_knowledge_base)
+        self.kb.index_type = store_info["index_type"]
+        KnowledgeBase.objects.filter(pk=self.kb.pk).update(
+            index_type=self.kb.index_type,
+            embedding_progress=min(99, 100 * (self.stats.files + 1) // max(self.pending, 1)),
+        )
+        return f"KB {self.kb.id} / {name}"
+
+
+def run_bulk_ingestion(files, user, kb=None, state_path=None, workers=None, queue_size=8, batch_size=None,
+                       quantization=None, log=None):
+    """
+    Ingests `files` ([(path, title or None)], see find_files) for `user` through IngestionPipeline.
+    Files finished by an earlier run with the same state file are skipped. Raises IngestionError
+    if `kb` is already being embedded.
+
+    Returns:
+        tuple: (PipelineStats, state file path)
+    """
+    paths = [path for path, _ in files]
+    state_path = state_path or default_state_path(user, paths, kb)
+    state = IngestionState(state_path)
+    stats = PipelineStats()
+    writer = KnowledgeBaseWriter(
+        user, state, stats, kb=kb, titles={path: title for path, title in files if title},
+        quantization=quantization, log=log,
+    )
+
+    todo = []
+    for path in paths:
+        if writer.is_done(path):
+            stats.skipped += 1
+        else:
+            todo.append(path)
+    # Also with nothing left to do: a run killed after its last file still holds the KB
+    writer.start(len(todo))
+    try:
+        if todo:
+            pipeline = IngestionPipeline(
+                get_embedding_model(), writer, workers=workers, queue_size=queue_size, batch_size=batch_size, stats=stats,
+            )
+            pipeline.run(todo)
+    except KeyboardInterrupt:
+        writer.finish("Bulk ingestion was interrupted; run it again to resume.")
+        raise
+    except Exception as e:
+        writer.finish(f"Bulk ingestion failed: {e}")
+        raise
+    else:
+        writer.finish()
+    finally:
+        if kb is not None and stats.files:
+            # Cached chat answers were generated from the old chunks
+            invalidate_kb_responses(kb.id)
+    return stats, state_path
@@ -0,0 +1,150 @@
+# core/utils/ingestion/kb_ingestion.py
+
+import logging
+import os
+import uuid
+
+from core.utils.file_reader import TextExtractionError, iter_text_sections
+from core.utils.chunking.text_chunker import iter_chunks
+from core.utils.embeddings.embedding_service import get_embedding_model
+from core.utils.metrics import STAGE_CHUNK, STAGE_EXTRACT, StageClock
+from core.utils.vector.chunk_store import DEFAULT_DOC_KEY
+from core.utils.vector.vector_store import get_vector_store
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionError(Exception):
+    """A permanent ingestion failure (bad/empty file); retrying won't help."""
+
+
+def get_index_name(kb):
+    return f"kb_{kb.id}"
+
+
+def _iter_document_chunks(file_field, report_fraction, clock):
+    """
+    Streams Chunks for one stored file, reporting how far through the file extraction is.
+    Extraction and chunking time is added to `clock` as the chunks are pulled.
+    """
+    try:
+        file_size = file_field.size or 0
+    except Exception:
+        file_size = 0
+
+    def tracked_sections():
+        # Progress follows how far through the document extraction is (pages for PDFs,
+        # characters vs. file size otherwise); encoding runs in lockstep with it.
+        for section in iter_text_sections(file_field):
+            if section.page_count:
+                fraction = section.page_number / section.page_count
+            elif file_size:
+                fraction = min((section.char_offset + len(section.text)) / file_size, 1.0)
+            else:
+                fraction = 0
+            report_fraction(fraction)
+            yield section
+
+    file_extension = os.path.splitext(file_field.name)[1]
+    sections = clock.timed_iter(tracked_sections(), STAGE_EXTRACT)
+    return clock.timed_iter(iter_chunks(sections, file_extension), STAGE_CHUNK, exclude=STAGE_EXTRACT)
+
+
+def ingest_knowledge_base(kb, progress_callback=None):
+    """
+    Runs the embedding pipeline for a KnowledgeBase: extract -> chunk -> encode -> store.
+
+    The first run builds the index from kb.file (plus any documents already attached). Later runs
+    only sync the KB's documents: new or re-uploaded documents are upserted (unchanged chunks keep
+    their vectors, see VectorStore.upsert_document) and chunks of deleted documents are removed.
+    Storage goes through get_vector_store(), so it works the same with any VECTOR_STORE_BACKEND.
+
+    The stages are chained generators, so pages stream from the file through the chunker into
+    batched encoding; the full document text is never held in memory at once. Each document's
+    time per stage is exported as chatbot_ingestion_stage_seconds (see core/utils/metrics.py).
+
+    Args:
+        kb: KnowledgeBase instance whose file(s) should be embedded.
+        progress_callback: Optional callable(percent: int, stage: str) for status reporting.
+
+    Returns:
+        int: Number of chunks encoded.
+
+    Raises:
+        IngestionError: For problems with the file itself. Other exceptions (storage/network)
+        propagate so the caller can decide whether to retry.
+    """
+    def report(percent, stage):
+        if progress_callback:
+            progress_callback(percent, stage)
+
+    report(5, "loading model")
+    model = get_embedding_model()
+    index_name = get_index_name(kb)
+    vector_store = get_vector_store()
+
+    documents = list(kb.documents.all())
+    pending = [doc for doc in documents if not doc.is_embedded or not kb.is_embedded]
+    # Each file gets an equal share of the 10-90% progress range
+    steps = len(pending) + (0 if kb.is_embedded else 1)
+    step = [0]
+
+    def reporter(stage):
+        start, span = 10 + 80 * step[0] // max(steps, 1), 80 // max(steps, 1)
+        return lambda fraction: report(start + int(span * fraction), stage)
+
+    chunk_count = 0
+    index_type = kb.index_type
+    report(10, "extracting and encoding")
+
+    if not kb.is_embedded:
+        with StageClock() as clock:
+            chunks = _iter_document_chunks(kb.file, reporter("extracting and encoding"), clock)
+            try:
+                store_info = vector_store.build(
+                    index_name, chunks, model, doc_key=DEFAULT_DOC_KEY, quantization=kb.vector_quantization or None,
+                )
+            except TextExtractionError as e:
+                raise IngestionError(f"Error: {e}")
+
+            if not store_info:
+                raise IngestionError("The uploaded file has no readable text or is empty.")
+        chunk_count += store_info["vectors"]
+        index_type = store_info["index_type"]
+        logger.info(f"KB {kb.id}: embedded {store_info['vectors']} chunks into a {index_type} index")
+        step[0] += 1
+
+    for doc in pending:
+        with StageClock() as clock:
+            chunks = _iter_document_chunks(doc.file, reporter(f"updating {doc.name}"), clock)
+            try:
+                store_info = vector_store.upsert_document(index_name, doc.document_key, chunks, model)
+            except TextExtractionError as e:
+                raise IngestionError(f"Error in {doc.name}: {e}")
+
+            if not store_info:
+                raise IngestionError(f"{doc.name} has no readable text or is empty.")
+        chunk_count += store_info["added"]
+        index_type = store_info["index_type"]
+        logger.info(
+            f"KB {kb.id}: {doc.name}: {store_info['added']} chunks added, "
+            f"{store_info['removed']} removed, {store_info['unchanged']} unchanged"
+        )
+        # Leave it pending if the file was replaced again while we were encoding
+        kb.documents.filter(pk=doc.pk, updated_at=doc.updated_at).update(is_embedded=True)
+        step[0] += 1
+
+    # Documents deleted since the last sync still have chunks in the store
+    known_keys = {DEFAULT_DOC_KEY} | {doc.document_key for doc in documents}
+    stale_keys = [key for key in vector_store.list_documents(index_name) if key not in known_keys]
+    if stale_keys:
+        removed = vector_store.remove_documents(index_name, stale_keys)
+        logger.info(f"KB {kb.id}: removed {removed} chunks of deleted documents {stale_keys}")
+
+    report(95, "finalizing")
+    if not kb.widget_slug:
+        kb.widget_slug = str(uuid.uuid4())[:8] # Generates a unique 8-char slug
+    kb.is_embedded = True
+    kb.index_type = index_type
+    kb.save(update_fields=["widget_slug", "is_embedded", "index_type"])
+    return chunk_count
@@ -0,0 +1,172 @@
+# core/utils/metrics.py
+
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Histogram, multiprocess
+except ImportError: # Metrics become no-ops and /metrics returns 404
+    prometheus_client = None
+
+# Chat request stages (label values of chatbot_chat_stage_seconds)
+STAGE_KB_LOOKUP = "kb_lookup"
+STAGE_MODEL_ACQUIRE = "model_acquire"
+STAGE_QUERY_ENCODE = "query_encode"
+STAGE_INDEX_LOAD = "index_load"
+STAGE_VECTOR_SEARCH = "vector_search"
+STAGE_KEYWORD_SEARCH = "keyword_search"
+STAGE_RERANK = "rerank"
+STAGE_RESPONSE_CACHE = "response_cache"
+STAGE_PROMPT_BUILD = "prompt_build"
+STAGE_LLM_FIRST_TOKEN = "llm_first_token"
+STAGE_LLM = "llm"
+STAGE_RETRIEVAL = "retrieval" # Everything before the LLM call
+
+# Ingestion stages (label values of chatbot_ingestion_stage_seconds), summed per document
+STAGE_EXTRACT = "extract"
+STAGE_CHUNK = "chunk"
+STAGE_ENCODE = "encode"
+STAGE_INDEX_BUILD = "index_build"
+STAGE_STORE_WRITE = "store_write"
+STAGE_DOCUMENT = "document"
+
+# Sub-millisecond cache hits up to slow LLM answers
+CHAT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+INGESTION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+class _NoOpMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+if prometheus_client is not None:
+    CHAT_STAGE_SECONDS = Histogram(
+        "chatbot_chat_stage_seconds", "Time spent in each stage of a chat request.", ["stage"], buckets=CHAT_BUCKETS,
+    )
+    CHAT_REQUESTS = Counter(
+        "chatbot_chat_requests_total", "Chat requests by endpoint and how they were answered.", ["endpoint", "result"],
+    )
+    INGESTION_STAGE_SECONDS = Histogram(
+        "chatbot_ingestion_stage_seconds", "Time spent in each ingestion stage, per document.", ["stage"],
+        buckets=INGESTION_BUCKETS,
+    )
+    INGESTION_JOBS = Counter("chatbot_ingestion_jobs_total", "Embedding jobs by outcome.", ["result"])
+    INGESTED_CHUNKS = Counter("chatbot_ingested_chunks_total", "Chunks encoded by ingestion.")
+else:
+    CHAT_STAGE_SECONDS = CHAT_REQUESTS = INGESTION_STAGE_SECONDS = INGESTION_JOBS = INGESTED_CHUNKS = _NoOpMetric()
+
+
+def metrics_enabled():
+    return prometheus_client is not None and getattr(settings, "METRICS_ENABLED", True)
+
+
+def observe_chat_stage(stage, seconds):
+    CHAT_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_ingestion_stage(stage, seconds):
+    INGESTION_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def chat_stage(stage):
+    """Times the enclosed block into chatbot_chat_stage_seconds{stage=...}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        CHAT_STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def record_ingestion_stage(stage, seconds):
+    """Adds to the document's StageClock when one is active, else observes `seconds` directly."""
+    clock = _active_clock.get()
+    if clock is not None:
+        clock.add(stage, seconds)
+    else:
+        observe_ingestion_stage(stage, seconds)
+
+
+_active_clock = contextvars.ContextVar("ingestion_stage_clock", default=None)
+_DONE = object()
+
+
+class StageClock:
+    """
+    Accumulates the time one document spends in each ingestion stage. Stages run interleaved
+    (pages stream through the chunker into batched encoding), so each is timed where it runs
+    and the totals are observed once the document is done.
+
+    Used as a context manager around one document's build/upsert: code further down
+    (vector_logic, the vector store backends) reports its stages with record_ingestion_stage().
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self._token = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._token = _active_clock.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        _active_clock.reset(self._token)
+        if exc_type is None: # Failed documents would skew the timings
+            self.add(STAGE_DOCUMENT, time.perf_counter() - self._started)
+            self.observe()
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def timed_iter(self, iterable, stage, exclude=None):
+        """
+        Yields from `iterable`, counting the time spent producing each item towards `stage`.
+        `exclude` is a stage whose time is spent inside this one (an upstream generator it pulls
+        from) and is subtracted, so "chunk" doesn't also count extraction.
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            nested_before = self.seconds.get(exclude, 0.0)
+            item = next(iterator, _DONE)
+            nested = self.seconds.get(exclude, 0.0) - nested_before
+            self.add(stage, time.perf_counter() - started - nested)
+            if item is _DONE:
+                return
+            yield item
+
+    def observe(self):
+        for stage, seconds in self.seconds.items():
+            observe_ingestion_stage(stage, seconds)
+
+
+def render_metrics():
+    """
+    Returns (body, content type) in the Prometheus text format. With PROMETHEUS_MULTIPROC_DIR set
+    (gunicorn with several workers), the samples of every worker process are merged.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drops a dead worker's live gauges in multiprocess mode (gunicorn child_exit hook)."""
+    if prometheus_client is not None and os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
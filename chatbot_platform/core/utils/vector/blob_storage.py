@@ -0,0 +1,255 @@
+# core/utils/vector/blob_storage.py
+
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+DEFAULT_TRANSFER_WORKERS = 4
+DEFAULT_UPLOAD_CHUNK_SIZE_MB = 8 # Resumable upload request size; GCS wants a multiple of 256 KiB
+DEFAULT_RESUMABLE_THRESHOLD_MB = 8 # The client switches from single-request to resumable uploads above 8 MiB too
+DEFAULT_SLICED_DOWNLOAD_THRESHOLD_MB = 64
+SLICED_DOWNLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+_MB = 1024 * 1024
+_RESUMABLE_CHUNK_MULTIPLE = 256 * 1024
+
+
+class BlobPreconditionFailed(RuntimeError):
+    """A conditional write lost the race: the blob's generation wasn't the one we expected."""
+
+
+class GCSBlobStorage:
+    """
+    Vector store blobs in a GCS bucket, through one process-wide storage.Client.
+
+    Creating a storage.Client means resolving credentials and opening a new HTTP session, so the
+    client (and its connection pool) is built once per process and reused for every call; it's
+    rebuilt after a fork because HTTP sessions can't be shared with the parent.
+
+    Large uploads use resumable, chunked uploads (each chunk is retried on its own instead of
+    restarting the file) and large downloads are fetched as concurrent byte-range slices.
+    Writes and deletes accept if_generation_match so concurrent writers can't silently
+    overwrite each other. Set STORAGE_EMULATOR_HOST to run against a fake GCS server.
+    """
+
+    def __init__(self, bucket_name, project=None):
+        self.bucket_name = bucket_name
+        self.project = project
+        self._client = None
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def _get_bucket(self):
+        if self._bucket is None:
+            with self._lock:
+                if self._bucket is None:
+                    from google.cloud import storage
+                    self._client = storage.Client(project=self.project)
+                    self._bucket = self._client.bucket(self.bucket_name)
+        return self._bucket
+
+    def _reset_after_fork(self):
+        self._client = None
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def describe(self, key):
+        return f"gs://{self.bucket_name}/{key}"
+
+    def get_generation(self, key):
+        """Returns the live generation of `key`, or None if it doesn't exist."""
+        blob = self._get_bucket().get_blob(key)
+        return blob.generation if blob is not None else None
+
+    def upload(self, local_path, key, if_generation_match=None):
+        """Uploads a file. if_generation_match=0 means "only if the blob doesn't exist". Returns the new generation."""
+        from google.api_core import exceptions
+
+        blob = self._get_bucket().blob(key)
+        if os.path.getsize(local_path) > _setting_mb("GCS_RESUMABLE_THRESHOLD_MB", DEFAULT_RESUMABLE_THRESHOLD_MB):
+            chunk_size = _setting_mb("GCS_UPLOAD_CHUNK_SIZE_MB", DEFAULT_UPLOAD_CHUNK_SIZE_MB)
+            blob.chunk_size = max(_RESUMABLE_CHUNK_MULTIPLE, chunk_size - chunk_size % _RESUMABLE_CHUNK_MULTIPLE)
+        try:
+            # With a generation precondition the client's default retry policy also covers uploads
+            blob.upload_from_filename(local_path, if_generation_match=if_generation_match)
+        except exceptions.PreconditionFailed as e:
+            raise BlobPreconditionFailed(f"{self.describe(key)} changed since it was read") from e
+        return blob.generation
+
+    def download(self, key, local_path, generation=None):
+        """Downloads `key` (pinned to `generation` if given) to `local_path`."""
+        from google.api_core import exceptions
+        from google.cloud.storage import transfer_manager
+
+        # Pinning the generation guarantees we download exactly the version we validated against
+        blob = self._get_bucket().blob(key, generation=generation)
+        try:
+            blob.reload()
+            if blob.size and blob.size > _setting_mb("GCS_SLICED_DOWNLOAD_THRESHOLD_MB", DEFAULT_SLICED_DOWNLOAD_THRESHOLD_MB):
+                transfer_manager.download_chunks_concurrently(
+                    blob,
+                    local_path,
+                    chunk_size=SLICED_DOWNLOAD_CHUNK_SIZE,
+                    worker_type=transfer_manager.THREAD,
+                    max_workers=_transfer_workers(),
+                )
+            else:
+                blob.download_to_filename(local_path)
+        except exceptions.NotFound as e:
+            raise FileNotFoundError(f"{self.describe(key)} not found") from e
+
+    def delete(self, key, if_generation_match=None):
+        """Deletes `key`. Returns False if it didn't exist."""
+        from google.api_core import exceptions
+
+        try:
+            self._get_bucket().blob(key).delete(if_generation_match=if_generation_match)
+        except exceptions.NotFound:
+            return False
+        except exceptions.PreconditionFailed as e:
+            raise BlobPreconditionFailed(f"{self.describe(key)} changed since it was read") from e
+        return True
+
+
+class LocalBlobStorage:
+    """
+    Filesystem stand-in for GCSBlobStorage (settings.GCS_LOCAL_ROOT): blobs are files under
+    <root>/<bucket>/<key>, and a file's mtime in nanoseconds plays the role of its generation.
+    Lets the GCS code paths (temp downloads, generation pinning and preconditions) run in dev and
+    tests without a bucket. Preconditions are only atomic within one process.
+    """
+
+    def __init__(self, root, bucket_name):
+        self.bucket_name = bucket_name
+        self.root = Path(root) / bucket_name
+        self._lock = threading.Lock()
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return self.root / key
+
+    def describe(self, key):
+        return f"{self.root.as_uri()}/{key}"
+
+    def get_generation(self, key):
+        try:
+            return os.stat(self._path(key)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _check_generation(self, key, if_generation_match):
+        if if_generation_match is not None and (self.get_generation(key) or 0) != if_generation_match:
+            raise BlobPreconditionFailed(f"{self.describe(key)} changed since it was read")
+
+    def upload(self, local_path, key, if_generation_match=None):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.upload-{threading.get_ident()}"
+        shutil.copyfile(local_path, tmp_path)
+        with self._lock:
+            try:
+                self._check_generation(key, if_generation_match)
+            except BlobPreconditionFailed:
+                os.remove(tmp_path)
+                raise
+            previous = self.get_generation(key)
+            os.replace(tmp_path, path)
+            # Make sure every write gets a new generation even on coarse-grained filesystem clocks
+            if previous is not None and self.get_generation(key) <= previous:
+                os.utime(path, ns=(previous + 1, previous + 1))
+            return self.get_generation(key)
+
+    def download(self, key, local_path, generation=None):
+        # Like GCS without object versioning, only the live generation can be read
+        with self._lock:
+            if self.get_generation(key) is None or (generation is not None and self.get_generation(key) != generation):
+                raise FileNotFoundError(f"{self.describe(key)} not found")
+            shutil.copyfile(self._path(key), local_path)
+
+    def delete(self, key, if_generation_match=None):
+        with self._lock:
+            if self.get_generation(key) is None:
+                return False
+            self._check_generation(key, if_generation_match)
+            os.remove(self._path(key))
+            return True
+
+
+def _setting_mb(name, default):
+    return int(getattr(settings, name, default) * _MB)
+
+
+def _transfer_workers():
+    return max(1, getattr(settings, "GCS_TRANSFER_WORKERS", DEFAULT_TRANSFER_WORKERS))
+
+
+# --- Process-wide storage and transfer pool ---
+_storages = {}
+_executor = None
+_shared_lock = threading.Lock()
+
+
+def get_blob_storage(bucket_name=None):
+    """
+    Returns the shared blob storage for `bucket_name` (default settings.GS_BUCKET_NAME): GCS, or
+    the filesystem stand-in when settings.GCS_LOCAL_ROOT is set.
+    """
+    bucket_name = bucket_name or getattr(settings, "GS_BUCKET_NAME", None)
+    if not bucket_name:
+        raise ValueError("GS_BUCKET_NAME must be set in settings for GCS operations.")
+    storage = _storages.get(bucket_name)
+    if storage is not None:
+        return storage
+
+    with _shared_lock:
+        storage = _storages.get(bucket_name)
+        if storage is None:
+            local_root = getattr(settings, "GCS_LOCAL_ROOT", None)
+            if local_root:
+                storage = LocalBlobStorage(local_root, bucket_name)
+            else:
+                project_id = getattr(settings, "GS_PROJECT_ID", None)
+                # If project_id is "None" string (from default config), treat as None
+                storage = GCSBlobStorage(bucket_name, project_id if project_id and project_id != "None" else None)
+            _storages[bucket_name] = storage
+        return storage
+
+
+def run_concurrently(*calls):
+    """
+    Runs zero-argument callables on the shared transfer pool and returns their results in order.
+    Re-raises the first failure after every call has finished, so no transfer is left running
+    against a temp file that is about to be deleted.
+    """
+    global _executor
+    if len(calls) <= 1:
+        return [call() for call in calls]
+    if _executor is None:
+        with _shared_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_transfer_workers(), thread_name_prefix="blob-transfer")
+
+    futures = [_executor.submit(call) for call in calls]
+    errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [future.result() for future in futures]
+
+
+def _reset_after_fork():
+    global _executor, _shared_lock
+    # Neither HTTP sessions nor pool threads survive a fork
+    _executor = None
+    _shared_lock = threading.Lock()
+    for storage in _storages.values():
+        storage._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,273 @@
+# core/utils/vector/chunk_store.py
+
+import hashlib
+import json
+import mmap
+import struct
+
+import numpy as np
+
+DEFAULT_DOC_KEY = "document"
+
+# On-disk chunk file (kb_<id>.chunks):
+#   magic | uint32 header length | JSON header | (8-byte aligned) ids int64[n] | offsets int64[n+1]
+#   | pages int32[n] | doc indexes int32[n] | sha1 hex hashes S40[n] | UTF-8 text blob
+# Rows are sorted by id, so a FAISS result id is found with a binary search and only the hit's
+# bytes are read from the mapping.
+CHUNK_FILE_MAGIC = b"KBCHUNK1"
+CHUNK_FILE_VERSION = 1
+_HASH_DTYPE = "S40"
+_NO_PAGE = -1
+
+
+def hash_chunk(text):
+    """Content hash used to detect unchanged chunks when a document is re-ingested."""
+    return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+class ChunkStore:
+    """
+    The chunk texts behind a FAISS index, plus what we need to update it incrementally:
+    each chunk's FAISS id, the document it came from and its content hash.
+
+    This is the mutable, in-memory form used while building or updating a store. It is saved
+    next to the .faiss file as kb_<id>.chunks (see write_chunk_file) and searched through
+    MappedChunkStore. Older .pkl stores load via from_pickled: a plain list of strings becomes
+    a single document whose ids are the list positions.
+    """
+
+    def __init__(self, ids=None, texts=None, doc_keys=None, hashes=None, pages=None):
+        self.ids = list(ids or [])
+        self.texts = list(texts or [])
+        self.doc_keys = list(doc_keys or [])
+        self.hashes = list(hashes or [])
+        self.pages = list(pages) if pages is not None else [None] * len(self.ids)
+        self.version = None # Storage version this copy was read at (set by _load_vector_store)
+        self._positions = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return sum(len(t) for t in self.texts) + len(self.ids) * 64
+
+    # --- (de)serialization ---
+
+    @classmethod
+    def from_pickled(cls, data):
+        if isinstance(data, list):
+            # Legacy format: list of chunk texts, FAISS ids == positions
+            return cls(
+                ids=range(len(data)),
+                texts=data,
+                doc_keys=[DEFAULT_DOC_KEY] * len(data),
+                hashes=[hash_chunk(t) for t in data],
+            )
+        return cls(data["ids"], data["texts"], data["doc_keys"], data["hashes"], data.get("pages"))
+
+    def to_chunk_store(self):
+        return ChunkStore(self.ids, self.texts, self.doc_keys, self.hashes, self.pages)
+
+    # --- lookups ---
+
+    def _get_positions(self):
+        if self._positions is None:
+            self._positions = {chunk_id: pos for pos, chunk_id in enumerate(self.ids)}
+        return self._positions
+
+    def get_text(self, chunk_id):
+        pos = self._get_positions().get(int(chunk_id))
+        return self.texts[pos] if pos is not None else None
+
+    def get_page(self, chunk_id):
+        pos = self._get_positions().get(int(chunk_id))
+        return self.pages[pos] if pos is not None else None
+
+    def get_doc_key(self, chunk_id):
+        pos = self._get_positions().get(int(chunk_id))
+        return self.doc_keys[pos] if pos is not None else None
+
+    def next_id(self):
+        return (max(self.ids) + 1) if self.ids else 0
+
+    def ids_for_documents(self, doc_keys):
+        doc_keys = set(doc_keys)
+        return [chunk_id for chunk_id, doc_key in zip(self.ids, self.doc_keys) if doc_key in doc_keys]
+
+    def document_chunks(self, doc_key):
+        """Returns {hash: [chunk ids]} for one document."""
+        by_hash = {}
+        for chunk_id, chunk_doc_key, chunk_hash in zip(self.ids, self.doc_keys, self.hashes):
+            if chunk_doc_key == doc_key:
+                by_hash.setdefault(chunk_hash, []).append(chunk_id)
+        return by_hash
+
+    def document_keys(self):
+        return sorted(set(self.doc_keys))
+
+    def count_ids_in_range(self, start, stop):
+        return sum(1 for chunk_id in self.ids if start <= chunk_id < stop)
+
+    # --- mutation ---
+
+    def add(self, ids, texts, doc_key, hashes=None, pages=None):
+        self.ids.extend(int(i) for i in ids)
+        self.texts.extend(texts)
+        self.doc_keys.extend([doc_key] * len(texts))
+        self.hashes.extend(hashes if hashes is not None else [hash_chunk(t) for t in texts])
+        self.pages.extend(pages if pages is not None else [None] * len(texts))
+        self._positions = None
+
+    def remove(self, ids):
+        remove = set(int(i) for i in ids)
+        keep = [pos for pos, chunk_id in enumerate(self.ids) if chunk_id not in remove]
+        self.ids = [self.ids[pos] for pos in keep]
+        self.texts = [self.texts[pos] for pos in keep]
+        self.doc_keys = [self.doc_keys[pos] for pos in keep]
+        self.hashes = [self.hashes[pos] for pos in keep]
+        self.pages = [self.pages[pos] for pos in keep]
+        self._positions = None
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def write_chunk_file(path, store):
+    """Writes a ChunkStore in the mmap-able chunk file format."""
+    order = sorted(range(len(store)), key=lambda pos: store.ids[pos])
+    encoded = [store.texts[pos].encode("utf-8", errors="ignore") for pos in order]
+    doc_key_table = sorted(set(store.doc_keys))
+    doc_key_index = {doc_key: i for i, doc_key in enumerate(doc_key_table)}
+    n_chunks = len(order)
+
+    arrays = [
+        ("ids", np.array([store.ids[pos] for pos in order], dtype="int64")),
+        ("offsets", np.concatenate([[0], np.cumsum([len(b) for b in encoded], dtype="int64")]).astype("int64")),
+        ("pages", np.array([_NO_PAGE if store.pages[pos] is None else store.pages[pos] for pos in order], dtype="int32")),
+        ("doc_indexes", np.array([doc_key_index[store.doc_keys[pos]] for pos in order], dtype="int32")),
+        ("hashes", np.array([store.hashes[pos] for pos in order], dtype=_HASH_DTYPE)),
+    ]
+
+    # Section offsets are relative to the (8-byte aligned) end of the header
+    sections = {}
+    offset = 0
+    for name, array in arrays:
+        sections[name] = offset
+        offset = _align(offset + array.nbytes)
+    sections["text"] = offset
+    header = {"version": CHUNK_FILE_VERSION, "count": n_chunks, "doc_keys": doc_key_table, "sections": sections}
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(CHUNK_FILE_MAGIC) + 4 + len(header_bytes))
+
+    with open(path, "wb") as f:
+        f.write(CHUNK_FILE_MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays:
+            f.write(b"\0" * (data_start + sections[name] - f.tell()))
+            f.write(array.tobytes())
+        f.write(b"\0" * (data_start + sections["text"] - f.tell()))
+        for chunk_bytes in encoded:
+            f.write(chunk_bytes)
+
+
+class MappedChunkStore:
+    """
+    Read-only view of a chunk file through mmap. Opening it only parses the header; text is read
+    row by row on lookup, so a search touches a few pages instead of unpickling every chunk, and
+    processes serving the same KB share the OS page cache instead of each holding a copy.
+
+    Exposes the same lookups as ChunkStore; call to_chunk_store() to get a mutable copy.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            # The mapping stays valid after the file is closed (or unlinked, for GCS temp copies)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(CHUNK_FILE_MAGIC)] != CHUNK_FILE_MAGIC:
+            raise ValueError(f"{path} is not a chunk file")
+        header_start = len(CHUNK_FILE_MAGIC) + 4
+        (header_size,) = struct.unpack("<I", self._mmap[len(CHUNK_FILE_MAGIC):header_start])
+        header = json.loads(self._mmap[header_start:header_start + header_size].decode("utf-8"))
+        if header["version"] != CHUNK_FILE_VERSION:
+            raise ValueError(f"Unsupported chunk file version {header['version']}")
+
+        n_chunks = header["count"]
+        data_start = _align(header_start + header_size)
+        sections = {name: data_start + offset for name, offset in header["sections"].items()}
+        self._doc_key_table = header["doc_keys"]
+        self._ids = np.frombuffer(self._mmap, dtype="int64", count=n_chunks, offset=sections["ids"])
+        self._offsets = np.frombuffer(self._mmap, dtype="int64", count=n_chunks + 1, offset=sections["offsets"])
+        self._pages = np.frombuffer(self._mmap, dtype="int32", count=n_chunks, offset=sections["pages"])
+        self._doc_indexes = np.frombuffer(self._mmap, dtype="int32", count=n_chunks, offset=sections["doc_indexes"])
+        self._hashes = np.frombuffer(self._mmap, dtype=_HASH_DTYPE, count=n_chunks, offset=sections["hashes"])
+        self._text_offset = sections["text"]
+        self.version = None # Storage version the file was read at (set by _load_vector_store)
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def ids(self):
+        return self._ids
+
+    @property
+    def nbytes(self):
+        return len(self._mmap)
+
+    def _row(self, chunk_id):
+        row = int(np.searchsorted(self._ids, chunk_id))
+        if row < len(self._ids) and self._ids[row] == chunk_id:
+            return row
+        return None
+
+    def _text_at(self, row):
+        start = self._text_offset + int(self._offsets[row])
+        end = self._text_offset + int(self._offsets[row + 1])
+        return self._mmap[start:end].decode("utf-8")
+
+    def get_text(self, chunk_id):
+        row = self._row(int(chunk_id))
+        return self._text_at(row) if row is not None else None
+
+    def get_page(self, chunk_id):
+        row = self._row(int(chunk_id))
+        if row is None or self._pages[row] == _NO_PAGE:
+            return None
+        return int(self._pages[row])
+
+    def get_doc_key(self, chunk_id):
+        row = self._row(int(chunk_id))
+        return self._doc_key_table[self._doc_indexes[row]] if row is not None else None
+
+    def next_id(self):
+        return int(self._ids[-1]) + 1 if len(self._ids) else 0
+
+    def document_keys(self):
+        return list(self._doc_key_table)
+
+    def document_chunks(self, doc_key):
+        """Returns {hash: [chunk ids]} for one document."""
+        if doc_key not in self._doc_key_table:
+            return {}
+        rows = np.flatnonzero(self._doc_indexes == self._doc_key_table.index(doc_key))
+        by_hash = {}
+        for row in rows:
+            by_hash.setdefault(self._hashes[row].decode("ascii"), []).append(int(self._ids[row]))
+        return by_hash
+
+    def count_ids_in_range(self, start, stop):
+        # Rows are sorted by id
+        return int(np.searchsorted(self._ids, stop) - np.searchsorted(self._ids, start))
+
+    def to_chunk_store(self):
+        """Materializes every row into a mutable ChunkStore (for incremental updates)."""
+        return ChunkStore(
+            ids=self._ids.tolist(),
+            texts=[self._text_at(row) for row in range(len(self))],
+            doc_keys=[self._doc_key_table[i] for i in self._doc_indexes],
+            hashes=[h.decode("ascii") for h in self._hashes],
+            pages=[None if p == _NO_PAGE else int(p) for p in self._pages],
+        )
@@ -0,0 +1,189 @@
+# core/utils/vector/disk_cache.py
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024 # 2 GB of downloaded .faiss/.chunks files per machine
+# Files used this recently are never evicted, so a store's two files can't evict each other mid-load
+EVICTION_GRACE_SECONDS = 60
+
+
+class BlobDiskCache:
+    """
+    Local disk tier in front of GCS for vector store files.
+
+    A blob is kept at <root>/<key hash>/<generation>/<file name>, so a cached file can never be
+    stale: a new upload gets a new generation and therefore a new path, and the old generation is
+    deleted when the new one arrives. Files are evicted least-recently-used (by mtime, refreshed
+    on every hit) once the directory exceeds `max_bytes`; files used in the
+    last EVICTION_GRACE_SECONDS are kept even over budget.
+
+    The directory is scanned once, when the cache is created; after that the size and mtime of
+    each file are tracked in memory as files are hit, added and evicted, so an add doesn't walk
+    the directory. Files another process adds later are tracked once this process uses them.
+
+    The directory is shared by every worker process on the machine; files are written under a
+    temp name and renamed into place, and evicting a file that another process has mmapped is
+    safe (the kernel keeps it until the mapping goes away). An eviction candidate is re-checked
+    on disk first, so a file another process used recently is kept.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._files = {file_path: [mtime_ns, size] for mtime_ns, size, file_path in self._cached_files()}
+        self._bytes = sum(size for _, size in self._files.values())
+
+    def _key_dir(self, key):
+        return self.root / hashlib.sha1(str(key).encode("utf-8")).hexdigest()
+
+    def _path(self, key, generation):
+        return self._key_dir(key) / str(generation) / os.path.basename(str(key))
+
+    def fetch(self, storage, key, generation):
+        """Returns a local path holding `key` at `generation`, downloading it through `storage` on a miss."""
+        path = self._path(key, generation)
+        try:
+            os.utime(path) # LRU touch; raises if the file isn't cached
+        except FileNotFoundError:
+            pass
+        else:
+            with self._lock:
+                self.hits += 1
+                entry = self._files.get(str(path))
+                if entry is not None:
+                    entry[0] = time.time_ns()
+            if entry is None:
+                self._track(str(path)) # Added by another process
+            return str(path)
+
+        with self._lock:
+            self.misses += 1
+        self._add(key, generation, lambda tmp_path: storage.download(key, tmp_path, generation=generation))
+        return str(path)
+
+    def put(self, key, generation, source_path):
+        """Copies a file we just uploaded into the cache, so this machine doesn't download it again."""
+        self._add(key, generation, lambda tmp_path: shutil.copyfile(source_path, tmp_path))
+
+    def _add(self, key, generation, write):
+        path = self._path(key, generation)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".download-")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._track(str(path))
+
+        # Older generations of this blob can never be asked for again
+        for generation_dir in self._key_dir(key).iterdir():
+            if generation_dir.name != str(generation):
+                for old_path in generation_dir.iterdir():
+                    self._forget(str(old_path))
+                shutil.rmtree(generation_dir, ignore_errors=True)
+        self._evict()
+
+    def _cached_files(self):
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith(".download-"):
+                    continue
+                file_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue # Evicted by another process meanwhile
+                files.append((stat.st_mtime_ns, stat.st_size, file_path))
+        return files
+
+    def _track(self, file_path):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._forget_locked(file_path)
+            self._files[file_path] = [stat.st_mtime_ns, stat.st_size]
+            self._bytes += stat.st_size
+
+    def _forget(self, file_path):
+        with self._lock:
+            self._forget_locked(file_path)
+
+    def _forget_locked(self, file_path):
+        entry = self._files.pop(file_path, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _evict(self):
+        with self._lock:
+            if self._bytes <= self.max_bytes:
+                return
+            files = sorted((mtime_ns, size, file_path) for file_path, (mtime_ns, size) in self._files.items())
+        grace_cutoff = time.time_ns() - EVICTION_GRACE_SECONDS * 1_000_000_000
+        for mtime_ns, _, file_path in files:
+            if self._bytes <= self.max_bytes or mtime_ns > grace_cutoff:
+                break
+            try:
+                if os.stat(file_path).st_mtime_ns > grace_cutoff:
+                    self._track(file_path) # Another process used it since we last looked
+                    continue
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass # Evicted by another process
+            except OSError:
+                continue
+            else:
+                with self._lock:
+                    self.evictions += 1
+            self._forget(file_path)
+            try:
+                os.rmdir(os.path.dirname(file_path))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "root": str(self.root),
+                "files": len(self._files),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache():
+    """Returns the process-wide BlobDiskCache, or None if settings.VECTOR_DISK_CACHE_DIR is empty."""
+    global _disk_cache
+    root = getattr(settings, "VECTOR_DISK_CACHE_DIR", "")
+    if not root:
+        return None
+    if _disk_cache is None:
+        with _disk_cache_lock:
+            if _disk_cache is None:
+                _disk_cache = BlobDiskCache(root, getattr(settings, "VECTOR_DISK_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+    return _disk_cache
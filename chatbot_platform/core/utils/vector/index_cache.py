@@ -0,0 +1,144 @@
+# core/utils/vector/index_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core.utils.vector.index_factory import estimate_index_bytes
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024 # 512 MB of loaded indexes + chunk texts per process
+DEFAULT_REVALIDATE_SECONDS = 10
+
+
+def estimate_entry_bytes(index, store):
+    """
+    Rough footprint of a loaded FAISS index plus its chunk store (mmapped data counts too,
+    as page cache). Good enough for budgeting; we don't need to be exact.
+    """
+    index_bytes = estimate_index_bytes(index) if index is not None else 0
+    store_bytes = store.nbytes if store is not None else 0
+    return index_bytes + store_bytes
+
+
+class IndexCache:
+    """
+    Per-process LRU cache of loaded vector stores keyed by index name (e.g. "kb_12").
+
+    Each entry remembers the storage version (file mtime/size locally, blob generation on GCS)
+    it was loaded from. Entries are evicted least-recently-used first once the byte budget is
+    exceeded, and dropped whenever the stored version no longer matches.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, revalidate_seconds=DEFAULT_REVALIDATE_SECONDS):
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, index_name, version_getter):
+        """
+        Returns the cached value for `index_name`, or None on a miss.
+
+        `version_getter` is only called when the entry is older than `revalidate_seconds`,
+        so hot indexes are served without touching storage at all.
+        """
+        with self._lock:
+            entry = self._entries.get(index_name)
+            if entry is None:
+                self.misses += 1
+                return None
+            needs_check = (time.monotonic() - entry["checked_at"]) >= self.revalidate_seconds
+
+        if needs_check:
+            try:
+                current_version = version_getter()
+            except Exception:
+                current_version = None
+            with self._lock:
+                if current_version is None or current_version != entry["version"]:
+                    self._remove(index_name)
+                    self.invalidations += 1
+                    self.misses += 1
+                    return None
+                entry["checked_at"] = time.monotonic()
+
+        with self._lock:
+            if index_name not in self._entries:
+                self.misses += 1
+                return None
+            entry = self._entries[index_name]
+            self._entries.move_to_end(index_name)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, index_name, version, value, nbytes):
+        with self._lock:
+            self._remove(index_name)
+            if nbytes > self.max_bytes:
+                # Larger than the whole budget; serve it uncached rather than flushing everything
+                return
+            while self._entries and self._current_bytes + nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= evicted["nbytes"]
+                self.evictions += 1
+            self._entries[index_name] = {
+                "value": value,
+                "version": version,
+                "nbytes": nbytes,
+                "checked_at": time.monotonic(),
+            }
+            self._current_bytes += nbytes
+
+    def invalidate(self, index_name):
+        with self._lock:
+            if self._remove(index_name):
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, index_name):
+        # Caller must hold self._lock
+        entry = self._entries.pop(index_name, None)
+        if entry is None:
+            return False
+        self._current_bytes -= entry["nbytes"]
+        return True
+
+
+_index_cache = None
+_index_cache_lock = threading.Lock()
+
+
+def get_index_cache():
+    """Returns the process-wide IndexCache configured from settings."""
+    global _index_cache
+    if _index_cache is None:
+        with _index_cache_lock:
+            if _index_cache is None:
+                _index_cache = IndexCache(
+                    max_bytes=getattr(settings, "VECTOR_INDEX_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES),
+                    revalidate_seconds=getattr(settings, "VECTOR_INDEX_CACHE_REVALIDATE_SECONDS", DEFAULT_REVALIDATE_SECONDS),
+                )
+    return _index_cache
@@ -0,0 +1,384 @@
+# core/utils/vector/index_factory.py
+
+import logging
+import math
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_FLAT = "flat"
+INDEX_HNSW = "hnsw"
+INDEX_IVFPQ = "ivfpq"
+INDEX_TYPES = (INDEX_FLAT, INDEX_HNSW, INDEX_IVFPQ)
+
+# How vectors are stored inside the index (orthogonal to the index type)
+QUANT_NONE = "none" # float32, 4 bytes per dimension (IVF indexes use PQ codes regardless)
+QUANT_FP16 = "fp16" # half floats, 2 bytes per dimension, practically lossless
+QUANT_SQ8 = "sq8"   # 8-bit scalar quantization (per-dimension ranges trained on the KB), 1 byte per dimension
+QUANT_PQ = "pq"     # product quantization, 1 byte per PQ sub-vector (48 bytes for 384 dims)
+QUANTIZATIONS = (QUANT_NONE, QUANT_FP16, QUANT_SQ8, QUANT_PQ)
+
+# How vectors are compared
+METRIC_COSINE = "cosine" # Vectors L2-normalized on the way in, inner-product search; distances are cosine similarities
+METRIC_L2 = "l2"         # Raw vectors, squared L2 distances (indexes built before cosine existed)
+METRICS = (METRIC_COSINE, METRIC_L2)
+
+# Size thresholds for "auto": exact search is fast enough for small KBs
+DEFAULT_HNSW_THRESHOLD = 20_000
+DEFAULT_IVFPQ_THRESHOLD = 500_000
+
+HNSW_M = 32                 # Graph neighbours per node; more = better recall, more memory
+HNSW_EF_CONSTRUCTION = 80
+DEFAULT_EF_SEARCH = 64
+DEFAULT_NPROBE = 16
+IVFPQ_MAX_SUBQUANTIZERS = 48 # 384 dims -> 48 sub-vectors of 8 dims, 48 bytes per vector
+IVFPQ_BITS = 8
+IVF_TRAINING_POINTS_PER_LIST = 64 # faiss wants >= 39 points per centroid
+PQ_MIN_BITS = 4 # Fewer than 2**4 * 39 vectors is too few to train PQ codebooks; those KBs get SQ8 instead
+SQ_MAX_TRAINING_POINTS = 100_000 # Per-dimension min/max ranges settle long before this
+
+
+def choose_index_type(n_vectors):
+    """Picks an index type for a KB of `n_vectors`, honouring settings.VECTOR_INDEX_TYPE if it isn't "auto"."""
+    configured = getattr(settings, "VECTOR_INDEX_TYPE", "auto")
+    if configured in INDEX_TYPES:
+        return configured
+
+    if n_vectors < getattr(settings, "VECTOR_INDEX_HNSW_THRESHOLD", DEFAULT_HNSW_THRESHOLD):
+        return INDEX_FLAT
+    if n_vectors < getattr(settings, "VECTOR_INDEX_IVFPQ_THRESHOLD", DEFAULT_IVFPQ_THRESHOLD):
+        return INDEX_HNSW
+    return INDEX_IVFPQ
+
+
+def choose_quantization(quantization=None):
+    """Returns `quantization` if valid, else settings.VECTOR_QUANTIZATION ("none" if unset)."""
+    if quantization in QUANTIZATIONS:
+        return quantization
+    configured = getattr(settings, "VECTOR_QUANTIZATION", QUANT_NONE)
+    return configured if configured in QUANTIZATIONS else QUANT_NONE
+
+
+def choose_metric(metric=None):
+    """Returns `metric` if valid, else settings.VECTOR_METRIC ("cosine" if unset)."""
+    if metric in METRICS:
+        return metric
+    configured = getattr(settings, "VECTOR_METRIC", METRIC_COSINE)
+    return configured if configured in METRICS else METRIC_COSINE
+
+
+def _pq_bits(n_vectors):
+    # 2**bits centroids per sub-quantizer, each wanting ~39 training points
+    return min(IVFPQ_BITS, int(math.log2(max(n_vectors, 1) / 39))) if n_vectors >= 39 else 0
+
+
+def _training_sample(vectors, max_points):
+    if len(vectors) <= max_points:
+        return vectors
+    return vectors[np.random.default_rng(0).choice(len(vectors), max_points, replace=False)]
+
+
+def _pq_subquantizers(dim):
+    # PQ needs the dimension to split evenly; take the largest divisor under the cap
+    for m in range(min(IVFPQ_MAX_SUBQUANTIZERS, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+_SQ_TYPES = {QUANT_FP16: faiss.ScalarQuantizer.QT_fp16, QUANT_SQ8: faiss.ScalarQuantizer.QT_8bit}
+
+
+def _create_index(dim, n_vectors, index_type, training_vectors, quantization=QUANT_NONE, metric=METRIC_L2):
+    """Creates (and trains, if needed) an empty index of the given type, vector storage and metric."""
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == METRIC_COSINE else faiss.METRIC_L2
+    if quantization == QUANT_PQ and index_type != INDEX_IVFPQ and _pq_bits(n_vectors) < PQ_MIN_BITS:
+        logger.info(f"Only {n_vectors} vectors, too few to train PQ; using SQ8 instead")
+        quantization = QUANT_SQ8
+
+    if index_type == INDEX_HNSW:
+        if quantization in _SQ_TYPES:
+            index = faiss.IndexHNSWSQ(dim, _SQ_TYPES[quantization], HNSW_M, faiss_metric)
+        elif quantization == QUANT_PQ:
+            index = faiss.IndexHNSWPQ(dim, _pq_subquantizers(dim), HNSW_M, _pq_bits(n_vectors), faiss_metric)
+        else:
+            index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss_metric)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type == INDEX_IVFPQ:
+        # ~4*sqrt(n) lists, but never more than the data can train
+        nlist = max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // IVF_TRAINING_POINTS_PER_LIST))
+        quantizer = faiss.IndexFlatIP(dim) if metric == METRIC_COSINE else faiss.IndexFlatL2(dim)
+        pq_bits = _pq_bits(n_vectors)
+        if quantization not in _SQ_TYPES and pq_bits < PQ_MIN_BITS:
+            # Small KBs forced to IVF by VECTOR_INDEX_TYPE: too few vectors to train PQ codebooks
+            logger.info(f"Only {n_vectors} vectors, too few to train PQ; using IVF-SQ8 instead")
+            quantization = QUANT_SQ8
+        if quantization in _SQ_TYPES:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, _SQ_TYPES[quantization], faiss_metric)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim), pq_bits, faiss_metric)
+
+        sample = _training_sample(training_vectors, max(nlist * IVF_TRAINING_POINTS_PER_LIST, 2 ** pq_bits * 39))
+        logger.info(f"Training IVF index (nlist={nlist}, {quantization}) on {len(sample)} vectors")
+        index.train(sample)
+        return index
+    elif quantization in _SQ_TYPES:
+        index = faiss.IndexScalarQuantizer(dim, _SQ_TYPES[quantization], faiss_metric)
+    elif quantization == QUANT_PQ:
+        index = faiss.IndexPQ(dim, _pq_subquantizers(dim), _pq_bits(n_vectors), faiss_metric)
+    else:
+        index = faiss.IndexFlatIP(dim) if metric == METRIC_COSINE else faiss.IndexFlatL2(dim)
+
+    if not index.is_trained:
+        # SQ8 ranges / PQ codebooks; fp16 and float32 need no training
+        index.train(_training_sample(training_vectors, SQ_MAX_TRAINING_POINTS))
+    return index
+
+
+def build_index(embeddings, index_type=None, ids=None, quantization=None, metric=None):
+    """
+    Builds and populates a FAISS index for `embeddings` (float32, shape (n, dim)).
+    Any training the index type needs (IVF centroids, SQ ranges, PQ codebooks) happens here.
+    `quantization` picks how vectors are stored (see QUANTIZATIONS; default settings.VECTOR_QUANTIZATION),
+    `metric` how they are compared (see METRICS; default settings.VECTOR_METRIC). For "cosine",
+    `embeddings` are L2-normalized in place when they are already a float32 array.
+
+    Every vector is stored under an explicit int64 id (`ids`, default 0..n-1) so chunks can later
+    be added and removed without renumbering: IVF indexes take ids natively, flat/HNSW indexes are
+    wrapped in an IndexIDMap2.
+
+    Returns:
+        (faiss.Index, str): The populated index and the index type that was used.
+    """
+    n_vectors, dim = embeddings.shape
+    index_type = index_type or choose_index_type(n_vectors)
+    if index_type not in INDEX_TYPES:
+        index_type = INDEX_FLAT
+    if ids is None:
+        ids = np.arange(n_vectors, dtype="int64")
+
+    metric = choose_metric(metric)
+    if metric == METRIC_COSINE:
+        embeddings = normalize_vectors(embeddings)
+    base_index = _create_index(dim, n_vectors, index_type, embeddings, choose_quantization(quantization), metric)
+    # IndexIDMap can't sit on IVF: IVF removals don't compact, which desyncs the id map
+    index = base_index if index_type == INDEX_IVFPQ else faiss.IndexIDMap2(base_index)
+    index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    return index, index_type
+
+
+def unwrap_index(index):
+    """Returns the index doing the actual search (below any IndexIDMap wrapper)."""
+    if isinstance(index, faiss.IndexIDMap) or isinstance(index, faiss.IndexIDMap2):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def is_id_mapped(index):
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexIVF))
+
+
+def ensure_id_mapped(index):
+    """
+    Upgrades an index written before explicit ids (plain IndexFlatL2, ids == positions) so it
+    supports add_with_ids/remove_ids. Already id-mapped indexes are returned unchanged.
+    """
+    if is_id_mapped(index):
+        return index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    upgraded = faiss.IndexIDMap2(_empty_like(index))
+    upgraded.add_with_ids(vectors, np.arange(index.ntotal, dtype="int64"))
+    return upgraded
+
+
+def _empty_like(index):
+    empty = faiss.clone_index(index)
+    empty.reset()
+    return empty
+
+
+def add_vectors(index, embeddings, ids):
+    if get_metric(index) == METRIC_COSINE:
+        embeddings = normalize_vectors(embeddings)
+    index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    return index
+
+
+def normalize_vectors(vectors):
+    """L2-normalizes rows of `vectors` (in place if already a contiguous float32 array) and returns them."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if vectors.size:
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def remove_vectors(index, ids):
+    """
+    Removes vectors by id. Returns the index to use afterwards, which is a rebuilt one for
+    index types that can't delete in place (HNSW).
+    """
+    ids = np.asarray(list(ids), dtype="int64")
+    if len(ids) == 0:
+        return index
+    if not isinstance(unwrap_index(index), faiss.IndexHNSW):
+        index.remove_ids(faiss.IDSelectorBatch(ids))
+        return index
+
+    # HNSW graphs don't support deletion: re-insert the kept vectors into an empty copy of the index.
+    # The copy keeps the trained SQ ranges / PQ codebooks, and a decoded vector re-encodes to the same
+    # code, so quantized vectors survive any number of rebuilds unchanged (retraining on decoded
+    # vectors would lose a little recall on every update). Nothing is re-embedded.
+    removed = set(ids.tolist())
+    all_ids = faiss.vector_to_array(index.id_map)
+    keep_ids = np.array([i for i in all_ids if i not in removed], dtype="int64")
+    rebuilt = _empty_like(index)
+    if len(keep_ids):
+        # Already normalized for cosine indexes; renormalizing decoded vectors would move them off their codes
+        vectors = np.vstack([index.reconstruct(int(i)) for i in keep_ids]).astype("float32")
+        rebuilt.add_with_ids(vectors, keep_ids)
+    return rebuilt
+
+
+def reconstruct_all(index):
+    """
+    Returns (ids int64[n], float32 vectors (n, d)) for every vector in `index`, e.g. to rebuild it
+    as another type or merge it into a shard. IVF-PQ vectors come back as their PQ approximation.
+    Needs an in-memory (not mmapped) index; IVF indexes get a direct map added.
+    """
+    if isinstance(index, faiss.IndexIVF):
+        invlists = index.invlists
+        id_lists = [
+            faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+            for list_no in range(index.nlist) if invlists.list_size(list_no)
+        ]
+        ids = np.concatenate(id_lists).astype("int64") if id_lists else np.zeros(0, dtype="int64")
+        if len(ids) == 0:
+            return ids, np.zeros((0, index.d), dtype="float32")
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return ids, np.asarray(index.reconstruct_batch(ids), dtype="float32")
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        # id_map[i] is the id of the i-th vector of the wrapped index
+        ids = faiss.vector_to_array(index.id_map).astype("int64")
+        return ids, unwrap_index(index).reconstruct_n(0, index.ntotal)
+    return np.arange(index.ntotal, dtype="int64"), index.reconstruct_n(0, index.ntotal)
+
+
+def get_index_type(index):
+    """Best-effort reverse lookup of the index type for an index loaded from storage."""
+    index = unwrap_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return INDEX_HNSW
+    if isinstance(index, faiss.IndexIVF):
+        return INDEX_IVFPQ
+    return INDEX_FLAT
+
+
+def get_quantization(index):
+    """How an index stores its vectors (one of QUANTIZATIONS)."""
+    index = unwrap_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return QUANT_FP16 if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else QUANT_SQ8
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return QUANT_PQ
+    return QUANT_NONE
+
+
+def get_metric(index):
+    """How an index compares vectors (one of METRICS)."""
+    return METRIC_COSINE if index.metric_type == faiss.METRIC_INNER_PRODUCT else METRIC_L2
+
+
+def prepare_query(index, query_vectors):
+    """Query vectors as `index` expects them: float32, normalized for cosine indexes. Doesn't modify the input."""
+    query_vectors = np.array(query_vectors, dtype="float32", ndmin=2)
+    return normalize_vectors(query_vectors) if get_metric(index) == METRIC_COSINE else query_vectors
+
+
+def similarity_scores(index, distances):
+    """
+    Converts FAISS search distances to cosine similarities (1 = same direction, 0 = unrelated).
+    Cosine indexes return them directly; for L2 indexes 1 - d/2 is exact when the stored vectors
+    are unit length (as all-MiniLM-L6-v2's are) and an approximation otherwise.
+    """
+    distances = np.asarray(distances, dtype="float32")
+    if get_metric(index) == METRIC_COSINE:
+        return distances
+    return 1.0 - distances / 2.0
+
+
+def lookup_similarities(index, query_vector, ids):
+    """
+    Cosine similarities between a prepared query vector and the stored vectors `ids`, read back
+    from the index (e.g. for keyword hits the vector search didn't return). Returns {id: similarity};
+    empty for IVF indexes, which can't look vectors up by id without a direct map.
+    """
+    ids = np.asarray(list(ids), dtype="int64")
+    if len(ids) == 0 or not isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return {}
+    try:
+        vectors = index.reconstruct_batch(ids)
+    except RuntimeError:
+        return {}
+    query_vector = np.asarray(query_vector, dtype="float32").reshape(-1)
+    if get_metric(index) == METRIC_COSINE:
+        distances = vectors @ query_vector
+    else:
+        distances = ((vectors - query_vector) ** 2).sum(axis=1)
+    return {int(i): float(s) for i, s in zip(ids, similarity_scores(index, distances))}
+
+
+def get_search_params(index, nprobe=None, ef_search=None):
+    """
+    Per-query recall/latency knobs. Passed to index.search(params=...) instead of mutating the
+    index, because cached indexes are shared between request threads.
+    """
+    index = unwrap_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or getattr(settings, "VECTOR_SEARCH_EF_SEARCH", DEFAULT_EF_SEARCH))
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe or getattr(settings, "VECTOR_SEARCH_NPROBE", DEFAULT_NPROBE))
+    return None
+
+
+def get_filtered_search_params(index, id_selector, selectivity=1.0, nprobe=None, ef_search=None):
+    """
+    Search params that only return ids accepted by `id_selector` (e.g. one KB's id range in a
+    shard). `selectivity` is the fraction of the index the selector accepts: HNSW only collects
+    matching ids while walking the graph, so its candidate list is widened accordingly.
+    The caller must keep `id_selector` alive until the search returns.
+    """
+    if isinstance(unwrap_index(index), faiss.IndexHNSW):
+        ef_search = ef_search or getattr(settings, "VECTOR_SEARCH_EF_SEARCH", DEFAULT_EF_SEARCH)
+        if selectivity < 1.0:
+            ef_search = min(int(math.ceil(ef_search / max(selectivity, 1e-6))), max(int(index.ntotal), 1))
+    params = get_search_params(index, nprobe=nprobe, ef_search=ef_search) or faiss.SearchParameters()
+    params.sel = id_selector
+    return params
+
+
+def estimate_index_bytes(index):
+    """Approximate resident size of a populated index, for the index cache byte budget."""
+    n_vectors = int(getattr(index, "ntotal", 0))
+    # int64 id per vector; IDMap2 also keeps a reverse hash map, roughly doubling that
+    id_bytes = 0
+    if isinstance(index, faiss.IndexIVF):
+        id_bytes = n_vectors * 8
+    elif is_id_mapped(index):
+        id_bytes = n_vectors * 16
+    index = unwrap_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        # Stored vectors (full or quantized) plus ~2*M neighbour ids on the base layer
+        try:
+            vector_bytes = int(faiss.downcast_index(index.storage).sa_code_size())
+        except RuntimeError:
+            vector_bytes = int(index.d) * 4
+        return id_bytes + n_vectors * (vector_bytes + HNSW_M * 2 * 4)
+    try:
+        return id_bytes + n_vectors * int(index.sa_code_size())
+    except RuntimeError:
+        return id_bytes + n_vectors * int(getattr(index, "d", 0)) * 4
@@ -0,0 +1,178 @@
+# core/utils/vector/keyword_index.py
+
+import re
+
+import numpy as np
+
+# Retrieval modes (KnowledgeBase.retrieval_mode)
+MODE_DENSE = "dense"       # FAISS vector search only
+MODE_KEYWORD = "keyword"   # BM25 only
+MODE_HYBRID = "hybrid"     # Both, merged with reciprocal-rank fusion
+RETRIEVAL_MODES = (MODE_DENSE, MODE_KEYWORD, MODE_HYBRID)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+DEFAULT_RRF_K = 60 # Standard RRF constant; dampens the weight of top ranks
+
+# Words plus codes joined by - _ . / (e.g. "XJ-42", "ERR_CONN_RESET", "v2.1"), lowercased
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_RE = re.compile(r"[-_./]")
+MAX_TOKEN_LENGTH = 64 # Longer "tokens" are URLs/base64 blobs; they'd only bloat the term table
+
+
+def tokenize(text):
+    """Lowercased word/code tokens. Compound codes are also split, so "xj-42" matches "XJ 42" too."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if len(token) > MAX_TOKEN_LENGTH:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in _PART_RE.split(token) if part)
+    return tokens
+
+
+class KeywordIndex:
+    """
+    BM25 index over a vector store's chunks, saved next to it as <index name>.bm25.
+
+    Postings are stored per term as (row, weight) arrays where weight is the term's full BM25
+    contribution for that chunk, precomputed at build time. Scoring a query is then a handful
+    of array slices and one np.bincount over the rows, with no Python loop over documents.
+    Rows are sorted by chunk id, so an id range (one KB inside a shard) is a contiguous slice.
+    """
+
+    def __init__(self, ids, terms, term_offsets, rows, weights):
+        self.ids = np.asarray(ids, dtype="int64")
+        self.terms = terms
+        self._term_index = {term: i for i, term in enumerate(terms)}
+        self.term_offsets = np.asarray(term_offsets, dtype="int64")
+        self.rows = np.asarray(rows, dtype="int32")
+        self.weights = np.asarray(weights, dtype="float32")
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return int(self.ids.nbytes + self.term_offsets.nbytes + self.rows.nbytes + self.weights.nbytes
+                   + sum(len(term) for term in self.terms) + 64 * len(self.terms))
+
+    @classmethod
+    def build(cls, ids, texts):
+        order = sorted(range(len(ids)), key=lambda pos: ids[pos])
+        n_docs = len(order)
+        vocabulary = {} # term -> term number, in order of first appearance
+        doc_lengths = np.zeros(n_docs, dtype="float32")
+        token_terms, token_rows = [], []
+        for row, pos in enumerate(order):
+            tokens = tokenize(texts[pos])
+            doc_lengths[row] = len(tokens)
+            token_terms.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+            token_rows.extend([row] * len(tokens))
+
+        # One (term, row) key per token; unique keys come out grouped by term, counts are term frequencies
+        keys = np.asarray(token_terms, dtype="int64") * max(n_docs, 1) + np.asarray(token_rows, dtype="int64")
+        keys, tfs = np.unique(keys, return_counts=True)
+        term_numbers, rows = np.divmod(keys, max(n_docs, 1))
+        offsets = np.zeros(len(vocabulary) + 1, dtype="int64")
+        offsets[1:] = np.cumsum(np.bincount(term_numbers, minlength=len(vocabulary)))
+        tfs = tfs.astype("float32")
+
+        # BM25: idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avg_len))
+        doc_freqs = np.diff(offsets).astype("float32")
+        idf = np.log(1 + (n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        avg_length = float(doc_lengths.mean()) if n_docs else 1.0
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[rows] / max(avg_length, 1e-6))
+        weights = np.repeat(idf, np.diff(offsets)) * tfs * (BM25_K1 + 1) / (tfs + norms)
+
+        return cls([ids[pos] for pos in order], list(vocabulary), offsets, rows, weights)
+
+    def select(self, start, stop):
+        """The part of the index for chunk ids in [start, stop), keeping the weights it was built with."""
+        start_row, stop_row = np.searchsorted(self.ids, (start, stop))
+        keep = (self.rows >= start_row) & (self.rows < stop_row)
+        term_numbers = np.repeat(np.arange(len(self.terms), dtype="int64"), np.diff(self.term_offsets))[keep]
+        used, term_numbers = np.unique(term_numbers, return_inverse=True)
+        offsets = np.zeros(len(used) + 1, dtype="int64")
+        offsets[1:] = np.cumsum(np.bincount(term_numbers, minlength=len(used)))
+        return KeywordIndex(
+            self.ids[start_row:stop_row], [self.terms[i] for i in used], offsets, self.rows[keep] - start_row, self.weights[keep],
+        )
+
+    @classmethod
+    def concat(cls, parts):
+        """Joins indexes over disjoint id ranges, given in ascending id order. Each part keeps its own weights."""
+        if not parts:
+            return cls([], [], [0], [], [])
+        vocabulary = {}
+        ids, term_numbers, rows, weights = [], [], [], []
+        row_offset = 0
+        for part in parts:
+            part_terms = np.array([vocabulary.setdefault(term, len(vocabulary)) for term in part.terms], dtype="int64")
+            term_numbers.append(np.repeat(part_terms, np.diff(part.term_offsets)))
+            rows.append(part.rows.astype("int64") + row_offset)
+            weights.append(part.weights)
+            ids.append(part.ids)
+            row_offset += len(part)
+
+        # Group the postings by (global) term; the stable sort keeps each term's rows ascending
+        term_numbers = np.concatenate(term_numbers)
+        order = np.argsort(term_numbers, kind="stable")
+        offsets = np.zeros(len(vocabulary) + 1, dtype="int64")
+        offsets[1:] = np.cumsum(np.bincount(term_numbers, minlength=len(vocabulary)))
+        return cls(np.concatenate(ids), list(vocabulary), offsets, np.concatenate(rows)[order], np.concatenate(weights)[order])
+
+    def search(self, query, top_n, id_range=None):
+        """Returns [(chunk id, score)] for the best `top_n` chunks containing a query term, best first."""
+        term_numbers = {self._term_index[t] for t in tokenize(query) if t in self._term_index}
+        if not term_numbers or not len(self.ids):
+            return []
+        slices = [slice(self.term_offsets[i], self.term_offsets[i + 1]) for i in term_numbers]
+        rows = np.concatenate([self.rows[s] for s in slices])
+        weights = np.concatenate([self.weights[s] for s in slices])
+
+        if id_range is not None:
+            start_row, stop_row = np.searchsorted(self.ids, id_range)
+            in_range = (rows >= start_row) & (rows < stop_row)
+            rows, weights = rows[in_range], weights[in_range]
+            if not len(rows):
+                return []
+
+        # Only rows that matched something get a score; accumulate per row
+        matched, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights, minlength=len(matched))
+        top_n = min(top_n, len(matched))
+        best = np.argpartition(-scores, top_n - 1)[:top_n]
+        best = best[np.argsort(-scores[best])]
+        return [(int(self.ids[matched[i]]), float(scores[i])) for i in best]
+
+    # --- (de)serialization ---
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                ids=self.ids,
+                terms=np.array(self.terms, dtype="U"),
+                term_offsets=self.term_offsets,
+                rows=self.rows,
+                weights=self.weights,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["ids"], data["terms"].tolist(), data["term_offsets"], data["rows"], data["weights"])
+
+
+def reciprocal_rank_fusion(rankings, k=DEFAULT_RRF_K):
+    """
+    Merges ranked id lists: score(id) = sum over lists of 1 / (k + rank). Scores from different
+    retrievers (cosine similarities, BM25) aren't comparable, ranks are. Returns [(id, score)], best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
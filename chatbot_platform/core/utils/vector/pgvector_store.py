@@ -0,0 +1,428 @@
+# core/utils/vector/pgvector_store.py
+
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+
+from core.utils import metrics
+from core.utils.vector.chunk_store import DEFAULT_DOC_KEY, hash_chunk
+from core.utils.vector.keyword_index import (
+    DEFAULT_RRF_K, MODE_DENSE, MODE_HYBRID, MODE_KEYWORD, reciprocal_rank_fusion, tokenize,
+)
+from core.utils.vector.index_factory import METRIC_COSINE, choose_metric, normalize_vectors
+from core.utils.vector.vector_logic import (
+    DEFAULT_HYBRID_CANDIDATES, ScoredChunk, _encode_chunks, _is_chunk, _split_chunk, get_min_similarity,
+)
+from core.utils.vector.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+TABLE_PREFIX = "vector_chunks_"
+INDEX_TYPE = "pgvector"
+INSERT_BATCH_SIZE = 500
+DEFAULT_EF_SEARCH = 64
+DEFAULT_ITERATIVE_SCAN = "relaxed_order"
+ITERATIVE_SCAN_MIN_VERSION = (0, 8)
+TEXT_SEARCH_CONFIG = "simple" # No stemming or stop words, so codes and identifiers match exactly
+
+
+def _vector_literal(vector):
+    # pgvector's text input format; lets us pass vectors through the plain DB driver without the pgvector package
+    return "[" + ",".join(f"{x:.7g}" for x in np.asarray(vector, dtype="float32").reshape(-1)) + "]"
+
+
+class PgVectorStore(VectorStore):
+    """
+    Chunks and vectors as rows in Postgres with the pgvector extension.
+
+    Rows of every KB share one table per embedding dimension (vector_chunks_<dim>) with an HNSW
+    index on the embedding and a btree on (index_name, doc_key), so a search is one indexed
+    query on a pooled DB connection: nothing is loaded per request and there is no per-KB file
+    to open, however many KBs there are. Tables and the extension are created on first use.
+
+    Searches filter on index_name; Postgres uses the btree (exact search) for small KBs and the
+    HNSW index for large ones. The HNSW scan collects ef_search candidates from every KB in the
+    table before the filter, so with pgvector >= 0.8 it runs as an iterative scan
+    (PGVECTOR_ITERATIVE_SCAN, "relaxed_order" by default) that keeps going until `top_k` rows of
+    the KB are found. When a scan still comes back short (older pgvector, or iterative scans
+    off), the query is repeated as an exact scan of the KB's own rows. KBs with no more than
+    `top_k` rows skip HNSW and are scanned exactly straight away.
+
+    Keyword and hybrid searches use Postgres full-text search (a GIN index on the content's
+    tsvector, ranked with ts_rank_cd) in place of the BM25 files the FAISS backends keep.
+
+    With VECTOR_METRIC="cosine" vectors are normalized before they are written, so the L2 HNSW
+    index orders rows by cosine similarity; scores are always computed with pgvector's <=>.
+    """
+
+    name = INDEX_TYPE
+
+    def __init__(self, using="default"):
+        self.using = using
+        self._known_tables = set()
+        self._supports_iterative_scan = None
+
+    # --- schema ---
+
+    def _connection(self):
+        connection = connections[self.using]
+        if connection.vendor != "postgresql":
+            raise ImproperlyConfigured(
+                f"VECTOR_STORE_BACKEND='pgvector' needs a PostgreSQL database, but '{self.using}' is {connection.vendor}."
+            )
+        return connection
+
+    def _table_name(self, dim):
+        return f"{TABLE_PREFIX}{int(dim)}"
+
+    def _ensure_table(self, dim):
+        table = self._table_name(dim)
+        if table in self._known_tables:
+            return table
+        with self._connection().cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    index_name varchar(100) NOT NULL,
+                    chunk_id bigint NOT NULL,
+                    doc_key varchar(100) NOT NULL,
+                    content text NOT NULL,
+                    content_hash char(40) NOT NULL,
+                    page integer NULL,
+                    embedding vector({int(dim)}) NOT NULL,
+                    PRIMARY KEY (index_name, chunk_id)
+                )
+            """)
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_doc_idx ON {table} (index_name, doc_key)")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_hnsw_idx ON {table} USING hnsw (embedding vector_l2_ops)")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_fts_idx ON {table} "
+                f"USING gin (to_tsvector('{TEXT_SEARCH_CONFIG}', content))"
+            )
+        # Only once it's committed: a rollback of the caller's transaction also drops the table
+        transaction.on_commit(lambda: self._known_tables.add(table), using=self.using)
+        return table
+
+    def _tables(self):
+        """Every vector_chunks_<dim> table that exists (KBs may have been built with different models)."""
+        with self._connection().cursor() as cursor:
+            cursor.execute(
+                "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE %s",
+                [TABLE_PREFIX.replace("_", r"\_") + "%"],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    # --- writes ---
+
+    def _insert(self, cursor, table, index_name, doc_key, ids, texts, pages, embeddings):
+        if choose_metric() == METRIC_COSINE:
+            embeddings = normalize_vectors(embeddings)
+        rows = [
+            (index_name, int(chunk_id), doc_key, text, hash_chunk(text), page, _vector_literal(vector))
+            for chunk_id, text, page, vector in zip(ids, texts, pages, embeddings)
+        ]
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            cursor.executemany(
+                f"INSERT INTO {table} (index_name, chunk_id, doc_key, content, content_hash, page, embedding) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s::vector)",
+                rows[start:start + INSERT_BATCH_SIZE],
+            )
+
+    def build(self, index_name, chunks, model, progress_callback=None, index_type=None, doc_key=DEFAULT_DOC_KEY, quantization=None):
+        # index_type / quantization are FAISS options; rows always hold full vector(dim) values
+        if isinstance(chunks, str) or not hasattr(chunks, "__iter__"):
+            print("Error: 'chunks' must be a list of strings")
+            return
+        texts, pages, embeddings = _encode_chunks(chunks, model, progress_callback)
+        if not texts:
+            print("Warning: Chunks list is empty. No embeddings will be created.")
+            return
+
+        started = time.perf_counter()
+        table = self._ensure_table(embeddings.shape[1])
+        with transaction.atomic(using=self.using), self._connection().cursor() as cursor:
+            # Replaces the KB in one transaction: searches see the old rows until it commits
+            for existing_table in self._tables():
+                cursor.execute(f"DELETE FROM {existing_table} WHERE index_name = %s", [index_name])
+            self._insert(cursor, table, index_name, doc_key, range(len(texts)), texts, pages, embeddings)
+        metrics.record_ingestion_stage(metrics.STAGE_STORE_WRITE, time.perf_counter() - started)
+        print(f"pgvector rows written for {index_name}: {len(texts)} vectors in {table}.")
+        return {"vectors": len(texts), "index_type": INDEX_TYPE}
+
+    def upsert_document(self, index_name, doc_key, chunks, model, progress_callback=None):
+        chunks = list(chunks)
+        if not all(_is_chunk(c) for c in chunks):
+            print("Error: 'chunks' must be a list of strings")
+            return
+        if not chunks:
+            print("Warning: Chunks list is empty. Use remove_documents() to drop a document.")
+            return
+        if not self.list_documents(index_name):
+            result = self.build(index_name, chunks, model, progress_callback=progress_callback, doc_key=doc_key)
+            if result:
+                result.update({"added": result["vectors"], "removed": 0, "unchanged": 0})
+            return result
+
+        existing = {} # {hash: [ids]}, same matching as vector_logic.upsert_document
+        with self._connection().cursor() as cursor:
+            for table in self._tables():
+                cursor.execute(
+                    f"SELECT chunk_id, content_hash FROM {table} WHERE index_name = %s AND doc_key = %s",
+                    [index_name, doc_key],
+                )
+                for chunk_id, chunk_hash in cursor.fetchall():
+                    existing.setdefault(chunk_hash, []).append(chunk_id)
+
+        new_chunks = []
+        unchanged = 0
+        for chunk in chunks:
+            chunk_hash = hash_chunk(_split_chunk(chunk)[0])
+            if existing.get(chunk_hash):
+                existing[chunk_hash].pop()
+                unchanged += 1
+            else:
+                new_chunks.append(chunk)
+        stale_ids = [chunk_id for ids in existing.values() for chunk_id in ids]
+
+        texts, pages, embeddings = [], [], None
+        if new_chunks:
+            # Encode before opening the transaction so rows aren't locked while the model runs
+            texts, pages, embeddings = _encode_chunks(new_chunks, model, progress_callback)
+            if texts is None:
+                return
+
+        started = time.perf_counter()
+        with transaction.atomic(using=self.using), self._connection().cursor() as cursor:
+            if stale_ids:
+                for table in self._tables():
+                    cursor.execute(
+                        f"DELETE FROM {table} WHERE index_name = %s AND chunk_id = ANY(%s)",
+                        [index_name, stale_ids],
+                    )
+            if new_chunks:
+                table = self._ensure_table(embeddings.shape[1])
+                next_id = self._next_id(cursor, index_name)
+                new_ids = range(next_id, next_id + len(texts))
+                self._insert(cursor, table, index_name, doc_key, new_ids, texts, pages, embeddings)
+            vectors = self._count(cursor, index_name)
+        metrics.record_ingestion_stage(metrics.STAGE_STORE_WRITE, time.perf_counter() - started)
+
+        print(f"Updated '{doc_key}' in {index_name}: {len(new_chunks)} added, {len(stale_ids)} removed, {unchanged} unchanged.")
+        return {
+            "vectors": vectors,
+            "index_type": INDEX_TYPE,
+            "added": len(new_chunks),
+            "removed": len(stale_ids),
+            "unchanged": unchanged,
+        }
+
+    def _next_id(self, cursor, index_name):
+        next_id = 0
+        for table in self._tables():
+            cursor.execute(f"SELECT MAX(chunk_id) FROM {table} WHERE index_name = %s", [index_name])
+            max_id = cursor.fetchone()[0]
+            if max_id is not None:
+                next_id = max(next_id, max_id + 1)
+        return next_id
+
+    def _count(self, cursor, index_name):
+        total = 0
+        for table in self._tables():
+            cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE index_name = %s", [index_name])
+            total += cursor.fetchone()[0]
+        return total
+
+    def remove_documents(self, index_name, doc_keys):
+        removed = 0
+        with transaction.atomic(using=self.using), self._connection().cursor() as cursor:
+            for table in self._tables():
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE index_name = %s AND doc_key = ANY(%s)",
+                    [index_name, list(doc_keys)],
+                )
+                removed += cursor.rowcount
+        if removed:
+            print(f"Removed {removed} chunks of {list(doc_keys)} from {index_name}.")
+        return removed
+
+    def delete(self, index_name):
+        with transaction.atomic(using=self.using), self._connection().cursor() as cursor:
+            for table in self._tables():
+                cursor.execute(f"DELETE FROM {table} WHERE index_name = %s", [index_name])
+                if cursor.rowcount:
+                    print(f"Deleted {cursor.rowcount} pgvector rows for {index_name} from {table}")
+
+    # --- reads ---
+
+    def list_documents(self, index_name):
+        doc_keys = set()
+        with self._connection().cursor() as cursor:
+            for table in self._tables():
+                cursor.execute(f"SELECT DISTINCT doc_key FROM {table} WHERE index_name = %s", [index_name])
+                doc_keys.update(row[0] for row in cursor.fetchall())
+        return sorted(doc_keys)
+
+    def _iterative_scan(self, cursor):
+        """PGVECTOR_ITERATIVE_SCAN, or None if it's off or the installed pgvector predates iterative scans."""
+        mode = getattr(settings, "PGVECTOR_ITERATIVE_SCAN", DEFAULT_ITERATIVE_SCAN)
+        if not mode or mode == "off":
+            return None
+        if self._supports_iterative_scan is None:
+            cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            row = cursor.fetchone()
+            version = tuple(int(part) for part in row[0].split(".")[:2]) if row else (0, 0)
+            self._supports_iterative_scan = version >= ITERATIVE_SCAN_MIN_VERSION
+            if not self._supports_iterative_scan:
+                logger.warning(
+                    f"pgvector {row[0] if row else '?'} has no iterative HNSW scans (needs 0.8); "
+                    "short filtered searches are repeated as exact scans"
+                )
+        return mode if self._supports_iterative_scan else None
+
+    def _nearest_rows(self, cursor, table, index_name, vector, limit):
+        # Materialized and re-sorted: relaxed_order may return the scanned rows slightly out of order
+        cursor.execute(
+            f"WITH nearest AS MATERIALIZED ("
+            f"SELECT chunk_id, content, doc_key, page, 1 - (embedding <=> %s::vector), embedding <-> %s::vector AS distance "
+            f"FROM {table} WHERE index_name = %s ORDER BY distance LIMIT %s"
+            ") SELECT * FROM nearest ORDER BY distance",
+            [vector, vector, index_name, int(limit)],
+        )
+        return [row[:5] for row in cursor.fetchall()]
+
+    def _has_more_rows(self, cursor, table, index_name, limit):
+        """Whether the KB has more than `limit` rows in `table`; reads at most limit + 1 btree entries."""
+        cursor.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE index_name = %s LIMIT %s) AS kb_rows",
+            [index_name, int(limit) + 1],
+        )
+        return cursor.fetchone()[0] > limit
+
+    def _exact_rows(self, cursor, table, index_name, vector, limit):
+        # Without index scans Postgres reads the KB's rows through the (index_name, doc_key) btree
+        # (as a bitmap scan) and sorts them exactly, instead of walking the table-wide HNSW graph
+        cursor.execute("SELECT current_setting('enable_indexscan')")
+        previous = cursor.fetchone()[0]
+        cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+        rows = self._nearest_rows(cursor, table, index_name, vector, limit)
+        cursor.execute("SELECT set_config('enable_indexscan', %s, true)", [previous])
+        return rows
+
+    def _dense_rows(self, cursor, table, index_name, query_vec, limit):
+        vector = _vector_literal(query_vec)
+        if not self._has_more_rows(cursor, table, index_name, limit):
+            # The KB has at most `limit` rows: all of them are the answer, and HNSW could only miss some
+            return self._exact_rows(cursor, table, index_name, vector, limit)
+
+        # SET LOCAL only lasts until the end of the caller's transaction, so pooled connections aren't affected
+        cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [str(getattr(settings, "PGVECTOR_EF_SEARCH", DEFAULT_EF_SEARCH))])
+        iterative_scan = self._iterative_scan(cursor)
+        if iterative_scan:
+            cursor.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", [iterative_scan])
+        rows = self._nearest_rows(cursor, table, index_name, vector, limit)
+        if len(rows) < limit:
+            # The KB has more rows, but not enough of them were among the HNSW candidates of the whole table
+            rows = self._exact_rows(cursor, table, index_name, vector, limit)
+        return rows
+
+    def _similarities(self, cursor, table, index_name, query_vec, chunk_ids):
+        cursor.execute(
+            f"SELECT chunk_id, 1 - (embedding <=> %s::vector) FROM {table} WHERE index_name = %s AND chunk_id = ANY(%s)",
+            [_vector_literal(query_vec), index_name, list(chunk_ids)],
+        )
+        return {chunk_id: float(similarity) for chunk_id, similarity in cursor.fetchall()}
+
+    def _keyword_rows(self, cursor, tables, index_name, query, limit):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        # websearch_to_tsquery never raises on user input; "or" makes any term match, like BM25
+        tsquery = " or ".join(terms)
+        rows = []
+        for table in tables:
+            cursor.execute(
+                f"SELECT chunk_id, content, doc_key, page, ts_rank_cd(to_tsvector('{TEXT_SEARCH_CONFIG}', content), q) AS rank "
+                f"FROM {table}, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %s) AS q "
+                f"WHERE index_name = %s AND to_tsvector('{TEXT_SEARCH_CONFIG}', content) @@ q "
+                "ORDER BY rank DESC LIMIT %s",
+                [tsquery, index_name, int(limit)],
+            )
+            rows.extend(cursor.fetchall())
+        rows.sort(key=lambda row: -row[4])
+        return rows[:limit]
+
+    def search_scored(self, query, index_name, model, top_k=1, mode=MODE_DENSE, min_similarity=None):
+        if mode not in (MODE_DENSE, MODE_KEYWORD, MODE_HYBRID):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        min_similarity = get_min_similarity(min_similarity)
+        n_candidates = top_k
+        if mode == MODE_HYBRID:
+            n_candidates = max(top_k, getattr(settings, "HYBRID_CANDIDATES", DEFAULT_HYBRID_CANDIDATES))
+
+        rows = {} # chunk_id -> (content, doc_key, page)
+        similarities = {}
+        dense_hits, keyword_hits = [], []
+        with transaction.atomic(using=self.using), self._connection().cursor() as cursor:
+            if mode in (MODE_DENSE, MODE_HYBRID):
+                query_vec = np.array(model.encode([query]), dtype="float32")
+                if choose_metric() == METRIC_COSINE:
+                    query_vec = normalize_vectors(query_vec)
+                query_vec = query_vec[0]
+                table = self._table_name(query_vec.shape[0])
+                if table not in self._known_tables and table not in self._tables():
+                    return [], "Knowledge base not found or not embedded."
+                with metrics.chat_stage(metrics.STAGE_VECTOR_SEARCH):
+                    dense_rows = self._dense_rows(cursor, table, index_name, query_vec, n_candidates)
+                for chunk_id, content, doc_key, page, similarity in dense_rows:
+                    rows[chunk_id] = (content, doc_key, page)
+                    similarities[chunk_id] = float(similarity)
+                    dense_hits.append((chunk_id, float(similarity)))
+            if mode in (MODE_KEYWORD, MODE_HYBRID):
+                with metrics.chat_stage(metrics.STAGE_KEYWORD_SEARCH):
+                    keyword_rows = self._keyword_rows(cursor, self._tables(), index_name, query, n_candidates)
+                for chunk_id, content, doc_key, page, rank in keyword_rows:
+                    rows[chunk_id] = (content, doc_key, page)
+                    keyword_hits.append((chunk_id, float(rank)))
+
+            if mode == MODE_DENSE:
+                ranked = dense_hits
+            elif mode == MODE_KEYWORD:
+                ranked = keyword_hits
+            else:
+                ranked = reciprocal_rank_fusion(
+                    [[chunk_id for chunk_id, _ in dense_hits], [chunk_id for chunk_id, _ in keyword_hits]],
+                    k=getattr(settings, "HYBRID_RRF_K", DEFAULT_RRF_K),
+                )
+                missing = [chunk_id for chunk_id, _ in ranked if chunk_id not in similarities]
+                if min_similarity and missing:
+                    similarities.update(self._similarities(cursor, table, index_name, query_vec, missing))
+
+        results = []
+        for chunk_id, score in ranked:
+            similarity = similarities.get(chunk_id)
+            if similarity is not None and similarity < min_similarity:
+                continue
+            content, doc_key, page = rows[chunk_id]
+            results.append(ScoredChunk(content, score, similarity, chunk_id, doc_key, page))
+            if len(results) == top_k:
+                break
+        return results, None
+
+    def stats(self, index_name=None):
+        stats = {"backend": self.name, "database": self.using, "tables": {}}
+        with self._connection().cursor() as cursor:
+            for table in self._tables():
+                if index_name is None:
+                    cursor.execute(f"SELECT COUNT(*), COUNT(DISTINCT index_name) FROM {table}")
+                    vectors, indexes = cursor.fetchone()
+                    stats["tables"][table] = {"vectors": vectors, "indexes": indexes}
+                else:
+                    cursor.execute(f"SELECT COUNT(*), COUNT(DISTINCT doc_key) FROM {table} WHERE index_name = %s", [index_name])
+                    vectors, documents = cursor.fetchone()
+                    if vectors:
+                        stats["tables"][table] = {"vectors": vectors, "documents": documents}
+        return stats
@@ -0,0 +1,388 @@
+# core/utils/vector/sharded_store.py
+
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+from core.utils import metrics
+from core.utils.vector import vector_logic
+from core.utils.vector.chunk_store import DEFAULT_DOC_KEY, ChunkStore, hash_chunk
+from core.utils.vector.index_factory import (
+    add_vectors, build_index, choose_index_type, ensure_id_mapped, get_filtered_search_params, get_index_type,
+    get_metric, get_quantization, reconstruct_all, remove_vectors,
+)
+from core.utils.vector.keyword_index import MODE_DENSE, KeywordIndex
+from core.utils.vector.vector_store import FaissFileVectorStore, VectorStore
+
+try:
+    import fcntl
+except ImportError: # Windows dev machines: only threads of one process are serialized
+    fcntl = None
+
+DEFAULT_SHARD_COUNT = 16
+# A vector's FAISS id is (index number << 32) | chunk id, so one KB's vectors form a contiguous id range
+INDEX_ID_BITS = 32
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def index_number(index_name):
+    """The number that prefixes an index's vector ids: the KB id for "kb_<id>", a stable hash otherwise."""
+    prefix, _, number = index_name.rpartition("_")
+    if prefix == "kb" and number.isdigit():
+        return int(number)
+    return zlib.crc32(index_name.encode("utf-8")) & 0x7FFFFFFF
+
+
+def index_id_range(index_name):
+    """[start, stop) of the FAISS ids that belong to `index_name` inside its shard."""
+    start = index_number(index_name) << INDEX_ID_BITS
+    return start, start + (1 << INDEX_ID_BITS)
+
+
+def _shard_doc_key(index_name, doc_key):
+    return f"{index_name}/{doc_key}"
+
+
+class ShardedFaissVectorStore(VectorStore):
+    """
+    Packs many KBs into a fixed number of shared FAISS shards (shard_<n>, picked by KB id modulo
+    VECTOR_SHARD_COUNT) instead of one index + chunk file pair per KB.
+
+    Every vector id carries its KB (see index_id_range) and searches pass an IDSelectorRange,
+    so a query only sees its own KB's chunks. A shard is loaded and cached once for all of its
+    KBs, so the number of files and per-query opens stays flat as KBs are added. Chunk doc keys
+    are stored as "<index name>/<doc key>".
+
+    KBs that still have a per-KB store are read from it until they are written again (they are
+    moved into their shard on the next update) or migrated with `manage.py compact_vector_shards`.
+    Writers serialize per shard: with a file lock locally, and with the GCS generation check otherwise.
+    """
+
+    name = "faiss_sharded"
+
+    def __init__(self, shard_count=DEFAULT_SHARD_COUNT):
+        self.shard_count = max(1, shard_count)
+        self.per_index = FaissFileVectorStore()
+
+    def shard_for(self, index_name):
+        return f"shard_{index_number(index_name) % self.shard_count}"
+
+    # --- shard I/O ---
+
+    @contextmanager
+    def shard_write_lock(self, shard):
+        with _thread_locks_guard:
+            thread_lock = _thread_locks.setdefault(shard, threading.Lock())
+        with thread_lock:
+            if getattr(settings, "USE_GCS", False) or fcntl is None:
+                # GCS writes are guarded by if_generation_match instead (see _save_vector_store)
+                yield
+                return
+            lock_dir = settings.BASE_DIR / "faiss_data" / ".locks"
+            os.makedirs(lock_dir, exist_ok=True)
+            with open(lock_dir / f"{shard}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load_shard_for_update(self, shard):
+        """
+        Returns a writable (index or None, ChunkStore) for `shard`; None/empty if it doesn't exist yet.
+        Raises VectorStoreUnavailable if it exists but can't be read: saving an empty shard over it
+        would delete every other KB stored there.
+        """
+        index, store, error_message = vector_logic._load_vector_store(shard, for_update=True)
+        if error_message or index is None:
+            if vector_logic._find_store_files(shard) is not None:
+                raise vector_logic.VectorStoreUnavailable(f"{shard}: {error_message}")
+            store = ChunkStore()
+            store.version = (0, 0) # On GCS: only create the shard if nobody else has meanwhile
+            return None, store
+        return ensure_id_mapped(index), store
+
+    def save_shard(self, shard, index, store, changed_index_names=()):
+        """Saves a shard loaded by load_shard_for_update; `changed_index_names` are the KBs whose chunks were edited."""
+        keyword_index = self._shard_keyword_index(shard, store, changed_index_names)
+        vector_logic._save_vector_store(shard, index, store, expected_version=store.version, keyword_index=keyword_index)
+
+    def _shard_keyword_index(self, shard, store, changed_index_names):
+        """
+        Builds the shard's BM25 index one KB at a time. KBs that weren't changed reuse their part
+        of the saved .bm25 (if its ids still match), so a single-KB update only re-tokenizes that
+        KB's chunks. Each part keeps its own BM25 statistics, which is what per-KB searches want.
+        """
+        try:
+            previous = vector_logic._read_keyword_file(shard)
+        except Exception as e:
+            print(f"Error loading keyword index for {shard}, rebuilding it: {e}")
+            previous = None
+        changed = {index_number(index_name) for index_name in changed_index_names}
+
+        ids = np.asarray(store.ids, dtype="int64")
+        order = np.argsort(ids, kind="stable")
+        numbers, starts = np.unique(ids[order] >> INDEX_ID_BITS, return_index=True)
+        parts = []
+        for number, begin, end in zip(numbers.tolist(), starts, np.append(starts[1:], len(order))):
+            positions = order[begin:end]
+            part = None
+            if previous is not None and number not in changed:
+                start = number << INDEX_ID_BITS
+                part = previous.select(start, start + (1 << INDEX_ID_BITS))
+                if not np.array_equal(part.ids, ids[positions]):
+                    part = None
+            if part is None:
+                part = KeywordIndex.build(ids[positions].tolist(), [store.texts[pos] for pos in positions])
+            parts.append(part)
+        return KeywordIndex.concat(parts)
+
+    def _in_shard(self, store, index_name):
+        return store is not None and store.count_ids_in_range(*index_id_range(index_name)) > 0
+
+    def _has_per_index_store(self, index_name):
+        return vector_logic._find_store_files(index_name) is not None
+
+    # --- editing a loaded shard (caller holds the shard lock) ---
+
+    def remove_index_vectors(self, index, store, index_name):
+        start, stop = index_id_range(index_name)
+        ids = [chunk_id for chunk_id in store.ids if start <= chunk_id < stop]
+        if ids and index is not None:
+            index = remove_vectors(index, ids)
+            store.remove(ids)
+        return index, store, len(ids)
+
+    def _add(self, index, store, embeddings, ids, texts, shard_doc_key, pages):
+        started = time.perf_counter()
+        if index is None:
+            index, _ = build_index(embeddings, choose_index_type(len(ids)), ids=ids)
+        else:
+            add_vectors(index, embeddings, ids)
+        store.add(ids, texts, shard_doc_key, pages=pages)
+        metrics.record_ingestion_stage(metrics.STAGE_INDEX_BUILD, time.perf_counter() - started)
+        return index
+
+    def migrate_index(self, index, store, index_name):
+        """
+        Moves a per-KB store into the loaded shard (vectors are copied, not re-encoded).
+        Returns (index, store, vectors moved); the caller saves the shard and then deletes the source.
+        """
+        source_index, source_store, error_message = vector_logic._load_vector_store(index_name, for_update=True)
+        if error_message or source_index is None:
+            if self._has_per_index_store(index_name):
+                # The caller deletes the source after this, so it must not be skipped
+                raise vector_logic.VectorStoreUnavailable(f"{index_name}: {error_message}")
+            return index, store, 0
+        index, store, _ = self.remove_index_vectors(index, store, index_name)
+
+        source_ids, vectors = reconstruct_all(ensure_id_mapped(source_index))
+        if len(source_ids) == 0:
+            return index, store, 0
+        start, _ = index_id_range(index_name)
+        positions = {chunk_id: pos for pos, chunk_id in enumerate(source_store.ids)}
+        by_doc = {}
+        for row, source_id in enumerate(source_ids.tolist()):
+            pos = positions.get(source_id)
+            if pos is not None:
+                by_doc.setdefault(source_store.doc_keys[pos], []).append((row, source_id, pos))
+        for doc_key, rows in by_doc.items():
+            index = self._add(
+                index, store,
+                vectors[[row for row, _, _ in rows]],
+                [start + source_id for _, source_id, _ in rows],
+                [source_store.texts[pos] for _, _, pos in rows],
+                _shard_doc_key(index_name, doc_key),
+                [source_store.pages[pos] for _, _, pos in rows],
+            )
+        return index, store, len(source_ids)
+
+    def _migrate_if_needed(self, index_name):
+        """Moves a KB that still has its own store into its shard, so updates apply to one place."""
+        if not self._has_per_index_store(index_name):
+            return
+        shard = self.shard_for(index_name)
+        with self.shard_write_lock(shard):
+            index, store = self.load_shard_for_update(shard)
+            index, store, moved = self.migrate_index(index, store, index_name)
+            if moved:
+                self.save_shard(shard, index, store, [index_name])
+        self.per_index.delete(index_name)
+        print(f"Moved {moved} vectors of {index_name} into {shard}.")
+
+    # --- VectorStore API ---
+
+    def build(self, index_name, chunks, model, progress_callback=None, index_type=None, doc_key=DEFAULT_DOC_KEY, quantization=None):
+        # index_type / quantization are per shard (from settings), not per KB
+        if isinstance(chunks, str) or not hasattr(chunks, "__iter__"):
+            print("Error: 'chunks' must be a list of strings")
+            return
+        # Encode before taking the shard lock: other KBs in the shard can be written meanwhile
+        texts, pages, embeddings = vector_logic._encode_chunks(chunks, model, progress_callback)
+        if not texts:
+            print("Warning: Chunks list is empty. No embeddings will be created.")
+            return
+
+        shard = self.shard_for(index_name)
+        start, _ = index_id_range(index_name)
+        with self.shard_write_lock(shard):
+            index, store = self.load_shard_for_update(shard)
+            index, store, _ = self.remove_index_vectors(index, store, index_name)
+            ids = list(range(start, start + len(texts)))
+            index = self._add(index, store, embeddings, ids, texts, _shard_doc_key(index_name, doc_key), pages)
+            self.save_shard(shard, index, store, [index_name])
+        if self._has_per_index_store(index_name):
+            self.per_index.delete(index_name) # Superseded by the shard copy
+        print(f"{index_name}: {len(texts)} vectors stored in {shard} ({index.ntotal} vectors in the shard).")
+        return {"vectors": len(texts), "index_type": get_index_type(index)}
+
+    def upsert_document(self, index_name, doc_key, chunks, model, progress_callback=None):
+        chunks = list(chunks)
+        if not all(vector_logic._is_chunk(c) for c in chunks):
+            print("Error: 'chunks' must be a list of strings")
+            return
+        if not chunks:
+            print("Warning: Chunks list is empty. Use remove_documents() to drop a document.")
+            return
+
+        self._migrate_if_needed(index_name)
+        shard = self.shard_for(index_name)
+        shard_doc_key = _shard_doc_key(index_name, doc_key)
+        _, snapshot, error_message = vector_logic._load_vector_store(shard)
+        if error_message and vector_logic._find_store_files(shard) is not None:
+            # build() would replace the KB's other documents with this one
+            raise vector_logic.VectorStoreUnavailable(f"{shard}: {error_message}")
+        if error_message or not self._in_shard(snapshot, index_name):
+            result = self.build(index_name, chunks, model, progress_callback=progress_callback, doc_key=doc_key)
+            if result:
+                result.update({"added": result["vectors"], "removed": 0, "unchanged": 0})
+            return result
+
+        # Encode what the current shard doesn't have yet outside the lock, keyed by content hash
+        encoded = {}
+        new_chunks, _, _ = vector_logic._diff_document(snapshot, shard_doc_key, chunks)
+        self._encode_into(encoded, new_chunks, model, progress_callback)
+
+        start, stop = index_id_range(index_name)
+        with self.shard_write_lock(shard):
+            index, store = self.load_shard_for_update(shard)
+            new_chunks, stale_ids, unchanged = vector_logic._diff_document(store, shard_doc_key, chunks)
+            # Only needed if the document changed again between the snapshot and the lock
+            self._encode_into(encoded, new_chunks, model, None)
+
+            if stale_ids:
+                index = remove_vectors(index, stale_ids)
+                store.remove(stale_ids)
+            if new_chunks:
+                next_id = max([chunk_id + 1 for chunk_id in store.ids if start <= chunk_id < stop], default=start)
+                rows = [encoded[hash_chunk(vector_logic._split_chunk(chunk)[0])] for chunk in new_chunks]
+                index = self._add(
+                    index, store,
+                    np.vstack([vector for _, _, vector in rows]),
+                    list(range(next_id, next_id + len(rows))),
+                    [text for text, _, _ in rows],
+                    shard_doc_key,
+                    [page for _, page, _ in rows],
+                )
+            if new_chunks or stale_ids:
+                self.save_shard(shard, index, store, [index_name])
+            vectors = store.count_ids_in_range(start, stop)
+
+        print(f"Updated '{doc_key}' in {index_name} ({shard}): {len(new_chunks)} added, {len(stale_ids)} removed, {unchanged} unchanged.")
+        return {
+            "vectors": vectors,
+            "index_type": get_index_type(index),
+            "added": len(new_chunks),
+            "removed": len(stale_ids),
+            "unchanged": unchanged,
+        }
+
+    def _encode_into(self, encoded, chunks, model, progress_callback):
+        chunks = [c for c in chunks if hash_chunk(vector_logic._split_chunk(c)[0]) not in encoded]
+        if not chunks:
+            return
+        texts, pages, embeddings = vector_logic._encode_chunks(chunks, model, progress_callback)
+        for text, page, vector in zip(texts, pages, embeddings):
+            encoded[hash_chunk(text)] = (text, page, vector)
+
+    def remove_documents(self, index_name, doc_keys):
+        self._migrate_if_needed(index_name)
+        shard = self.shard_for(index_name)
+        with self.shard_write_lock(shard):
+            index, store = self.load_shard_for_update(shard)
+            stale_ids = store.ids_for_documents([_shard_doc_key(index_name, doc_key) for doc_key in doc_keys])
+            if not stale_ids:
+                return 0
+            index = remove_vectors(index, stale_ids)
+            store.remove(stale_ids)
+            self.save_shard(shard, index, store, [index_name])
+        print(f"Removed {len(stale_ids)} chunks of {list(doc_keys)} from {index_name} ({shard}).")
+        return len(stale_ids)
+
+    def list_documents(self, index_name):
+        _, store, error_message = vector_logic._load_vector_store(self.shard_for(index_name))
+        if error_message or not self._in_shard(store, index_name):
+            return self.per_index.list_documents(index_name)
+        prefix = _shard_doc_key(index_name, "")
+        return [key[len(prefix):] for key in store.document_keys() if key.startswith(prefix)]
+
+    def search_scored(self, query, index_name, model, top_k=1, mode=MODE_DENSE, min_similarity=None):
+        shard = self.shard_for(index_name)
+        load_started = time.perf_counter()
+        index, store, error_message = vector_logic._load_vector_store(shard)
+        if error_message or not self._in_shard(store, index_name):
+            # Not moved into its shard yet; the per-index search observes its own index_load
+            return self.per_index.search_scored(query, index_name, model, top_k=top_k, mode=mode, min_similarity=min_similarity)
+        metrics.observe_chat_stage(metrics.STAGE_INDEX_LOAD, time.perf_counter() - load_started)
+
+        start, stop = index_id_range(index_name)
+        index_vectors = store.count_ids_in_range(start, stop)
+        id_selector = faiss.IDSelectorRange(start, stop)
+        params = get_filtered_search_params(index, id_selector, selectivity=index_vectors / max(index.ntotal, 1))
+        # The shard's keyword index is filtered to the same id range as the vectors
+        ranked = vector_logic._rank_chunks(
+            query, shard, index, store, model, top_k, mode=mode, params=params, id_range=(start, stop), available=index_vectors,
+            min_similarity=vector_logic.get_min_similarity(min_similarity),
+        )
+        return vector_logic._scored_chunks(store, ranked, doc_key_prefix=_shard_doc_key(index_name, "")), None
+
+    def delete(self, index_name):
+        shard = self.shard_for(index_name)
+        with self.shard_write_lock(shard):
+            index, store = self.load_shard_for_update(shard)
+            index, store, removed = self.remove_index_vectors(index, store, index_name)
+            if removed:
+                self.save_shard(shard, index, store, [index_name])
+                print(f"Deleted {removed} vectors of {index_name} from {shard}")
+        if self._has_per_index_store(index_name):
+            self.per_index.delete(index_name)
+
+    def stats(self, index_name=None):
+        stats = {"backend": self.name, "shard_count": self.shard_count}
+        if index_name is None:
+            return stats
+        shard = self.shard_for(index_name)
+        index, store, error_message = vector_logic._load_vector_store(shard)
+        if error_message or not self._in_shard(store, index_name):
+            stats.update(self.per_index.stats(index_name))
+            stats["backend"] = self.name
+            stats["shard"] = None
+            return stats
+        stats.update({
+            "shard": shard,
+            "shard_vectors": int(index.ntotal),
+            "vectors": store.count_ids_in_range(*index_id_range(index_name)),
+            "index_type": get_index_type(index),
+            "quantization": get_quantization(index),
+            "metric": get_metric(index),
+            "documents": self.list_documents(index_name),
+        })
+        return stats
@@ -5,204 +5,705 @@ import pickle
 import numpy as np
 import os
 import tempfile
+import time
+from typing import NamedTuple, Optional
 from django.conf import settings
-from google.cloud import storage
 
-# --- GCS Helper Functions ---
+from core.utils import metrics
+from core.utils.vector.blob_storage import BlobPreconditionFailed, get_blob_storage, run_concurrently
+from core.utils.vector.disk_cache import get_disk_cache
+from core.utils.vector.index_cache import get_index_cache, estimate_entry_bytes
+from core.utils.vector.index_factory import (
+    add_vectors, build_index, ensure_id_mapped, get_index_type, get_quantization, get_search_params, lookup_similarities,
+    prepare_query, remove_vectors, similarity_scores,
+)
+from core.utils.vector.chunk_store import DEFAULT_DOC_KEY, ChunkStore, MappedChunkStore, hash_chunk, write_chunk_file
+from core.utils.vector.keyword_index import (
+    DEFAULT_RRF_K, MODE_DENSE, MODE_HYBRID, MODE_KEYWORD, KeywordIndex, reciprocal_rank_fusion,
+)
+
+# Map index data instead of copying it onto the heap. IO_FLAG_MMAP_IFC (faiss >= 1.10) maps flat/HNSW
+# codes as well as IVF lists; older faiss only has IO_FLAG_MMAP, which maps IVF lists. They can't be combined.
+FAISS_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
 
-def _get_gcs_client():
-    project_id = getattr(settings, "GS_PROJECT_ID", None)
-    # If project_id is "None" string (from default config), treat as None
-    return storage.Client(project=project_id if project_id and project_id != "None" else None)
+# --- Path Helper (Crucial for consistency) ---
+CHUNKS_EXT = ".chunks"
+LEGACY_CHUNKS_EXT = ".pkl" # Pickled list/dict chunk stores written before the .chunks format
+KEYWORD_EXT = ".bm25" # BM25 keyword index over the same chunks (see keyword_index.py)
+DEFAULT_HYBRID_CANDIDATES = 20
+DEFAULT_MIN_SIMILARITY = 0.2
+NO_RESULTS_MESSAGE = "No relevant results found."
 
-def _upload_blob(bucket_name, source_file_name, destination_blob_name):
-    client = _get_gcs_client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
-    try:
-        blob.upload_from_filename(source_file_name)
-        print(f"Uploaded {source_file_name} to gs://{bucket_name}/{destination_blob_name}")
-    except Exception as e:
-        print(f"GCS upload failed for {destination_blob_name}: {e}")
-        raise
 
-def _download_blob(bucket_name, source_blob_name, destination_file_name):
-    client = _get_gcs_client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(source_blob_name)
-    try:
-        blob.download_to_filename(destination_file_name)
-        print(f"Downloaded gs://{bucket_name}/{source_blob_name} to {destination_file_name}")
-    except Exception as e:
-        print(f"GCS download failed for {source_blob_name}: {e}")
-        raise
+class VectorStoreUnavailable(Exception):
+    """A stored index exists but couldn't be read (storage error, corrupt file); it must not be rebuilt over."""
 
-# --- Path Helper (Crucial for consistency) ---
-def _get_vector_store_paths(index_name: str, use_gcs: bool):
+
+class ScoredChunk(NamedTuple):
+    """One search result."""
+    text: str
+    score: float                # Ranking score of the retrieval mode: cosine similarity (dense), BM25 (keyword) or RRF (hybrid)
+    similarity: Optional[float] # Cosine similarity to the query; None when it wasn't computed (keyword mode)
+    chunk_id: int
+    doc_key: Optional[str] = None
+    page_number: Optional[int] = None
+
+def _get_vector_store_paths(index_name: str, use_gcs: bool, chunks_ext: str = CHUNKS_EXT):
     """
-    Generates the expected file paths/keys for FAISS index and pickle files.
+    Generates the expected file paths/keys for the FAISS index and chunk files.
     Ensures consistency across save, load, and delete operations.
     """
     faiss_file_name = f"{index_name}.faiss"
-    pkl_file_name = f"{index_name}.pkl"
+    chunks_file_name = f"{index_name}{chunks_ext}"
 
     if use_gcs:
         # GCS keys include index_name as a subdirectory
         # Use settings.GS_FAISS_PREFIX for the top-level folder in GCS
         gcs_base_prefix = getattr(settings, "GS_FAISS_PREFIX", "faiss_indices/")
         faiss_key = f"{gcs_base_prefix}{index_name}/{faiss_file_name}"
-        pkl_key = f"{gcs_base_prefix}{index_name}/{pkl_file_name}"
-        return faiss_key, pkl_key
+        chunks_key = f"{gcs_base_prefix}{index_name}/{chunks_file_name}"
+        return faiss_key, chunks_key
     else:
         # Local paths relative to BASE_DIR and into 'faiss_data' directory
         local_base_dir = settings.BASE_DIR / "faiss_data"
         subdir = local_base_dir / index_name
-        return subdir / faiss_file_name, subdir / pkl_file_name
+        return subdir / faiss_file_name, subdir / chunks_file_name
+
+def _write_store_files(index, store, faiss_file_path, chunks_file_path, keyword_file_path, keyword_index=None):
+    if keyword_index is None:
+        keyword_index = KeywordIndex.build(store.ids, store.texts)
+    # Write to a temp name and rename over the old file: other processes may have the old
+    # files mmapped, and truncating a mapped file in place would crash them on the next read.
+    for path, write in (
+        (faiss_file_path, lambda tmp: faiss.write_index(index, tmp)),
+        (chunks_file_path, lambda tmp: write_chunk_file(tmp, store)),
+        (keyword_file_path, keyword_index.save),
+    ):
+        tmp_path = f"{path}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, str(path))
+
+# --- _save_vector_store (shared by full builds and incremental updates) ---
+def _save_vector_store(index_name, index, store, expected_version=None, keyword_index=None):
+    """
+    Writes the FAISS index, its chunk file and the BM25 keyword index to GCS or local disk and
+    drops the cached copies. The keyword index is built from all of `store`'s chunks unless the
+    caller passes one (the shards reuse the parts of KBs that didn't change).
+
+    On GCS, `expected_version` (the version the store was read at, see ChunkStore.version) makes
+    the .faiss upload conditional on its generation, so an update racing another writer fails
+    with BlobPreconditionFailed instead of overwriting it. Without one, all files upload concurrently.
+    Locally the version is re-checked before writing (writers that must not interleave, like the
+    shards' writers, also hold a file lock around read + write). (0, 0) means "must not exist yet".
+    """
+    use_gcs = getattr(settings, "USE_GCS", False)
+    faiss_path, chunks_path = _get_vector_store_paths(index_name, use_gcs)
+    _, legacy_chunks_path = _get_vector_store_paths(index_name, use_gcs, LEGACY_CHUNKS_EXT)
+    _, keyword_path = _get_vector_store_paths(index_name, use_gcs, KEYWORD_EXT)
+    started = time.perf_counter()
+
+    if use_gcs:
+        storage = get_blob_storage()
+
+        # Use temporary files for GCS upload/download
+        with tempfile.TemporaryDirectory() as tmpdir:
+            local_faiss_temp = os.path.join(tmpdir, f"{index_name}.faiss")
+            local_chunks_temp = os.path.join(tmpdir, f"{index_name}{CHUNKS_EXT}")
+            local_keyword_temp = os.path.join(tmpdir, f"{index_name}{KEYWORD_EXT}")
+            _write_store_files(index, store, local_faiss_temp, local_chunks_temp, local_keyword_temp, keyword_index)
+
+            if expected_version is None:
+                generations = run_concurrently(
+                    lambda: storage.upload(local_faiss_temp, str(faiss_path)),
+                    lambda: storage.upload(local_chunks_temp, str(chunks_path)),
+                    lambda: storage.upload(local_keyword_temp, str(keyword_path)),
+                )
+            else:
+                # The .faiss generation guards the set: only the writer that wins it goes on to write the rest
+                generations = [storage.upload(local_faiss_temp, str(faiss_path), if_generation_match=expected_version[0])]
+                generations += run_concurrently(
+                    lambda: storage.upload(local_chunks_temp, str(chunks_path)),
+                    lambda: storage.upload(local_keyword_temp, str(keyword_path)),
+                )
+            print(f"FAISS index and chunks saved to GCS: {storage.describe(faiss_path)}, {storage.describe(chunks_path)}")
+
+            disk_cache = get_disk_cache()
+            if disk_cache is not None:
+                local_paths = (local_faiss_temp, local_chunks_temp, local_keyword_temp)
+                for local_path, key, generation in zip(local_paths, (faiss_path, chunks_path, keyword_path), generations):
+                    disk_cache.put(str(key), generation, local_path)
+
+        storage.delete(str(legacy_chunks_path))
+    else:
+        if expected_version is not None:
+            current_version = _get_store_version(index_name)
+            if current_version != expected_version and not (current_version is None and not any(expected_version)):
+                raise BlobPreconditionFailed(f"{index_name} was changed by another writer since it was read")
+        # Local paths are PurePath objects, convert to string for os.makedirs, open, faiss.write_index
+        os.makedirs(faiss_path.parent, exist_ok=True)
+        _write_store_files(index, store, faiss_path, chunks_path, keyword_path, keyword_index)
+        if legacy_chunks_path.exists():
+            os.remove(str(legacy_chunks_path))
+        print(f"FAISS index and chunks saved locally at {faiss_path.parent}/")
+    metrics.record_ingestion_stage(metrics.STAGE_STORE_WRITE, time.perf_counter() - started)
+
+    # Drop any stale copy held by this process; other workers notice via the version check
+    get_index_cache().invalidate(index_name)
+    get_index_cache().invalidate(f"{index_name}{KEYWORD_EXT}")
+
+
+def _iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _split_chunk(chunk):
+    # Chunks are plain strings or text_chunker.Chunk tuples carrying the page they start on
+    if isinstance(chunk, str):
+        return chunk, None
+    return chunk.text, chunk.page_number
+
+def _is_chunk(chunk):
+    return isinstance(chunk, str) or isinstance(getattr(chunk, "text", None), str)
+
+def _encode_chunks(chunks, model, progress_callback=None):
+    """
+    Encodes an iterable of chunks (strings or Chunk tuples) one batch at a time.
+    Returns (texts, pages, float32 embeddings), or (None, None, None) if the input isn't chunks.
+    """
+    batch_size = getattr(settings, "EMBEDDING_BATCH_SIZE", 64)
+    total = len(chunks) if hasattr(chunks, "__len__") else None
+    texts = []
+    pages = []
+    batches = []
+    encode_seconds = 0.0 # Model time only; pulling `chunks` (extraction, chunking) is timed by whoever produces them
+    for batch in _iter_batches(chunks, batch_size):
+        if not all(_is_chunk(c) for c in batch):
+            print("Error: 'chunks' must be a list of strings")
+            return None, None, None
+        batch_texts, batch_pages = zip(*(_split_chunk(c) for c in batch))
+        started = time.perf_counter()
+        batches.append(np.array(model.encode(list(batch_texts), batch_size=batch_size, show_progress_bar=False)).astype("float32"))
+        encode_seconds += time.perf_counter() - started
+        texts.extend(batch_texts)
+        pages.extend(batch_pages)
+        if progress_callback:
+            progress_callback(len(texts), total)
+    metrics.record_ingestion_stage(metrics.STAGE_ENCODE, encode_seconds)
+    metrics.INGESTED_CHUNKS.inc(len(texts))
+    embeddings = np.vstack(batches) if batches else np.zeros((0, 0), dtype="float32")
+    return texts, pages, embeddings
+
 
 # --- embed_and_store (Modified to use _get_vector_store_paths) ---
-def embed_and_store(chunks, index_name, model):
-    if not isinstance(chunks, list) or not all(isinstance(c, str) for c in chunks):
+def embed_and_store(chunks, index_name, model, progress_callback=None, index_type=None, doc_key=DEFAULT_DOC_KEY, quantization=None):
+    """
+    Encodes `chunks` and writes the FAISS index + chunk texts for `index_name`, replacing any existing store.
+
+    `chunks` may be a list or any iterable of strings or text_chunker.Chunk tuples (e.g. a generator
+    streaming out of the chunker; a Chunk's page number is kept with its text);
+    it is consumed one batch at a time. progress_callback(done, total) is called after each batch,
+    with total=None when the input has no length. `index_type` forces "flat"/"hnsw"/"ivfpq";
+    by default it is chosen from the number of chunks. `quantization` ("none"/"fp16"/"sq8"/"pq",
+    default settings.VECTOR_QUANTIZATION) sets how the vectors are stored; later updates keep it.
+    All chunks are recorded under `doc_key` so the document can later be updated with upsert_document().
+
+    Returns:
+        dict: {"vectors": number of vectors stored, "index_type": index type used, "quantization": vector storage used}
+    """
+    if isinstance(chunks, str) or not hasattr(chunks, "__iter__"):
         print("Error: 'chunks' must be a list of strings")
         return
 
+    # Encode in batches so long documents can report progress and stream from the chunker
+    texts, pages, embeddings = _encode_chunks(chunks, model, progress_callback)
+    if texts is None:
+        return
+
     # Ensure chunks are not empty to avoid issues with model.encode
-    if not chunks:
+    if not texts:
         print("Warning: Chunks list is empty. No embeddings will be created.")
         return
 
-    embeddings = np.array(model.encode(chunks)).astype("float32")
-
     if embeddings.shape[0] == 0:
         print("Warning: No embeddings created from chunks after encoding.")
         return
 
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
-    print(f"FAISS index created for {index_name} with {index.ntotal} vectors.")
+    # Flat for small KBs, HNSW / IVF-PQ above the size thresholds (see index_factory.py)
+    started = time.perf_counter()
+    index, index_type = build_index(embeddings, index_type, quantization=quantization)
+    metrics.record_ingestion_stage(metrics.STAGE_INDEX_BUILD, time.perf_counter() - started)
+    del embeddings
+    quantization = get_quantization(index)
+    print(f"FAISS {index_type} index ({quantization}) created for {index_name} with {index.ntotal} vectors.")
 
-    use_gcs = getattr(settings, "USE_GCS", False)
-    faiss_path, pkl_path = _get_vector_store_paths(index_name, use_gcs)
+    store = ChunkStore()
+    store.add(range(len(texts)), texts, doc_key, pages=pages)
+    _save_vector_store(index_name, index, store)
+    return {"vectors": index.ntotal, "index_type": index_type, "quantization": quantization}
 
-    if use_gcs:
-        bucket_name = getattr(settings, "GS_BUCKET_NAME", None)
-        if not bucket_name:
-            raise ValueError("GS_BUCKET_NAME must be set in settings for GCS operations.")
 
-        # Use temporary files for GCS upload/download
-        with tempfile.TemporaryDirectory() as tmpdir:
-            local_faiss_temp = os.path.join(tmpdir, f"{index_name}.faiss")
-            local_pkl_temp = os.path.join(tmpdir, f"{index_name}.pkl")
+# --- Incremental updates (add/replace/remove documents without re-embedding the rest) ---
+def _diff_document(store, doc_key, chunks):
+    """
+    Compares a document's new chunks with what `store` holds for it, by content hash.
+    Returns (chunks that need encoding, ids of chunks that disappeared, number unchanged).
+    """
+    existing = store.document_chunks(doc_key) # {hash: [ids]}
+    new_chunks = []
+    unchanged = 0
+    for chunk in chunks:
+        chunk_hash = hash_chunk(_split_chunk(chunk)[0])
+        if existing.get(chunk_hash):
+            existing[chunk_hash].pop() # Reuse this vector; duplicates are matched one for one
+            unchanged += 1
+        else:
+            new_chunks.append(chunk)
+    stale_ids = [chunk_id for ids in existing.values() for chunk_id in ids]
+    return new_chunks, stale_ids, unchanged
+
+def upsert_document(index_name, doc_key, chunks, model, progress_callback=None):
+    """
+    Adds a document to an existing store, or updates it if `doc_key` is already there.
+
+    Chunks whose content hash already exists for this document keep their vectors; only new or
+    changed chunks are encoded, and chunks that disappeared are removed. Falls back to a full
+    embed_and_store() if the store doesn't exist yet.
 
-            faiss.write_index(index, local_faiss_temp)
-            with open(local_pkl_temp, "wb") as f:
-                pickle.dump(chunks, f)
+    Returns:
+        dict: {"vectors", "index_type", "added", "removed", "unchanged"}
 
-            _upload_blob(bucket_name, local_faiss_temp, str(faiss_path))
-            _upload_blob(bucket_name, local_pkl_temp, str(pkl_path))
-            print(f"FAISS index and chunks saved to GCS: {faiss_path}, {pkl_path}")
+    Raises:
+        VectorStoreUnavailable: The store exists but couldn't be loaded.
+    """
+    index, store, error_message = _load_vector_store(index_name, for_update=True)
+    if error_message or index is None:
+        if _find_store_files(index_name) is not None:
+            # Rebuilding from this one document would drop every other document in the store
+            raise VectorStoreUnavailable(f"{index_name}: {error_message}")
+        result = embed_and_store(chunks, index_name, model, progress_callback=progress_callback, doc_key=doc_key)
+        if result:
+            result.update({"added": result["vectors"], "removed": 0, "unchanged": 0})
+        return result
+
+    chunks = list(chunks)
+    if not all(_is_chunk(c) for c in chunks):
+        print("Error: 'chunks' must be a list of strings")
+        return
+    if not chunks:
+        print("Warning: Chunks list is empty. Use remove_documents() to drop a document.")
+        return
+
+    new_chunks, stale_ids, unchanged = _diff_document(store, doc_key, chunks)
+
+    # for_update loaded private, writable copies, so request threads searching the cached index are unaffected
+    index = ensure_id_mapped(index)
+    index_type = get_index_type(index)
+
+    started = time.perf_counter()
+    if stale_ids:
+        index = remove_vectors(index, stale_ids)
+        store.remove(stale_ids)
+    index_seconds = time.perf_counter() - started
+
+    if new_chunks:
+        texts, pages, embeddings = _encode_chunks(new_chunks, model, progress_callback)
+        if texts is None:
+            return
+        started = time.perf_counter()
+        new_ids = list(range(store.next_id(), store.next_id() + len(texts)))
+        add_vectors(index, embeddings, new_ids)
+        store.add(new_ids, texts, doc_key, pages=pages)
+        index_seconds += time.perf_counter() - started
+    metrics.record_ingestion_stage(metrics.STAGE_INDEX_BUILD, index_seconds)
+
+    if new_chunks or stale_ids:
+        _save_vector_store(index_name, index, store, expected_version=store.version)
+    print(f"Updated '{doc_key}' in {index_name}: {len(new_chunks)} added, {len(stale_ids)} removed, {unchanged} unchanged.")
+    return {
+        "vectors": index.ntotal,
+        "index_type": index_type,
+        "added": len(new_chunks),
+        "removed": len(stale_ids),
+        "unchanged": unchanged,
+    }
+
+
+def list_documents(index_name):
+    """Returns the document keys currently stored in `index_name` (empty if it doesn't exist)."""
+    index, store, error_message = _load_vector_store(index_name)
+    if error_message or store is None:
+        return []
+    return store.document_keys()
+
+
+def remove_documents(index_name, doc_keys):
+    """Removes every chunk of the given documents from the store. Returns the number of vectors removed."""
+    index, store, error_message = _load_vector_store(index_name, for_update=True)
+    if error_message or index is None:
+        return 0
+
+    stale_ids = store.ids_for_documents(doc_keys)
+    if not stale_ids:
+        return 0
+
+    index = ensure_id_mapped(index)
+    index = remove_vectors(index, stale_ids)
+    store.remove(stale_ids)
+    _save_vector_store(index_name, index, store, expected_version=store.version)
+    print(f"Removed {len(stale_ids)} chunks of {list(doc_keys)} from {index_name}.")
+    return len(stale_ids)
+
+
+# --- Storage version helpers (used to validate cached indexes) ---
+def _get_local_version(faiss_file_path, chunks_file_path):
+    faiss_stat = os.stat(str(faiss_file_path))
+    chunks_stat = os.stat(str(chunks_file_path))
+    return (faiss_stat.st_mtime_ns, faiss_stat.st_size, chunks_stat.st_mtime_ns, chunks_stat.st_size)
+
+def _find_store_files(index_name):
+    """
+    Returns (faiss path/key, chunks path/key, version) for the stored index, or None if it
+    doesn't exist. Falls back to a legacy .pkl chunk file when there is no .chunks file yet.
+    """
+    use_gcs = getattr(settings, "USE_GCS", False)
+    faiss_file_path, chunks_file_path = _get_vector_store_paths(index_name, use_gcs)
+    _, legacy_chunks_path = _get_vector_store_paths(index_name, use_gcs, LEGACY_CHUNKS_EXT)
+
+    if use_gcs:
+        storage = get_blob_storage()
+        faiss_generation, chunks_generation = run_concurrently(
+            lambda: storage.get_generation(str(faiss_file_path)),
+            lambda: storage.get_generation(str(chunks_file_path)),
+        )
+        if chunks_generation is None:
+            chunks_file_path = legacy_chunks_path
+            chunks_generation = storage.get_generation(str(legacy_chunks_path))
+        if faiss_generation is None or chunks_generation is None:
+            return None
+        return str(faiss_file_path), str(chunks_file_path), (faiss_generation, chunks_generation)
+
+    if not chunks_file_path.exists():
+        chunks_file_path = legacy_chunks_path
+    if not faiss_file_path.exists() or not chunks_file_path.exists():
+        return None
+    return faiss_file_path, chunks_file_path, _get_local_version(faiss_file_path, chunks_file_path)
+
+def _get_store_version(index_name):
+    """Returns an opaque version tuple for the stored index, or None if it doesn't exist."""
+    store_files = _find_store_files(index_name)
+    return store_files[2] if store_files else None
+
+def _read_store_files(faiss_file_path, chunks_file_path, for_update):
+    """
+    Reads an index and its chunks. Searches get mmapped, read-only views (FAISS codes via
+    IO_FLAG_MMAP, chunk texts via MappedChunkStore) so opening a KB costs almost nothing and
+    processes share the page cache; updates get ordinary in-memory copies they can modify.
+    """
+    if for_update:
+        index = faiss.read_index(str(faiss_file_path))
     else:
-        # Local paths are PurePath objects, convert to string for os.makedirs, open, faiss.write_index
-        os.makedirs(faiss_path.parent, exist_ok=True)
+        index = faiss.read_index(str(faiss_file_path), FAISS_MMAP_FLAGS)
 
-        faiss.write_index(index, str(faiss_path))
-        with open(str(pkl_path), "wb") as f:
-            pickle.dump(chunks, f)
-        print(f"FAISS index and chunks saved locally at {faiss_path.parent}/")
+    if str(chunks_file_path).endswith(LEGACY_CHUNKS_EXT):
+        with open(str(chunks_file_path), "rb") as f:
+            return index, ChunkStore.from_pickled(pickle.load(f))
+    store = MappedChunkStore(str(chunks_file_path))
+    return index, store.to_chunk_store() if for_update else store
 
 
-# --- search_similar_chunks (Modified to use _get_vector_store_paths) ---
-def search_similar_chunks(query, index_name, model, top_k=1):
-    use_gcs = getattr(settings, "USE_GCS", False)
-    faiss_file_path, pkl_file_path = _get_vector_store_paths(index_name, use_gcs)
+# --- _load_vector_store (disk/GCS read, fronted by the per-process index cache) ---
+def _load_vector_store(index_name, for_update=False):
+    """
+    Returns (index, chunk store, error_message). On success error_message is None.
+
+    By default the store is served from the per-process cache (hot indexes need no storage I/O)
+    and is read-only. for_update=True bypasses the cache and returns a private, writable
+    index and ChunkStore for incremental updates.
+    """
+    cache = get_index_cache()
+    if not for_update:
+        cached = cache.get(index_name, lambda: _get_store_version(index_name))
+        if cached is not None:
+            index, store = cached
+            return index, store, None
 
-    index = None
-    texts = None
+    use_gcs = getattr(settings, "USE_GCS", False)
 
     if use_gcs:
-        bucket_name = getattr(settings, "GS_BUCKET_NAME", None)
-        if not bucket_name:
+        if not getattr(settings, "GS_BUCKET_NAME", None):
             print("Error: GS_BUCKET_NAME not set for GCS operations.")
-            return ["Error retrieving knowledge base."]
-        
-        with tempfile.TemporaryDirectory() as tmpdir:
-            local_faiss_temp = os.path.join(tmpdir, f"{index_name}.faiss")
-            local_pkl_temp = os.path.join(tmpdir, f"{index_name}.pkl")
-            
+            return None, None, "Error retrieving knowledge base."
+        storage = get_blob_storage()
+
+        store_files = _find_store_files(index_name)
+        if store_files is None:
+            print(f"Error downloading FAISS files from GCS: Blobs for {index_name} not found in bucket {storage.bucket_name}")
+            return None, None, "Knowledge base not found or error accessing cloud storage."
+        faiss_key, chunks_key, version = store_files
+
+        disk_cache = get_disk_cache()
+        if disk_cache is not None:
+            # Served from local disk when this machine already has these generations
             try:
-                _download_blob(bucket_name, str(faiss_file_path), local_faiss_temp)
-                _download_blob(bucket_name, str(pkl_file_path), local_pkl_temp)
+                local_faiss_path, local_chunks_path = run_concurrently(
+                    lambda: disk_cache.fetch(storage, faiss_key, version[0]),
+                    lambda: disk_cache.fetch(storage, chunks_key, version[1]),
+                )
             except Exception as e:
                 print(f"Error downloading FAISS files from GCS: {e}")
-                return ["Knowledge base not found or error accessing cloud storage."]
-
+                return None, None, "Knowledge base not found or error accessing cloud storage."
             try:
-                index = faiss.read_index(local_faiss_temp)
-                with open(local_pkl_temp, "rb") as f:
-                    texts = pickle.load(f)
+                index, store = _read_store_files(local_faiss_path, local_chunks_path, for_update)
             except Exception as e:
-                print(f"Error loading FAISS files from temporary paths: {e}")
-                return ["Error processing knowledge base data."]
+                print(f"Error loading FAISS files from the disk cache: {e}")
+                return None, None, "Error processing knowledge base data."
+        else:
+            # The temp files are deleted when this block exits. mmapped data stays readable after
+            # the unlink (the kernel keeps the inode until the mapping goes away).
+            with tempfile.TemporaryDirectory() as tmpdir:
+                try:
+                    local_faiss_temp = os.path.join(tmpdir, os.path.basename(faiss_key))
+                    local_chunks_temp = os.path.join(tmpdir, os.path.basename(chunks_key))
+                    run_concurrently(
+                        lambda: storage.download(faiss_key, local_faiss_temp, generation=version[0]),
+                        lambda: storage.download(chunks_key, local_chunks_temp, generation=version[1]),
+                    )
+                except Exception as e:
+                    print(f"Error downloading FAISS files from GCS: {e}")
+                    return None, None, "Knowledge base not found or error accessing cloud storage."
+
+                try:
+                    index, store = _read_store_files(local_faiss_temp, local_chunks_temp, for_update)
+                except Exception as e:
+                    print(f"Error loading FAISS files from temporary paths: {e}")
+                    return None, None, "Error processing knowledge base data."
     else:
-        if not faiss_file_path.exists() or not pkl_file_path.exists():
-            print(f"FAISS index or chunks not found locally at {faiss_file_path.parent}")
-            return ["Knowledge base not found or not embedded."]
-        
+        store_files = _find_store_files(index_name)
+        if store_files is None:
+            print(f"FAISS index or chunks not found locally for {index_name}")
+            return None, None, "Knowledge base not found or not embedded."
+
         try:
-            index = faiss.read_index(str(faiss_file_path))
-            with open(str(pkl_file_path), "rb") as f:
-                texts = pickle.load(f)
+            # The version is taken before reading so a concurrent rewrite shows up as stale next time
+            faiss_file_path, chunks_file_path, version = store_files
+            index, store = _read_store_files(faiss_file_path, chunks_file_path, for_update)
         except Exception as e:
             print(f"Error loading FAISS files from local paths: {e}")
-            return ["Error processing knowledge base data."]
+            return None, None, "Error processing knowledge base data."
+
+    # Updates pass it back to _save_vector_store; searches key the matching keyword index on it
+    store.version = version
+    if not for_update:
+        cache.put(index_name, version, (index, store), estimate_entry_bytes(index, store))
+    return index, store, None
+
+
+# --- Keyword (BM25) index, loaded next to the vector store ---
+def _read_keyword_file(index_name):
+    """Returns the saved KeywordIndex for `index_name`, or None if there is no .bm25 file."""
+    use_gcs = getattr(settings, "USE_GCS", False)
+    _, keyword_path = _get_vector_store_paths(index_name, use_gcs, KEYWORD_EXT)
+    if not use_gcs:
+        return KeywordIndex.load(str(keyword_path)) if keyword_path.exists() else None
+
+    storage = get_blob_storage()
+    generation = storage.get_generation(str(keyword_path))
+    if generation is None:
+        return None
+    disk_cache = get_disk_cache()
+    if disk_cache is not None:
+        return KeywordIndex.load(disk_cache.fetch(storage, str(keyword_path), generation))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        local_keyword_temp = os.path.join(tmpdir, os.path.basename(str(keyword_path)))
+        storage.download(str(keyword_path), local_keyword_temp, generation=generation)
+        return KeywordIndex.load(local_keyword_temp)
+
+def _load_keyword_index(index_name, store):
+    """
+    Returns the KeywordIndex for a store loaded by _load_vector_store, cached per process under
+    the same version as the store. A .bm25 file whose ids don't match the chunks (stores saved
+    before keyword search existed, or one caught mid-upload) is rebuilt from the chunk texts.
+    """
+    cache = get_index_cache()
+    cache_key = f"{index_name}{KEYWORD_EXT}"
+    keyword_index = cache.get(cache_key, lambda: _get_store_version(index_name))
+    if keyword_index is not None:
+        return keyword_index
+
+    try:
+        keyword_index = _read_keyword_file(index_name)
+    except Exception as e:
+        print(f"Error loading keyword index for {index_name}, rebuilding it: {e}")
+        keyword_index = None
+    if keyword_index is None or not np.array_equal(keyword_index.ids, np.sort(np.asarray(store.ids, dtype="int64"))):
+        chunk_store = store.to_chunk_store() if isinstance(store, MappedChunkStore) else store
+        keyword_index = KeywordIndex.build(chunk_store.ids, chunk_store.texts)
+
+    version = getattr(store, "version", None)
+    if version is not None:
+        cache.put(cache_key, version, keyword_index, keyword_index.nbytes)
+    return keyword_index
+
+def _rank_chunks(query, index_name, index, store, model, top_k, mode=MODE_DENSE, params=None, id_range=None, available=None, min_similarity=0.0):
+    """
+    Returns up to `top_k` (chunk id, score, similarity) for `query`, best first.
+
+    mode is "dense" (FAISS), "keyword" (BM25, no query embedding needed) or "hybrid": the top
+    HYBRID_CANDIDATES of each, merged with reciprocal-rank fusion. `params` and `id_range`
+    restrict both retrievers to one KB inside a shared index; `available` is how many vectors
+    that KB has (defaults to the whole index).
 
-    if index is None or texts is None or not texts:
-        return ["No data in knowledge base."]
+    Chunks whose cosine similarity to the query is below `min_similarity` are dropped. Hybrid
+    keyword-only hits get their similarity looked up from the index; keyword mode has none, so
+    nothing is dropped there.
+    """
+    if mode not in (MODE_DENSE, MODE_KEYWORD, MODE_HYBRID):
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    available = index.ntotal if available is None else available
+    n_candidates = top_k
+    if mode == MODE_HYBRID:
+        n_candidates = max(top_k, getattr(settings, "HYBRID_CANDIDATES", DEFAULT_HYBRID_CANDIDATES))
+
+    similarities = {}
+    dense_hits, keyword_hits = [], []
+    if mode in (MODE_DENSE, MODE_HYBRID):
+        query_vec = prepare_query(index, model.encode([query]))
+        with metrics.chat_stage(metrics.STAGE_VECTOR_SEARCH):
+            D, I = index.search(query_vec, min(n_candidates, available), params=params)
+        # I holds chunk ids (-1 for empty slots)
+        dense_hits = [(int(i), float(s)) for i, s in zip(I[0], similarity_scores(index, D[0])) if i >= 0]
+        similarities.update(dense_hits)
+    if mode in (MODE_KEYWORD, MODE_HYBRID):
+        with metrics.chat_stage(metrics.STAGE_KEYWORD_SEARCH):
+            keyword_index = _load_keyword_index(index_name, store)
+            keyword_hits = keyword_index.search(query, n_candidates, id_range=id_range)
+
+    if mode == MODE_DENSE:
+        ranked = dense_hits
+    elif mode == MODE_KEYWORD:
+        ranked = keyword_hits
+    else:
+        ranked = reciprocal_rank_fusion(
+            [[chunk_id for chunk_id, _ in dense_hits], [chunk_id for chunk_id, _ in keyword_hits]],
+            k=getattr(settings, "HYBRID_RRF_K", DEFAULT_RRF_K),
+        )
+        if min_similarity:
+            similarities.update(lookup_similarities(index, query_vec, [i for i, _ in ranked if i not in similarities]))
+
+    results = []
+    for chunk_id, score in ranked:
+        similarity = similarities.get(chunk_id)
+        if similarity is not None and similarity < min_similarity:
+            continue
+        results.append((chunk_id, score, similarity))
+        if len(results) == top_k:
+            break
+    return results
+
+
+def _scored_chunks(store, ranked, doc_key_prefix=""):
+    """ScoredChunks for _rank_chunks results, skipping ids the store no longer has."""
+    results = []
+    for chunk_id, score, similarity in ranked:
+        text = store.get_text(chunk_id)
+        if text is None:
+            continue
+        doc_key = store.get_doc_key(chunk_id)
+        if doc_key is not None and doc_key_prefix and doc_key.startswith(doc_key_prefix):
+            doc_key = doc_key[len(doc_key_prefix):]
+        results.append(ScoredChunk(text, score, similarity, chunk_id, doc_key, store.get_page(chunk_id)))
+    return results
+
+
+def get_min_similarity(min_similarity=None):
+    """`min_similarity` if given, else settings.RETRIEVAL_MIN_SIMILARITY (0 keeps everything)."""
+    if min_similarity is None:
+        min_similarity = getattr(settings, "RETRIEVAL_MIN_SIMILARITY", DEFAULT_MIN_SIMILARITY)
+    return float(min_similarity or 0.0)
+
+
+def search_scored_chunks(query, index_name, model, top_k=1, nprobe=None, ef_search=None, mode=MODE_DENSE, min_similarity=None):
+    """
+    Returns (results, message): up to `top_k` ScoredChunks most relevant to `query`, best first
+    (see _rank_chunks for `mode`), and None or a message saying why the KB couldn't be searched.
+    Chunks less similar to the query than `min_similarity` (default settings.RETRIEVAL_MIN_SIMILARITY)
+    are left out, so results can be empty for an off-topic question.
+    nprobe (IVF) / ef_search (HNSW) trade latency for recall; defaults come from settings.
+    """
+    with metrics.chat_stage(metrics.STAGE_INDEX_LOAD):
+        index, store, error_message = _load_vector_store(index_name)
+    if error_message:
+        return [], error_message
 
-    query_vec = model.encode([query]).astype("float32")
+    if index is None or store is None or not len(store):
+        return [], "No data in knowledge base."
 
     if index.ntotal == 0:
-        return ["Knowledge base is empty."]
+        return [], "Knowledge base is empty."
+
+    params = get_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    ranked = _rank_chunks(
+        query, index_name, index, store, model, top_k, mode=mode, params=params, min_similarity=get_min_similarity(min_similarity),
+    )
+    return _scored_chunks(store, ranked), None
 
-    actual_top_k = min(top_k, index.ntotal)
-    D, I = index.search(query_vec, actual_top_k)
-    
-    # Ensure indices 'I' are valid before accessing 'texts'
-    results = [texts[i] for i in I[0] if i >= 0 and i < len(texts)]
 
-    return results if results else ["No relevant results found."]
+# --- search_similar_chunks (Modified to use _get_vector_store_paths) ---
+def search_similar_chunks(query, index_name, model, top_k=1, nprobe=None, ef_search=None, mode=MODE_DENSE, min_similarity=None):
+    """
+    Returns the texts of search_scored_chunks(), or a single message if there are none.
+    """
+    results, message = search_scored_chunks(
+        query, index_name, model, top_k=top_k, nprobe=nprobe, ef_search=ef_search, mode=mode, min_similarity=min_similarity,
+    )
+    if message:
+        return [message]
+    return [result.text for result in results] if results else [NO_RESULTS_MESSAGE]
 
 # --- delete_vector_store (Crucially fixed to use _get_vector_store_paths) ---
 def delete_vector_store(index_name: str):
-    """Deletes both FAISS index and chunk file from GCS or local disk based on storage mode."""
+    """Deletes the FAISS index, chunk file and keyword index from GCS or local disk based on storage mode."""
     use_gcs = getattr(settings, "USE_GCS", False)
-    faiss_file_path, pkl_file_path = _get_vector_store_paths(index_name, use_gcs)
+    faiss_file_path, chunks_file_path = _get_vector_store_paths(index_name, use_gcs)
+    _, legacy_chunks_path = _get_vector_store_paths(index_name, use_gcs, LEGACY_CHUNKS_EXT)
+    _, keyword_file_path = _get_vector_store_paths(index_name, use_gcs, KEYWORD_EXT)
+    get_index_cache().invalidate(index_name)
+    get_index_cache().invalidate(f"{index_name}{KEYWORD_EXT}")
 
     if use_gcs:
-        client = _get_gcs_client()
-        bucket_name = getattr(settings, "GS_BUCKET_NAME", None)
-        if not bucket_name:
+        if not getattr(settings, "GS_BUCKET_NAME", None):
             print("Error: GS_BUCKET_NAME not set for GCS operations. Cannot delete remote files.")
             return # Or raise an error to indicate critical failure
-        bucket = client.bucket(bucket_name)
+        storage = get_blob_storage()
 
         # The GCS paths are the full blob keys generated by _get_vector_store_paths
-        for blob_key in [str(faiss_file_path), str(pkl_file_path)]:
+        def delete_blob(blob_key):
             try:
-                blob = bucket.blob(blob_key)
-                if blob.exists(): # Check if blob exists before trying to delete
-                    blob.delete()
-                    print(f"Deleted GCS blob: gs://{bucket_name}/{blob_key}")
+                if storage.delete(blob_key):
+                    print(f"Deleted GCS blob: {storage.describe(blob_key)}")
                 else:
                     print(f"GCS blob not found (skipping deletion): {blob_key}")
             except Exception as e:
                 print(f"Failed to delete GCS blob {blob_key}: {e}")
                 # Log this error but don't stop the process if other file exists.
+
+        run_concurrently(*[
+            lambda blob_key=blob_key: delete_blob(blob_key)
+            for blob_key in [str(faiss_file_path), str(chunks_file_path), str(keyword_file_path), str(legacy_chunks_path)]
+        ])
     else:
         # Local paths are Path objects from _get_vector_store_paths
         parent_dir = faiss_file_path.parent # Get the directory Path object
         
-        for local_file_path in [faiss_file_path, pkl_file_path]:
+        # Stores saved before keyword search or the .chunks format don't have these
+        optional_files = [path for path in (keyword_file_path, legacy_chunks_path) if path.exists()]
+        for local_file_path in [faiss_file_path, chunks_file_path] + optional_files:
             if local_file_path.exists():
                 try:
                     os.remove(str(local_file_path)) # Convert Path object to string for os.remove
@@ -0,0 +1,152 @@
+# core/utils/vector/vector_store.py
+
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from core.utils.vector import vector_logic
+from core.utils.vector.chunk_store import DEFAULT_DOC_KEY
+from core.utils.vector.index_cache import get_index_cache
+from core.utils.vector.index_factory import get_index_type, get_metric, get_quantization
+from core.utils.vector.keyword_index import MODE_DENSE
+
+
+class VectorStore:
+    """
+    Where a KB's chunks and their vectors live. Ingestion and chat code go through this interface
+    (see get_vector_store()) so the deployment can choose the storage:
+
+    - "faiss": FAISS index + chunk file per KB on local disk or GCS (vector_logic.py)
+    - "faiss_sharded": many KBs per FAISS index, filtered by id range at search time (sharded_store.py)
+    - "pgvector": one table per embedding dimension in Postgres (pgvector_store.py)
+
+    Index names are the per-KB names used everywhere else ("kb_<id>"); documents within an index
+    are identified by doc_key (see ChunkStore).
+    """
+
+    name = None
+
+    def build(self, index_name, chunks, model, progress_callback=None, index_type=None, doc_key=DEFAULT_DOC_KEY, quantization=None):
+        """
+        Encodes `chunks` and replaces whatever `index_name` held. `quantization` ("none", "fp16",
+        "sq8", "pq"; see index_factory.QUANTIZATIONS) is a hint backends may not support.
+        Returns {"vectors", "index_type"}, or None if there was nothing to store.
+        """
+        raise NotImplementedError
+
+    def upsert_document(self, index_name, doc_key, chunks, model, progress_callback=None):
+        """
+        Adds or updates one document, re-encoding only new or changed chunks.
+        Returns {"vectors", "index_type", "added", "removed", "unchanged"}, or None if `chunks` is empty.
+        """
+        raise NotImplementedError
+
+    def remove_documents(self, index_name, doc_keys):
+        """Removes every chunk of the given documents. Returns the number of vectors removed."""
+        raise NotImplementedError
+
+    def list_documents(self, index_name):
+        raise NotImplementedError
+
+    def search_scored(self, query, index_name, model, top_k=1, mode=MODE_DENSE, min_similarity=None):
+        """
+        Returns (results, message): up to `top_k` vector_logic.ScoredChunk most relevant to `query`,
+        best first, and None or a message saying why the KB couldn't be searched.
+        mode: "dense" (embedding similarity), "keyword" (BM25) or "hybrid" (both, rank-fused).
+        Chunks with a cosine similarity below `min_similarity` (default settings.RETRIEVAL_MIN_SIMILARITY)
+        are left out.
+        """
+        raise NotImplementedError
+
+    def search(self, query, index_name, model, top_k=1, mode=MODE_DENSE, min_similarity=None):
+        """Returns the texts of search_scored() (or a single message if there are none)."""
+        results, message = self.search_scored(query, index_name, model, top_k=top_k, mode=mode, min_similarity=min_similarity)
+        if message:
+            return [message]
+        return [result.text for result in results] if results else [vector_logic.NO_RESULTS_MESSAGE]
+
+    def delete(self, index_name):
+        raise NotImplementedError
+
+    def stats(self, index_name=None):
+        raise NotImplementedError
+
+
+class FaissFileVectorStore(VectorStore):
+    """FAISS index + chunk file pair per KB, on local disk or GCS depending on settings.USE_GCS."""
+
+    name = "faiss"
+
+    def build(self, index_name, chunks, model, progress_callback=None, index_type=None, doc_key=DEFAULT_DOC_KEY, quantization=None):
+        return vector_logic.embed_and_store(
+            chunks, index_name, model, progress_callback=progress_callback, index_type=index_type, doc_key=doc_key, quantization=quantization,
+        )
+
+    def upsert_document(self, index_name, doc_key, chunks, model, progress_callback=None):
+        return vector_logic.upsert_document(index_name, doc_key, chunks, model, progress_callback=progress_callback)
+
+    def remove_documents(self, index_name, doc_keys):
+        return vector_logic.remove_documents(index_name, doc_keys)
+
+    def list_documents(self, index_name):
+        return vector_logic.list_documents(index_name)
+
+    def search_scored(self, query, index_name, model, top_k=1, mode=MODE_DENSE, min_similarity=None):
+        return vector_logic.search_scored_chunks(query, index_name, model, top_k=top_k, mode=mode, min_similarity=min_similarity)
+
+    def delete(self, index_name):
+        vector_logic.delete_vector_store(index_name)
+
+    def stats(self, index_name=None):
+        stats = {"backend": self.name, "storage": "gcs" if getattr(settings, "USE_GCS", False) else "local"}
+        if index_name is None:
+            stats["index_cache"] = get_index_cache().stats()
+            return stats
+        index, store, error_message = vector_logic._load_vector_store(index_name)
+        if error_message:
+            stats["error"] = error_message
+            return stats
+        stats.update({
+            "vectors": int(index.ntotal),
+            "index_type": get_index_type(index),
+            "quantization": get_quantization(index),
+            "metric": get_metric(index),
+            "documents": store.document_keys(),
+        })
+        return stats
+
+
+def _pgvector_store():
+    from core.utils.vector.pgvector_store import PgVectorStore
+    return PgVectorStore(using=getattr(settings, "PGVECTOR_DB_ALIAS", "default"))
+
+
+def _sharded_store():
+    from core.utils.vector.sharded_store import DEFAULT_SHARD_COUNT, ShardedFaissVectorStore
+    return ShardedFaissVectorStore(shard_count=getattr(settings, "VECTOR_SHARD_COUNT", DEFAULT_SHARD_COUNT))
+
+
+BACKENDS = {
+    "faiss": FaissFileVectorStore,
+    "faiss_sharded": _sharded_store,
+    "pgvector": _pgvector_store,
+}
+
+_vector_store = None
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store():
+    """
+    Returns the process-wide VectorStore selected by settings.VECTOR_STORE_BACKEND:
+    "faiss" (default), "faiss_sharded", "pgvector", or a dotted path to a VectorStore subclass.
+    """
+    global _vector_store
+    if _vector_store is None:
+        with _vector_store_lock:
+            if _vector_store is None:
+                backend_name = getattr(settings, "VECTOR_STORE_BACKEND", "faiss") or "faiss"
+                backend_factory = BACKENDS.get(backend_name) or import_string(backend_name)
+                _vector_store = backend_factory()
+    return _vector_store
@@ -0,0 +1,56 @@
+# gunicorn.conf.py
+# Picked up automatically by gunicorn when started from this directory (see Dockerfile CMD).
+
+import os
+import subprocess
+import sys
+
+_embedding_server = None
+
+
+def on_starting(server):
+    # With EMBEDDING_SERVER_AUTOSTART, the master starts the embedding server (manage.py embedding_server) before
+    # forking workers, so they share its model instead of each loading one. Workers encode in-process if it dies.
+    global _embedding_server
+    socket_path = os.environ.get("EMBEDDING_SERVER_SOCKET", "")
+    if not socket_path or os.environ.get("EMBEDDING_SERVER_AUTOSTART", "False").lower() not in ("true", "1", "yes"):
+        return
+
+    from core.utils.embeddings.embedding_server import wait_for_server
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    _embedding_server = subprocess.Popen([sys.executable, os.path.join(base_dir, "manage.py"), "embedding_server"], cwd=base_dir)
+    if wait_for_server(socket_path, timeout=float(os.environ.get("EMBEDDING_SERVER_START_TIMEOUT", "180"))):
+        server.log.info(f"Embedding server (pid {_embedding_server.pid}) listening on {socket_path}")
+    else:
+        server.log.warning("Embedding server didn't come up; workers will load their own models")
+
+
+def on_exit(server):
+    if _embedding_server is not None and _embedding_server.poll() is None:
+        _embedding_server.terminate()
+        try:
+            _embedding_server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _embedding_server.kill()
+
+
+def post_worker_init(worker):
+    # Runs inside each worker right after the Django app is loaded, before it accepts requests.
+    # Pre-warming here means the first chat request on a fresh worker doesn't pay the model load.
+    if os.environ.get("EMBEDDING_PRELOAD", "False").lower() not in ("true", "1", "yes"):
+        return
+
+    from core.utils.embeddings.embedding_service import preload_embedding_models, get_model_stats
+    from core.utils.embeddings.reranker import get_reranker
+
+    preload_embedding_models()
+    get_reranker() # Loads the cross-encoder too when RERANK_MODEL_NAME is set
+    worker.log.info(f"Embedding models pre-warmed in worker {worker.pid}: {get_model_stats()['models']}")
+
+
+def child_exit(server, worker):
+    # Lets /metrics drop a dead worker's live samples when PROMETHEUS_MULTIPROC_DIR is set
+    from core.utils.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -13,6 +13,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const typingIndicator = document.getElementById('typing-indicator');
 
     const apiUrl = chatContainer.dataset.apiUrl;
+    const streamUrl = chatContainer.dataset.streamUrl; // Server-Sent Events endpoint; tokens show up as they're generated
     const csrfToken = chatContainer.dataset.csrfToken;
     const historyKey = 'chatHistory_' + apiUrl;
 
@@ -33,7 +34,10 @@ document.addEventListener('DOMContentLoaded', function() {
 
         chatBox.appendChild(messageElement);
         chatBox.scrollTop = chatBox.scrollHeight;
+        saveToHistory(messageElement);
+    }
 
+    function saveToHistory(messageElement) {
         let history = JSON.parse(sessionStorage.getItem(historyKey)) || [];
         history.push(messageElement.outerHTML);
         sessionStorage.setItem(historyKey, JSON.stringify(history));
@@ -46,6 +50,80 @@ document.addEventListener('DOMContentLoaded', function() {
         return '<span class="timestamp">' + timeString + '</span>';
     }
 
+    // --- Streamed reply (SSE over fetch, since EventSource can't POST) ---
+    // Returns false if nothing was received, so the caller can fall back to the JSON endpoint.
+    async function streamReply(msg) {
+        const response = await fetch(streamUrl, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+                'X-CSRFToken': csrfToken
+            },
+            body: JSON.stringify({ message: msg })
+        });
+        if (!response.ok || !response.body) {
+            return false;
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let botElement = null;
+        let textElement = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            const events = buffer.split('\n\n');
+            buffer = events.pop(); // Keep any incomplete event for the next read
+            for (const rawEvent of events) {
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(function(line) {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                const payload = data ? JSON.parse(data) : {};
+
+                if (eventName === 'error') {
+                    if (botElement) {
+                        // Part of the answer is already on screen; don't ask again
+                        saveToHistory(botElement);
+                        return true;
+                    }
+                    throw new Error(payload.error || 'Stream error.');
+                }
+                if (eventName === 'done') {
+                    if (botElement) {
+                        botElement.insertAdjacentHTML('beforeend', getTimestamp());
+                        saveToHistory(botElement);
+                    }
+                    return botElement !== null;
+                }
+                if (payload.token) {
+                    if (!botElement) {
+                        typingIndicator.style.display = 'none';
+                        botElement = document.createElement('div');
+                        botElement.className = 'msg bot-msg';
+                        botElement.innerHTML = '<strong>Bot:</strong> ';
+                        textElement = document.createElement('span');
+                        botElement.appendChild(textElement);
+                        chatBox.appendChild(botElement);
+                    }
+                    textElement.textContent += payload.token;
+                    chatBox.scrollTop = chatBox.scrollHeight;
+                }
+            }
+        }
+        if (botElement) {
+            saveToHistory(botElement);
+        }
+        return botElement !== null;
+    }
+
     // --- Form Submission Handler ---
     form.addEventListener('submit', async function(e) {
         e.preventDefault(); // Stop page reload
@@ -61,6 +139,14 @@ document.addEventListener('DOMContentLoaded', function() {
         typingIndicator.style.display = 'block';
 
         try {
+            if (streamUrl) {
+                try {
+                    if (await streamReply(msg)) return;
+                } catch (streamError) {
+                    console.warn('Streaming failed, falling back to the JSON endpoint:', streamError);
+                }
+            }
+
             const response = await fetch(apiUrl, {
                 method: 'POST',
                 headers: {
@@ -0,0 +1,52 @@
+// statics/js/kb_status.js
+// Polls the embedding job status for every element with class "kb-status" that is still queued/running,
+// updates its ".kb-status-text" and reloads the page once the job is done (so the widget buttons show up).
+
+document.addEventListener('DOMContentLoaded', function() {
+    const POLL_INTERVAL_MS = 2000;
+    const ACTIVE_STATUSES = ['queued', 'running'];
+    const STATUS_LABELS = {
+        not_started: 'Not started',
+        queued: 'Queued',
+        running: 'Running',
+        failed: 'Failed',
+        done: 'Done'
+    };
+
+    const elements = Array.from(document.querySelectorAll('.kb-status'))
+        .filter(function(el) { return ACTIVE_STATUSES.includes(el.dataset.status); });
+
+    elements.forEach(function(el) {
+        const textEl = el.querySelector('.kb-status-text');
+
+        async function poll() {
+            try {
+                const response = await fetch(el.dataset.statusUrl, { headers: { 'Accept': 'application/json' } });
+                if (!response.ok) {
+                    throw new Error('Status request failed.');
+                }
+                const data = await response.json();
+
+                if (data.status === 'done') {
+                    window.location.reload();
+                    return;
+                }
+                if (data.status === 'failed') {
+                    // Don't reload: on the proceed page that would queue the job again
+                    if (textEl) {
+                        textEl.textContent = 'Failed: ' + data.error;
+                    }
+                    return;
+                }
+                if (textEl) {
+                    textEl.textContent = (STATUS_LABELS[data.status] || data.status) + ' (' + data.progress + '%)';
+                }
+            } catch (error) {
+                console.error('KB status error:', error);
+            }
+            setTimeout(poll, POLL_INTERVAL_MS);
+        }
+
+        setTimeout(poll, POLL_INTERVAL_MS);
+    });
+});
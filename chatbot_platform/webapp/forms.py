@@ -1,18 +1,40 @@
 from django import forms
-from core.models import KnowledgeBase
+from core.models import KnowledgeBase, KnowledgeBaseDocument
+
+def validate_document_file(file):
+    """Shared by the KB and document upload forms: only text, PDF and Word files can be embedded."""
+    if file:
+        # Allow only certain file extensions (optional)
+        allowed_extensions = ['.txt', '.pdf', '.docx', '.doc']
+        extension = file.name.split('.')[-1].lower()
+        if f'.{extension}' not in allowed_extensions:
+            raise forms.ValidationError("Unsupported file format. Only .txt, .pdf, .docx  files are allowed.")
+
 
 class KnowledgeBaseForm(forms.ModelForm):
     class Meta:
         model = KnowledgeBase
-        fields = ['title', 'file']
+        fields = ['title', 'file', 'vector_quantization']
+        labels = {'vector_quantization': 'Index storage'}
 
-    # Optionally, you can add custom validation to restrict file types, size, etc.
     def clean_file(self):
         file = self.cleaned_data.get('file')
-        if file:
-            # Allow only certain file extensions (optional)
-            allowed_extensions = ['.txt', '.pdf', '.docx', '.doc']
-            extension = file.name.split('.')[-1].lower()
-            if f'.{extension}' not in allowed_extensions:
-                raise forms.ValidationError("Unsupported file format. Only .txt, .pdf, .docx  files are allowed.")
+        validate_document_file(file)
         return file
+
+
+class KnowledgeBaseDocumentForm(forms.ModelForm):
+    class Meta:
+        model = KnowledgeBaseDocument
+        fields = ['file']
+
+    def clean_file(self):
+        file = self.cleaned_data.get('file')
+        validate_document_file(file)
+        return file
+
+
+class RetrievalModeForm(forms.ModelForm):
+    class Meta:
+        model = KnowledgeBase
+        fields = ['retrieval_mode']
@@ -10,8 +10,18 @@ urlpatterns = [
     path("logout/", views.logout_view, name="logout"),
     path("dashboard/", views.dashboard_view, name="dashboard"),
     path("proceed/<int:kb_id>/", views.proceed_view, name="proceed"),
+    path("proceed/<int:kb_id>/documents/", views.add_kb_document_view, name="add_kb_document"),
+    path("proceed/<int:kb_id>/documents/<int:document_id>/delete/", views.delete_kb_document_view, name="delete_kb_document"),
+    path("proceed/<int:kb_id>/retrieval-mode/", views.update_retrieval_mode_view, name="update_retrieval_mode"),
+    path("api/kb/<int:kb_id>/status/", views.kb_status_api_view, name="kb_status_api"),
     path("chat/<slug:widget_slug>/", views.chat_widget_view, name="chat_widget"),
     path("api/chat/<str:widget_slug>/", views.chat_api_view, name="chat_api"),
+    path("api/chat/<str:widget_slug>/stream/", views.chat_stream_api_view, name="chat_stream_api"),
     path("get-widget-api/<slug:widget_slug>/", views.get_widget_api_view, name="get_widget_api"),
     path("delete/<int:kb_id>/", views.delete_kb_view, name="delete_kb"),
+    path("api/embedding-stats/", views.embedding_stats_view, name="embedding_stats"),
+    path("api/vector-cache-stats/", views.vector_cache_stats_view, name="vector_cache_stats"),
+    path("api/response-cache-stats/", views.response_cache_stats_view, name="response_cache_stats"),
+    path("api/vector-store-stats/", views.vector_store_stats_view, name="vector_store_stats"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
@@ -1,23 +1,87 @@
 # webapp/utils/genai_llm.py
 
+import threading
+import time
 import traceback
 import google.generativeai as genai
 from django.conf import settings
 
+from core.utils import metrics
+
 genai.configure(api_key=settings.GOOGLE_GENAI_API_KEY)
 
-def generate_genai_response(context, question):
-    prompt = f"""You are a helpful assistant. Only answer based on the context below.
+GENAI_MODEL_NAME = "gemini-2.0-flash-001"
+GENAI_ERROR_MESSAGE = "Sorry, I couldn't get a response from the GenAI model."
+
+_async_client = None
+_async_client_lock = threading.Lock()
+
+
+def build_prompt(context, question):
+    return f"""You are a helpful assistant. Only answer based on the context below.
 Context:
 {context}
 
 Question: {question}
 Answer:"""
+
+
+def generate_genai_response(context, question):
+    with metrics.chat_stage(metrics.STAGE_PROMPT_BUILD):
+        prompt = build_prompt(context, question)
     try:
-        model = genai.GenerativeModel("gemini-2.0-flash-001")
-        response = model.generate_content(prompt)
+        model = genai.GenerativeModel(getattr(settings, "GENAI_MODEL_NAME", GENAI_MODEL_NAME))
+        with metrics.chat_stage(metrics.STAGE_LLM):
+            response = model.generate_content(prompt)
         return response.text.strip()
     except Exception as e:
         print("[GENAI ERROR]", e)
         traceback.print_exc()
-        return "Sorry, I couldn't get a response from the GenAI model."
+        return GENAI_ERROR_MESSAGE
+
+
+def _get_async_client():
+    # google-genai client (the async-capable SDK); one per process, its HTTP connections are reused
+    global _async_client
+    if _async_client is None:
+        with _async_client_lock:
+            if _async_client is None:
+                from google import genai as google_genai
+                _async_client = google_genai.Client(api_key=settings.GOOGLE_GENAI_API_KEY)
+    return _async_client
+
+
+async def stream_genai_response(context, question):
+    """
+    Async generator yielding the answer text as Gemini streams it back.
+    Awaits the network instead of blocking a worker thread, so one process can serve many chats.
+    On failure yields GENAI_ERROR_MESSAGE (after any text already sent).
+    Time to the first token and to the end of the stream are recorded as the llm_first_token / llm stages.
+    """
+    with metrics.chat_stage(metrics.STAGE_PROMPT_BUILD):
+        prompt = build_prompt(context, question)
+    started = time.perf_counter()
+    first_token = True
+    try:
+        client = _get_async_client()
+        stream = await client.aio.models.generate_content_stream(
+            model=getattr(settings, "GENAI_MODEL_NAME", GENAI_MODEL_NAME),
+            contents=prompt,
+        )
+        async for chunk in stream:
+            if chunk.text:
+                if first_token:
+                    metrics.observe_chat_stage(metrics.STAGE_LLM_FIRST_TOKEN, time.perf_counter() - started)
+                    first_token = False
+                yield chunk.text
+        metrics.observe_chat_stage(metrics.STAGE_LLM, time.perf_counter() - started)
+    except Exception as e:
+        print("[GENAI ERROR]", e)
+        traceback.print_exc()
+        yield GENAI_ERROR_MESSAGE
+
+
+async def agenerate_genai_response(context, question):
+    """Non-streaming async variant of generate_genai_response."""
+    parts = [text async for text in stream_genai_response(context, question)]
+    return "".join(parts).strip()
@@ -1,30 +1,45 @@
 #webapp/views.py
 
 import os
+import hmac
 import json
 import uuid
 import logging
 import shutil
 import tempfile
+import time
+from collections import deque
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-
-from webapp.forms import KnowledgeBaseForm
-from core.models import KnowledgeBase
-from core.utils.file_reader import extract_text_from_file
-from core.utils.vector.vector_logic import delete_vector_store as remove_faiss_data, embed_and_store, search_similar_chunks
-from .utils.genai_llm import generate_genai_response
-from core.utils.embeddings.embedding_service import get_embedding_model
+from asgiref.sync import sync_to_async
+
+from webapp.forms import KnowledgeBaseDocumentForm, KnowledgeBaseForm, RetrievalModeForm
+from core.models import KnowledgeBase, KnowledgeBaseDocument
+from core.tasks import embed_knowledge_base
+from core.utils import metrics
+from core.utils.vector.vector_store import get_vector_store
+from core.utils.vector.disk_cache import get_disk_cache
+from core.utils.vector.index_cache import get_index_cache
+from core.utils.cache.response_cache import get_response_cache, invalidate_kb_responses
+from .utils.genai_llm import GENAI_ERROR_MESSAGE, agenerate_genai_response, generate_genai_response, stream_genai_response
+from core.utils.embeddings.embedding_server import get_embedding_client_stats
+from core.utils.embeddings.embedding_service import get_model_stats
+from core.utils.embeddings.query_encoder import get_query_encoder, get_query_encoder_stats
+from core.utils.embeddings.reranker import DEFAULT_CANDIDATES as DEFAULT_RERANK_CANDIDATES, get_reranker, get_reranker_stats
 
 logger = logging.getLogger(__name__)
 
+# Per-stage timings of the last few chat retrievals in this worker (see embedding_stats_view)
+_recent_retrievals = deque(maxlen=20)
+
 def signup_view(request):
     if request.method == "POST":
         username = request.POST["username"]
@@ -107,57 +122,162 @@ def home_view(request):
     return render(request, "webapp/home.html", {"form": form})
 
 
+def _queue_embedding(request, kb):
+    """Claims and queues the embedding job for `kb`. Returns False if it couldn't be queued."""
+    # Claim the job atomically so a double click can't queue it twice
+    claimed = KnowledgeBase.objects.filter(pk=kb.id).exclude(
+        embedding_status__in=[KnowledgeBase.EMBEDDING_QUEUED, KnowledgeBase.EMBEDDING_RUNNING]
+    ).update(
+        embedding_status=KnowledgeBase.EMBEDDING_QUEUED,
+        embedding_progress=0,
+        embedding_error="",
+        embedding_started_at=None,
+        embedding_finished_at=None,
+    )
+    if not claimed:
+        return True
+    try:
+        # Extraction, chunking, encoding and index upload all run in the Celery worker
+        result = embed_knowledge_base.delay(kb.id)
+        KnowledgeBase.objects.filter(pk=kb.id).update(embedding_task_id=result.id or "")
+        messages.success(request, "Embedding started. This page will update when it's ready.")
+    except Exception as e:
+        logger.error("Failed to queue embedding job", exc_info=True)
+        KnowledgeBase.objects.filter(pk=kb.id).update(
+            embedding_status=KnowledgeBase.EMBEDDING_FAILED,
+            embedding_error=f"Failed to queue embedding job: {e}",
+        )
+        messages.error(request, f"Failed to embed knowledge base: {e}")
+        return False
+    return True
+
+
 @login_required
 def proceed_view(request, kb_id):
     kb = get_object_or_404(KnowledgeBase, pk=kb_id, user=request.user) # Added user filter for security
 
-    if not kb.is_embedded:
-        print("[DEBUG] File storage backend:", kb.file.storage.__class__)
-        # Pass the FileField object (kb.file) directly to the extraction function
-        extracted_text = extract_text_from_file(kb.file) # <--- CRITICAL CHANGE
-
-        # Check if the extracted_text indicates an error during processing
-        if extracted_text.startswith("Error:"):
-            messages.error(request, extracted_text) # Display the specific error message
+    if kb.embedding_in_progress:
+        messages.info(request, "Knowledge base is being embedded. This page will update when it's ready.")
+    elif kb.is_embedded and not kb.documents.filter(is_embedded=False).exists():
+        messages.info(request, "Knowledge base is already embedded.")
+    else:
+        if not _queue_embedding(request, kb):
             return redirect("dashboard")
+        kb.refresh_from_db()
 
-        if not extracted_text.strip():
-            messages.warning(request, "The uploaded file has no readable text or is empty.")
-            return redirect("dashboard")
-        try:
-            model = get_embedding_model() # Ensure this is correctly defined and returns your Gemini model
-            vector_index_name = f"kb_{kb.id}"
+    return render(request, 'webapp/proceed.html', {
+        'knowledge_base': kb,
+        'documents': kb.documents.order_by('created_at'),
+        'document_form': KnowledgeBaseDocumentForm(),
+        'retrieval_mode_form': RetrievalModeForm(instance=kb),
+    })
 
-            # Assuming embed_and_store handles the entire process and doesn't need file paths anymore
-            embed_and_store([extracted_text], vector_index_name, model)
 
-            kb.widget_slug = str(uuid.uuid4())[:8] # Generates a unique 8-char slug
-            kb.is_embedded = True
-            kb.save()
-            messages.success(request, "Knowledge base embedded successfully!") # Add success message
-        except Exception as e:
-            messages.error(request, f"Failed to embed knowledge base: {e}")
-            return redirect("dashboard")
+@login_required
+@require_POST
+def add_kb_document_view(request, kb_id):
+    """Adds a file to a KB, or replaces the document with the same name, then syncs the index."""
+    kb = get_object_or_404(KnowledgeBase, pk=kb_id, user=request.user)
+    if kb.embedding_in_progress:
+        messages.error(request, "Please wait for the current embedding job to finish.")
+        return redirect("proceed", kb_id=kb.id)
+
+    form = KnowledgeBaseDocumentForm(request.POST, request.FILES)
+    if not form.is_valid():
+        for field, errors in form.errors.items():
+            for error in errors:
+                messages.error(request, f"Error in {field}: {error}")
+        return redirect("proceed", kb_id=kb.id)
+
+    upload = form.cleaned_data["file"]
+    document = kb.documents.filter(name=upload.name).first()
+    try:
+        if document:
+            # Same name: replace the file; only the chunks that changed get re-encoded
+            if document.file:
+                document.file.delete(save=False)
+            document.file = upload
+            document.is_embedded = False
+            document.save()
+        else:
+            document = kb.documents.create(name=upload.name, file=upload)
+    except Exception as e:
+        logger.error("caught unexpected exception during document upload", exc_info=True)
+        messages.error(request, f"Failed to upload file to storage: {e}")
+        return redirect("proceed", kb_id=kb.id)
+
+    _queue_embedding(request, kb)
+    return redirect("proceed", kb_id=kb.id)
+
+
+@login_required
+@require_POST
+def delete_kb_document_view(request, kb_id, document_id):
+    """Removes a document from a KB; its chunks are dropped from the index by the sync job."""
+    kb = get_object_or_404(KnowledgeBase, pk=kb_id, user=request.user)
+    document = get_object_or_404(KnowledgeBaseDocument, pk=document_id, knowledge_base=kb)
+    if kb.embedding_in_progress:
+        messages.error(request, "Please wait for the current embedding job to finish.")
+        return redirect("proceed", kb_id=kb.id)
+
+    if document.file and document.file.storage.exists(document.file.name):
+        document.file.delete(save=False)
+    document.delete()
+
+    if kb.is_embedded:
+        _queue_embedding(request, kb)
+    return redirect("proceed", kb_id=kb.id)
+
+
+@login_required
+@require_POST
+def update_retrieval_mode_view(request, kb_id):
+    """Switches how the KB's widget retrieves context: semantic, keyword or hybrid search."""
+    kb = get_object_or_404(KnowledgeBase, pk=kb_id, user=request.user)
+    form = RetrievalModeForm(request.POST, instance=kb)
+    if form.is_valid():
+        form.save()
+        messages.success(request, f"Search mode set to {kb.get_retrieval_mode_display()}.")
     else:
-        messages.info(request, "Knowledge base is already embedded.")
+        for field, errors in form.errors.items():
+            for error in errors:
+                messages.error(request, f"Error in {field}: {error}")
+    return redirect("proceed", kb_id=kb.id)
 
-    return render(request, 'webapp/proceed.html', {'knowledge_base': kb})
+
+@login_required
+def kb_status_api_view(request, kb_id):
+    # Polled by the dashboard/proceed pages while an embedding job is running
+    kb = get_object_or_404(KnowledgeBase, pk=kb_id, user=request.user)
+    return JsonResponse({
+        "id": kb.id,
+        "status": kb.embedding_status,
+        "progress": kb.embedding_progress,
+        "error": kb.embedding_error,
+        "duration_seconds": kb.embedding_duration_seconds,
+        "is_embedded": kb.is_embedded,
+        "widget_slug": kb.widget_slug,
+    })
 
 @login_required
 @require_POST
 def delete_kb_view(request, kb_id):
     kb = get_object_or_404(KnowledgeBase, id=kb_id, user=request.user)
 
-    # Delete file from media storage (local or GCS)
+    # Delete files from media storage (local or GCS)
+    for document in kb.documents.all():
+        if document.file and document.file.storage.exists(document.file.name):
+            document.file.delete(save=False)
     if kb.file and kb.file.storage.exists(kb.file.name):
         kb.file.delete()
         print(f"Deleted media file: {kb.file.name}")
 
     # Delete associated FAISS index and chunk files
     index_name = f"kb_{kb.id}"
-    remove_faiss_data(index_name)
+    get_vector_store().delete(index_name)
 
     # Delete from DB
+    invalidate_kb_responses(kb.id)
     kb.delete()
     return redirect("dashboard")
 
@@ -167,37 +287,183 @@ def chat_widget_view(request, widget_slug):
     return render(request, 'webapp/chat_widget.html', {'kb': kb})
 
 
-@csrf_exempt
-def chat_api_view(request, widget_slug):
-    if request.method == 'POST':
+def _retrieve_context(user_message, kb):
+    """
+    Returns (context, query_vector, cached_answer) for a chat message. cached_answer is set when
+    the response cache already has an answer for this question and context.
+    Blocking (query encoding + FAISS search + rerank + cache I/O); async views run it via sync_to_async.
+
+    With a rerank model configured (settings.RERANK_MODEL_NAME), RERANK_CANDIDATES chunks are
+    retrieved and the cross-encoder keeps the best CHAT_CONTEXT_CHUNKS of them, within RERANK_BUDGET_MS.
+    Chunks below RETRIEVAL_MIN_SIMILARITY never reach the reranker or the prompt.
+
+    Each stage is also exported as chatbot_chat_stage_seconds on /metrics (see core/utils/metrics.py).
+    """
+    index_name = f"kb_{kb.id}"
+    timings = {"kb_id": kb.id}
+    started = time.perf_counter()
+    # Batches this query with other requests' queries and caches repeated ones
+    with metrics.chat_stage(metrics.STAGE_MODEL_ACQUIRE):
+        query_encoder = get_query_encoder()
+    stage_started = time.perf_counter()
+    query_vector = query_encoder.encode_query(user_message)
+    metrics.observe_chat_stage(metrics.STAGE_QUERY_ENCODE, time.perf_counter() - stage_started)
+    timings["encode_ms"] = round(1000 * (time.perf_counter() - started), 2)
+
+    top_k = getattr(settings, "CHAT_CONTEXT_CHUNKS", 3)
+    reranker = get_reranker()
+    n_candidates = max(top_k, getattr(settings, "RERANK_CANDIDATES", DEFAULT_RERANK_CANDIDATES)) if reranker else top_k
+    stage_started = time.perf_counter()
+    results, message = get_vector_store().search_scored(user_message, index_name, query_encoder, top_k=n_candidates, mode=kb.retrieval_mode)
+    timings["search_ms"] = round(1000 * (time.perf_counter() - stage_started), 2)
+    timings["results"] = len(results)
+    if results and results[0].similarity is not None:
+        timings["top_similarity"] = round(results[0].similarity, 3)
+    texts = [result.text for result in results]
+    if reranker and len(texts) > 1:
+        texts, rerank_info = reranker.rerank(user_message, texts, top_k)
+        timings.update(rerank_info)
+        metrics.observe_chat_stage(metrics.STAGE_RERANK, rerank_info["rerank_ms"] / 1000)
+    context = "\n".join(texts[:top_k]) if texts else (message or "No relevant information found.")
+
+    stage_started = time.perf_counter()
+    response_cache = get_response_cache()
+    cached_answer = response_cache.get(kb, query_vector, context) if response_cache else None
+    finished = time.perf_counter()
+    metrics.observe_chat_stage(metrics.STAGE_RESPONSE_CACHE, finished - stage_started)
+    metrics.observe_chat_stage(metrics.STAGE_RETRIEVAL, finished - started)
+    timings["cache_ms"] = round(1000 * (finished - stage_started), 2)
+    timings["total_ms"] = round(1000 * (finished - started), 2)
+    _recent_retrievals.append(timings)
+    logger.debug(f"Retrieval timings: {timings}")
+    return context, query_vector, cached_answer
+
+
+def _cache_answer(kb, query_vector, context, answer):
+    response_cache = get_response_cache()
+    if response_cache and answer and GENAI_ERROR_MESSAGE not in answer:
+        response_cache.put(kb, query_vector, context, answer)
+
+
+# Retrieval runs in the thread pool rather than Django's single shared sync thread,
+# so concurrent chats don't queue behind each other
+_aretrieve_context = sync_to_async(_retrieve_context, thread_sensitive=False)
+_acache_answer = sync_to_async(_cache_answer, thread_sensitive=False)
+
+
+async def _parse_chat_request(request, widget_slug):
+    """Returns (kb, message, error JsonResponse) for the async chat endpoints."""
+    try:
         data = json.loads(request.body)
-        user_message = data.get('message', '')
+    except json.JSONDecodeError:
+        return None, None, JsonResponse({'error': 'Invalid request'}, status=400)
+    user_message = (data.get('message') or '').strip()
+    if not user_message:
+        return None, None, JsonResponse({'error': 'Message is required'}, status=400)
+
+    with metrics.chat_stage(metrics.STAGE_KB_LOOKUP):
+        kb = await KnowledgeBase.objects.filter(widget_slug=widget_slug).afirst()
+    if kb is None:
+        return None, None, JsonResponse({'error': 'Chatbot not found'}, status=404)
+    return kb, user_message, None
 
-        kb = get_object_or_404(KnowledgeBase, widget_slug=widget_slug)
-        model = get_embedding_model()
-        index_name = f"kb_{kb.id}"
 
-        results = search_similar_chunks(user_message, index_name, model, top_k=3)
-        context = "\n".join(results[:3]) if results else "No relevant information found."
+@csrf_exempt
+async def chat_api_view(request, widget_slug):
+    if request.method == 'POST':
+        kb, user_message, error_response = await _parse_chat_request(request, widget_slug)
+        if error_response:
+            return error_response
 
-        response = generate_genai_response(context, user_message)
+        try:
+            context, query_vector, cached_answer = await _aretrieve_context(user_message, kb)
+        except Exception:
+            metrics.CHAT_REQUESTS.labels("api", "error").inc()
+            raise
+        if cached_answer is not None:
+            metrics.CHAT_REQUESTS.labels("api", "cached").inc()
+            return JsonResponse({'response': cached_answer, 'cached': True})
+
+        response = await agenerate_genai_response(context, user_message)
+        await _acache_answer(kb, query_vector, context, response)
+        metrics.CHAT_REQUESTS.labels("api", "error" if response == GENAI_ERROR_MESSAGE else "answered").inc()
 
         return JsonResponse({'response': response})
 
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
+def _sse_event(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+
+@csrf_exempt
+async def chat_stream_api_view(request, widget_slug):
+    """
+    Same as chat_api_view, but streams the answer as Server-Sent Events while Gemini generates it:
+    `data: {"token": "..."}` per piece of text, then `event: done` (or `event: error`).
+    Needs an ASGI server (see Dockerfile) to stream without holding a worker thread.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    kb, user_message, error_response = await _parse_chat_request(request, widget_slug)
+    if error_response:
+        return error_response
+
+    async def events():
+        try:
+            context, query_vector, cached_answer = await _aretrieve_context(user_message, kb)
+        except Exception as e:
+            logger.error("Retrieval failed for streamed chat", exc_info=True)
+            metrics.CHAT_REQUESTS.labels("stream", "error").inc()
+            yield _sse_event({'error': str(e)}, event='error')
+            return
+        if cached_answer is not None:
+            metrics.CHAT_REQUESTS.labels("stream", "cached").inc()
+            yield _sse_event({'token': cached_answer})
+            yield _sse_event({'cached': True}, event='done')
+            return
+
+        parts = []
+        async for text in stream_genai_response(context, user_message):
+            parts.append(text)
+            yield _sse_event({'token': text})
+        yield _sse_event({}, event='done')
+        answer = "".join(parts).strip()
+        metrics.CHAT_REQUESTS.labels("stream", "error" if GENAI_ERROR_MESSAGE in answer else "answered").inc()
+        await _acache_answer(kb, query_vector, context, answer)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Don't let proxies buffer the stream
+    return response
+
+
 def chat_view(request, widget_slug):
-    kb = get_object_or_404(KnowledgeBase, widget_slug=widget_slug)
+    # Server-rendered chat page (no JS): same stage metrics as the API views, counted as endpoint "page"
+    with metrics.chat_stage(metrics.STAGE_KB_LOOKUP):
+        kb = get_object_or_404(KnowledgeBase, widget_slug=widget_slug)
     index_name = f"kb_{kb.id}"
     chat_history = []
 
     if request.method == "POST":
         user_query = request.POST.get("message", "")
-        retrieved_chunks = search_similar_chunks(user_query, index_name, get_embedding_model())
-        context = "\n".join(retrieved_chunks)
-
-        bot_response = generate_genai_response(context, user_query)
+        try:
+            started = time.perf_counter()
+            with metrics.chat_stage(metrics.STAGE_MODEL_ACQUIRE):
+                query_encoder = get_query_encoder()
+            # The store observes index_load / vector_search / keyword_search itself
+            retrieved_chunks = get_vector_store().search(user_query, index_name, query_encoder, mode=kb.retrieval_mode)
+            metrics.observe_chat_stage(metrics.STAGE_RETRIEVAL, time.perf_counter() - started)
+            context = "\n".join(retrieved_chunks)
+
+            bot_response = generate_genai_response(context, user_query)
+        except Exception:
+            metrics.CHAT_REQUESTS.labels("page", "error").inc()
+            raise
+        metrics.CHAT_REQUESTS.labels("page", "error" if bot_response == GENAI_ERROR_MESSAGE else "answered").inc()
 
         chat_history.append(("You", user_query))
         chat_history.append(("Bot", bot_response))
@@ -216,3 +482,56 @@ def get_widget_api_view(request, widget_slug):
     kb = get_object_or_404(KnowledgeBase, widget_slug=widget_slug, user=request.user)
     iframe_code = f'<iframe src="{request.build_absolute_uri(f"/chat/{kb.widget_slug}/")}" width="100%" height="500px" frameborder="0"></iframe>'
     return JsonResponse({"iframe_code": iframe_code})
+
+
+@staff_member_required
+def embedding_stats_view(request):
+    # Load time and memory usage of the embedding models loaded in this worker process,
+    # plus query micro-batching / cache counters, embedding server client counters, reranker counters
+    # and recent per-stage retrieval timings
+    stats = get_model_stats()
+    stats["query_encoders"] = get_query_encoder_stats()
+    stats["embedding_server"] = get_embedding_client_stats()
+    stats["reranker"] = get_reranker_stats()
+    stats["recent_retrievals"] = list(_recent_retrievals)
+    return JsonResponse(stats)
+
+
+@staff_member_required
+def vector_store_stats_view(request):
+    # Backend in use plus its totals, or one KB's (?kb_id=<id>)
+    kb_id = request.GET.get("kb_id")
+    index_name = f"kb_{int(kb_id)}" if kb_id and kb_id.isdigit() else None
+    return JsonResponse(get_vector_store().stats(index_name))
+
+
+@staff_member_required
+def response_cache_stats_view(request):
+    # Hit/miss counters of the chat answer cache in this worker process
+    response_cache = get_response_cache()
+    return JsonResponse(response_cache.stats() if response_cache else {"enabled": False})
+
+
+def metrics_view(request):
+    # Prometheus scrape endpoint: per-stage chat/ingestion histograms and request/job counters.
+    # Staff sessions, or a scraper sending "Authorization: Bearer <METRICS_TOKEN>".
+    if not metrics.metrics_enabled():
+        raise Http404("Metrics are disabled")
+    token = getattr(settings, "METRICS_TOKEN", "")
+    authorization = request.headers.get("Authorization", "")
+    authorized_by_token = bool(token) and hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+    if not authorized_by_token and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")
+    body, content_type = metrics.render_metrics()
+    return HttpResponse(body, content_type=content_type)
+
+
+@staff_member_required
+def vector_cache_stats_view(request):
+    # Hit/miss/eviction counters of the loaded-index cache in this worker process
+    stats = get_index_cache().stats()
+    disk_cache = get_disk_cache()
+    if disk_cache is not None and getattr(settings, "USE_GCS", False):
+        # The on-disk tier below it (shared by the workers on this machine)
+        stats["disk_cache"] = disk_cache.stats()
+    return JsonResponse(stats)